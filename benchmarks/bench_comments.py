@@ -0,0 +1,128 @@
+"""Benchmark the comment popup parser against the previous BeautifulSoup implementation.
+
+Run from the repository root:
+    python -m benchmarks.bench_comments [saved_page.html ...] [--comments 3000]
+
+Without saved pages a synthetic popup with the requested number of threads is generated.
+"""
+import argparse
+import json
+import random
+import time
+
+from bs4 import BeautifulSoup
+
+from comments import REACTION_CLASSES, parse_comments_html
+
+def legacy_extract_reactions(reaction_element):
+    reactions = []
+    for div in reaction_element.select('div.listreact > div.colreact'):
+        reaction_type = None
+        reaction_span = div.find('span', class_='spritecmt')
+        if reaction_span:
+            for class_name in reaction_span.get('class', []):
+                if class_name in REACTION_CLASSES:
+                    reaction_type = REACTION_CLASSES[class_name]
+                    break
+        count_span = div.find('span', class_='num')
+        count = count_span.text.strip() if count_span else '0'
+        if reaction_type:
+            reactions.append({'type': reaction_type, 'count': count})
+    return reactions
+
+def legacy_extract_comments(page_source):
+    # The parser crawl_page used before: whole page, html.parser, replies walked twice
+    soup = BeautifulSoup(page_source, 'html.parser')
+    comments = []
+    for comment_element in soup.find('div', class_='lstcommentpopup').find_all('li', class_='item-comment'):
+        replies = []
+        for reply_element in comment_element.find_all('li', class_='item-comment'):
+            reaction_element = reply_element.find('div', class_='wrapreact')
+            replies.append({
+                'commentId': reply_element['data-cmid'],
+                'author': reply_element.find('span', class_='name').text,
+                'text': reply_element.find('span', class_='contentcomment').text,
+                'date': reply_element.find('span', class_='timeago')['title'],
+                'reactions': legacy_extract_reactions(reaction_element) if reaction_element else [],
+            })
+        reaction_element = comment_element.find('div', class_='wrapreact')
+        comments.append({
+            'commentId': comment_element['data-cmid'],
+            'author': comment_element.find('span', class_='name').text,
+            'text': comment_element.find('span', class_='contentcomment').text,
+            'date': comment_element.find('span', class_='timeago')['title'],
+            'reactions': legacy_extract_reactions(reaction_element) if reaction_element else [],
+            'replies': replies,
+        })
+    return comments
+
+def comment_html(comment_id, rng, replies_html=""):
+    reactions = "".join(
+        f'<div class="colreact"><span class="spritecmt {css}"></span><span class="num">{rng.randint(1, 99)}</span></div>'
+        for css in rng.sample(sorted(REACTION_CLASSES), rng.randint(0, 3))
+    )
+    return (
+        f'<li class="item-comment" data-cmid="{comment_id}"><div class="boxcmt">'
+        f'<span class="name">Bạn đọc {comment_id}</span>'
+        f'<span class="contentcomment">Bình luận số {comment_id} về bài viết này, rất hay và bổ ích.</span>'
+        f'<span class="timeago" title="18/10/2024 10:{comment_id % 60:02d}">1 giờ trước</span>'
+        f'<div class="wrapreact"><div class="listreact">{reactions}</div></div></div>'
+        f'{replies_html}</li>'
+    )
+
+def synthetic_page(num_comments, seed=0):
+    rng = random.Random(seed)
+    items = []
+    next_id = 1
+    for _ in range(num_comments):
+        comment_id = next_id
+        next_id += 1
+        replies = []
+        for _ in range(rng.choice([0, 0, 0, 1, 2, 5])):
+            replies.append(comment_html(next_id, rng))
+            next_id += 1
+        replies_html = f'<ul class="lst-reply">{"".join(replies)}</ul>' if replies else ""
+        items.append(comment_html(comment_id, rng, replies_html))
+    filler = '<div class="detail-content"><p>' + "Nội dung bài viết. " * 2000 + '</p></div>'
+    return f'<html><body>{filler}<div class="lstcommentpopup"><ul>{"".join(items)}</ul></div></body></html>'
+
+def best_of(func, arg, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(arg)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark comment popup parsing")
+    parser.add_argument("pages", nargs="*", help="saved article pages with the comment popup open")
+    parser.add_argument("--comments", type=int, default=3000, help="threads in the synthetic page")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    pages = []
+    for path in args.pages:
+        with open(path, 'r', encoding='utf-8') as f:
+            pages.append((path, f.read()))
+    if not pages:
+        pages.append((f"synthetic-{args.comments}", synthetic_page(args.comments)))
+
+    results = []
+    for name, html in pages:
+        legacy_time, legacy = best_of(legacy_extract_comments, html, args.repeat)
+        new_time, new = best_of(parse_comments_html, html, args.repeat)
+        results.append({
+            'page': name,
+            'bytes': len(html.encode('utf-8')),
+            'threads': len(new),
+            'replies': sum(len(c['replies']) for c in new),
+            'legacy_top_level': len(legacy),
+            'legacy_seconds': round(legacy_time, 4),
+            'lxml_seconds': round(new_time, 4),
+            'speedup': round(legacy_time / new_time, 1) if new_time else None,
+        })
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""Benchmark crawler throughput offline, against a replay server instead of tuoitre.vn.
+
+Run from the repository root:
+    python -m benchmarks.bench_crawl [--archive crawl.warc.gz] [--categories 4] [--per-category 25]
+                                     [--workers 4] [--latency-ms 0] [--output bench.json]
+
+With --archive the crawl replays a recording made with "crawl.py --record"; without it a
+synthetic archive is generated from the same seed every time. The archive has a home page,
+category listings, timeline pages, articles, comment API pages and media. The crawl runs
+with plain HTTP only, without a browser, in a temporary directory. The report has
+articles/second, bytes/second, and the time and bytes spent in each stage, as JSON.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlencode, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import crawl
+from benchmarks.synthetic_corpus import CorpusGenerator
+from comments import COMMENT_API, PAGE_SIZE, CommentHarvester
+from corpus import CorpusWriter
+from crawl_state import CrawlState
+from downloader import MediaDownloader
+from frontier import Frontier
+from replay import ArchiveWriter, ReplayServer, archive_paths, replay_url
+from scheduler import RequestScheduler
+
+SITE = "https://tuoitre.vn/"
+CDN = "https://cdn.tuoitre.vn/"
+AUDIO_CDN = "https://tuoitre.mediacdn.vn/"
+CATEGORIES = [("Kinh doanh", "kinh-doanh"), ("Thời sự", "thoi-su"), ("Thế giới", "the-gioi"), ("Pháp luật", "phap-luat"),
+              ("Giáo dục", "giao-duc"), ("Sức khỏe", "suc-khoe"), ("Du lịch", "du-lich"), ("Công nghệ", "cong-nghe")]
+LISTING_PAGE_SIZE = 10
+
+def listing_html(items):
+    return "".join(
+        f'<div class="box-category-item"><a class="box-category-link-title" title="{title}" href="{href}">{title}</a>'
+        f'<div class="ico-data-type type-data-comment"><span class="value">{comments}</span></div></div>'
+        for title, href, comments in items
+    )
+
+def article_html(article, url, images, audio):
+    figures = "".join(
+        f'<figure class="VCSortableInPreviewMode" type="Photo"><img data-original="{image}" src="{image}"></figure>'
+        for image in images
+    )
+    paragraphs = "".join(f"<p>{paragraph}</p>" for paragraph in article["content"].split("\n"))
+    audio_player = f'<div class="audioplayer" data-file="{audio}"></div>' if audio else ""
+    return (
+        f'<html><head><meta itemprop="name" content="{article["title"]}"><link rel="canonical" href="{url}"></head>'
+        f'<body><h1 class="detail-title article-title">{article["title"]}</h1>{audio_player}'
+        f'<div class="detail-time">{article["date"]}</div><h2 class="detail-sapo">{article["title"]}.</h2>'
+        f'<div class="detail-content afcbc-body">{paragraphs}{figures}</div>'
+        f'<div class="detail-author-bot">{article["author"]}</div></body></html>'
+    )
+
+def comment_pages(rng, post_id, num_comments, wave):
+    """Comment API pages of one article; the harvester asks for pages in waves, so the last wave is padded."""
+    comments = [{
+        'id': int(post_id) * 1000 + i,
+        'sender_fullname': f"Bạn đọc {rng.randint(1, 9999)}",
+        'content': "Bài viết rất hay và bổ ích.",
+        'created_date': "2024-10-18T10:00:00",
+        'reactions': {'1': rng.randint(0, 30)},
+        'child_count': 0,
+        'child_comments': [],
+    } for i in range(num_comments)]
+    pages = []
+    num_pages = num_comments // PAGE_SIZE + 1
+    for page in range(1, -(-num_pages // wave) * wave + 1):
+        params = {'pageindex': page, 'pagesize': PAGE_SIZE, 'objId': post_id, 'objType': 1, 'sort': 2}
+        pages.append((f"{COMMENT_API}?{urlencode(params)}",
+                      {'Success': True, 'Data': json.dumps(comments[(page - 1) * PAGE_SIZE:page * PAGE_SIZE])}))
+    return pages
+
+def synthetic_archive(path, categories, per_category, seed=0, comment_workers=4, image_bytes=60000):
+    """Write a self-consistent copy of the parts of the site the crawler visits."""
+    rng = random.Random(seed)
+    generator = CorpusGenerator(seed)
+    archive = ArchiveWriter(path)
+    html = [("Content-Type", "text/html; charset=utf-8")]
+
+    menu = "".join(f'<li><a title="{name}" href="/{slug}">{name}</a></li>'
+                   for name, slug in [("Trang chủ", "")] + [(name, f"{slug}.htm") for name, slug in CATEGORIES[:categories]])
+    archive.record("GET", SITE, 200, "OK", html,
+                   f'<html><body><div class="header__nav-flex"><ul class="menu-nav">{menu}</ul></div></body></html>'.encode())
+
+    number = 0
+    for zone_id, (name, slug) in enumerate(CATEGORIES[:categories], 100):
+        items = []
+        for _ in range(per_category):
+            article = generator.article(number)
+            number += 1
+            post_id = article["postId"]
+            url = f"{SITE}{slug}/bai-viet-{post_id}.htm"
+            num_comments = rng.choice([0, 2, 5, 20, 60])
+            # The listing stops once 25 items are in and one has 20 comments
+            items.append((article["title"], url, num_comments))
+
+            images = [f"{CDN}{post_id}/image{i}.jpg" for i in range(1, rng.randint(1, 4) + 1)]
+            audio = f"{AUDIO_CDN}audio/{post_id}.mp3" if rng.random() < 0.3 else None
+            archive.record("GET", url, 200, "OK", html, article_html(article, url, images, audio).encode())
+            for media in images + ([audio] if audio else []):
+                kind = "audio/mpeg" if media.endswith(".mp3") else "image/jpeg"
+                archive.record("GET", media, 200, "OK", [("Content-Type", kind)],
+                               rng.randbytes(rng.randint(image_bytes // 2, image_bytes * 3 // 2)))
+            for page_url, page in comment_pages(rng, post_id, num_comments, comment_workers):
+                archive.record("GET", page_url, 200, "OK", [("Content-Type", "application/json; charset=utf-8")],
+                               json.dumps(page, ensure_ascii=False).encode())
+
+        first = listing_html(items[:LISTING_PAGE_SIZE])
+        archive.record("GET", f"{SITE}{slug}.htm", 200, "OK", html,
+                       f'<html><body><div data-url="/timeline/{zone_id}/trang-1.htm">{first}</div></body></html>'.encode())
+        for page, start in enumerate(range(LISTING_PAGE_SIZE, len(items) + LISTING_PAGE_SIZE, LISTING_PAGE_SIZE), 2):
+            archive.record("GET", f"{SITE}timeline/{zone_id}/trang-{page}.htm", 200, "OK", html,
+                           listing_html(items[start:start + LISTING_PAGE_SIZE]).encode())
+    archive.close()
+    return number
+
+class StageTimer:
+    """Requests, bytes and seconds per crawl stage, shared by every crawler thread."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = defaultdict(lambda: {'count': 0, 'bytes': 0, 'seconds': 0.0})
+
+    def add(self, stage, seconds, size=0):
+        with self.lock:
+            totals = self.stages[stage]
+            totals['count'] += 1
+            totals['bytes'] += size
+            totals['seconds'] += seconds
+
+    def report(self):
+        return {stage: dict(totals, seconds=round(totals['seconds'], 3)) for stage, totals in sorted(self.stages.items())}
+
+def request_stage(url):
+    path = urlsplit(url).path
+    if path.startswith("/~id."):
+        return "comments"
+    if path.startswith("/~"):
+        return "media"
+    if path == "/":
+        return "home"
+    # Article URLs end in the post id, listings have none
+    if crawl.extract_post_id(path) is None or path.startswith("/timeline/"):
+        return "listing"
+    return "article"
+
+class TimedSession(requests.Session):
+    def __init__(self, timer, pool_size):
+        super().__init__()
+        self.timer = timer
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+        self.headers.update({"User-Agent": crawl.USER_AGENT})
+
+    def request(self, method, url, *args, **kwargs):
+        start = time.perf_counter()
+        response = super().request(method, url, *args, **kwargs)
+        # Streamed media are timed to their headers, their size comes from Content-Length
+        size = len(response.content) if not kwargs.get("stream") else int(response.headers.get("Content-Length", 0))
+        self.timer.add("http_" + request_stage(url), time.perf_counter() - start, size)
+        return response
+
+class TimedCrawlPool(crawl.CrawlPool):
+    def __init__(self, timer, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.timer = timer
+
+    def run_task(self, driver, item):
+        start = time.perf_counter()
+        try:
+            return super().run_task(driver, item)
+        finally:
+            self.timer.add("task_" + item["kind"], time.perf_counter() - start)
+
+def run_crawl(archive_path, args):
+    timer = StageTimer()
+    server = ReplayServer(archive_path, latency=args.latency_ms / 1000)
+    base_url = server.start()
+    crawl.use_base_url(base_url)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            session = TimedSession(timer, max(10, args.workers * 2 + args.media_workers))
+            # The replay server stands in for every host, without the live site's rate limits
+            scheduler = RequestScheduler(session, host_limits={urlsplit(base_url).hostname: (1e6, 1e6, 64)})
+            frontier = Frontier(os.path.join(directory, "frontier.db"))
+            frontier.add("home", crawl.URL)
+            state = CrawlState(os.path.join(directory, "state.db"), force=True)
+            downloader = MediaDownloader(scheduler, max_workers=args.media_workers)
+            harvester = CommentHarvester(scheduler, max_workers=args.comment_workers,
+                                         api_url=replay_url(COMMENT_API, base_url))
+            corpus = CorpusWriter(os.path.join(directory, "corpus"), batch_size=16)
+            pool = TimedCrawlPool(timer, args.workers, frontier, scheduler, downloader, state, harvester, corpus,
+                                  use_browser=False)
+
+            quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+            start = time.perf_counter()
+            with quiet:
+                pool.run()
+                crawl_seconds = time.perf_counter() - start
+                downloader.close()
+                harvester.close()
+            seconds = time.perf_counter() - start
+            corpus.close()
+            state.close()
+            frontier.close()
+            scheduler.close()
+        finally:
+            os.chdir(cwd)
+    server.shutdown()
+    server.server_close()
+
+    return {
+        'articles': pool.items_saved,
+        'articles_failed': pool.items_failed,
+        'seconds': round(seconds, 3),
+        'crawl_seconds': round(crawl_seconds, 3),
+        'media_drain_seconds': round(seconds - crawl_seconds, 3),
+        'articles_per_second': round(pool.items_saved / seconds, 2) if seconds else None,
+        'bytes_served': server.stats['bytes'],
+        'bytes_per_second': round(server.stats['bytes'] / seconds) if seconds else None,
+        'responses': server.stats['responses'],
+        'archive_misses': server.stats['misses'],
+        'stages': timer.report(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the crawler against a replayed archive")
+    parser.add_argument("--archive", default=None, help="archive recorded with crawl.py --record")
+    parser.add_argument("--categories", type=int, default=4, help="categories in the synthetic archive")
+    parser.add_argument("--per-category", type=int, default=25, help="articles per synthetic category")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--media-workers", type=int, default=8)
+    parser.add_argument("--comment-workers", type=int, default=4)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="delay the replay server adds to every response")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true", help="show the crawler's own output")
+    parser.add_argument("--output", default=None, help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        archive_path = args.archive
+        if archive_path is None:
+            archive_path = os.path.join(directory, "synthetic.warc.gz")
+            synthetic_archive(archive_path, min(args.categories, len(CATEGORIES)), args.per_category, args.seed,
+                              args.comment_workers)
+        runs = [run_crawl(archive_path, args) for _ in range(args.repeat)]
+        archive_bytes = sum(os.path.getsize(path) for path in archive_paths(archive_path))
+
+    report = {
+        'benchmark': 'crawl',
+        'archive': args.archive or 'synthetic',
+        'archive_bytes': archive_bytes,
+        'workers': args.workers,
+        'latency_ms': args.latency_ms,
+        # The fastest run is the least disturbed by the machine
+        'best': max(runs, key=lambda run: run['articles_per_second'] or 0),
+        'runs': runs,
+    }
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+
+if __name__ == "__main__":
+    main()
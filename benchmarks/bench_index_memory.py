@@ -0,0 +1,104 @@
+"""Benchmark index memory: the dict-of-dicts layout against CompactIndex and the on-disk form.
+
+Run from the repository root:
+    python -m benchmarks.bench_index_memory [--docs 20000] [--vocabulary 50000]
+
+Documents are synthetic token sequences over a Zipf-like vocabulary, so pyvi is not needed
+and only the index structures are measured. The dict layout holds term frequencies only,
+CompactIndex also keeps every token position.
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+
+from index_store import CompactIndex, IndexFile, write_index
+
+def synthetic_documents(num_docs, vocabulary, seed=0):
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(vocabulary)]
+    terms = [f"từ_{rank}" for rank in range(vocabulary)]
+    for number in range(num_docs):
+        term_positions = defaultdict(list)
+        for position, term in enumerate(rng.choices(terms, weights, k=rng.randint(50, 400))):
+            term_positions[term].append(position)
+        yield f"{number}.json", dict(term_positions)
+
+def dict_layout(documents):
+    index = defaultdict(dict)
+    for doc_id, term_positions in documents:
+        for term, positions in term_positions.items():
+            index[term][doc_id] = len(positions)
+    return index
+
+def compact_layout(documents):
+    index = CompactIndex()
+    for doc_id, term_positions in documents:
+        index.add_document(doc_id, term_positions)
+    return index
+
+def measure(build, documents):
+    tracemalloc.start()
+    start = time.perf_counter()
+    index = build(documents)
+    seconds = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return index, size, seconds
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark index memory layouts")
+    parser.add_argument("--docs", type=int, default=20000)
+    parser.add_argument("--vocabulary", type=int, default=50000)
+    args = parser.parse_args()
+
+    documents = list(synthetic_documents(args.docs, args.vocabulary))
+    num_postings = sum(len(term_positions) for _, term_positions in documents)
+
+    dict_index, dict_bytes, dict_seconds = measure(dict_layout, documents)
+    compact_index, compact_bytes, compact_seconds = measure(compact_layout, documents)
+
+    # On disk: variable-byte gaps and frequencies against plain uint32 doc numbers and frequencies;
+    # positions are reported separately
+    doc_ids = [doc_id for doc_id, _ in documents]
+    terms = sorted(dict_index, key=lambda term: term.encode("utf-8"))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "index.bin")
+        write_index(path, terms, dict_index, compact_index.positions, doc_ids, {}, {},
+                    {doc_id: {} for doc_id in doc_ids}, {}, {})
+        index_file = IndexFile(path)
+        posting_bytes = int(index_file.posting_doc_bytes.nbytes + index_file.posting_tf_bytes.nbytes)
+        position_bytes = int(index_file.posting_pos_bytes.nbytes)
+        file_bytes = os.path.getsize(path)
+        index_file.close()
+
+    # Decoding cost of the most common term's posting list
+    top_term = max(dict_index, key=lambda term: len(dict_index[term]))
+    start = time.perf_counter()
+    for _ in range(20):
+        compact_index[top_term]
+    decode_ms = (time.perf_counter() - start) / 20 * 1000
+
+    print(json.dumps({
+        'docs': args.docs,
+        'terms': len(dict_index),
+        'postings': num_postings,
+        'dict_mb': round(dict_bytes / 2 ** 20, 1),
+        'compact_mb': round(compact_bytes / 2 ** 20, 1),
+        'memory_ratio': round(dict_bytes / compact_bytes, 1),
+        'dict_build_seconds': round(dict_seconds, 2),
+        'compact_build_seconds': round(compact_seconds, 2),
+        'uint32_postings_mb': round(num_postings * 8 / 2 ** 20, 1),
+        'varbyte_postings_mb': round(posting_bytes / 2 ** 20, 1),
+        'varbyte_positions_mb': round(position_bytes / 2 ** 20, 1),
+        'index_file_mb': round(file_bytes / 2 ** 20, 1),
+        'top_term_df': len(dict_index[top_term]),
+        'top_term_decode_ms': round(decode_ms, 2),
+    }, indent=2, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
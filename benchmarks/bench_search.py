@@ -0,0 +1,209 @@
+"""Benchmark indexing and search on synthetic corpora of several sizes.
+
+Run from the repository root:
+    python -m benchmarks.bench_search [--docs 1000 100000 1000000] [--queries 200] [--output bench.json]
+
+For each size a corpus from benchmarks.synthetic_corpus is written to a temporary directory
+(or --keep-dir), then build_index, save_index and load_index are timed, and every query mix
+is run against the loaded index as a server would hold it. Each size runs in its own process,
+so peak RSS is per size. Results are printed, and written to --output, as JSON.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+# Peak RSS comes from getrusage where there is one (Unix), else from psutil (peak working set on Windows)
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from benchmarks.synthetic_corpus import DATE_SPAN_DAYS, START_DATE, CorpusGenerator, load_words, write_corpus
+from search import SearchEngine
+
+STOPWORDS = "vietnamese-stopwords-dash.txt"
+MIXES = ("common", "mixed", "rare", "long", "phrase", "date_range", "repeated")
+RESULT_POLL = 5  # seconds between checks that a size's process is still alive
+
+def peak_rss_mb(children=False):
+    """Peak RSS of this process, or of its finished children, in MB; None where it cannot be measured."""
+    if resource is not None:
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / (2 ** 20 if sys.platform == "darwin" else 2 ** 10), 1)
+    if psutil is not None and not children:
+        peak = getattr(psutil.Process().memory_info(), "peak_wset", None)
+        return None if peak is None else round(peak / 2 ** 20, 1)
+    return None
+
+def query_mixes(generator, num_queries, seed=0):
+    """name -> [(query, date_from, date_to)] for every mix, the same for every run with one seed."""
+    rng = random.Random(seed)
+    words = generator.words
+    # Phrases are cut from generated articles so that they occur in the corpus
+    phrases = []
+    for number in range(num_queries):
+        content = generator.article(number)["content"].split(".")[0].lower().split()
+        start = rng.randrange(max(len(content) - 2, 1))
+        phrases.append(" ".join(content[start:start + 2]))
+
+    mixes = {
+        'common': [" ".join(rng.sample(words[:20], 2)) for _ in range(num_queries)],
+        'mixed': [" ".join(generator.word(rng) for _ in range(rng.randint(3, 5))) for _ in range(num_queries)],
+        'rare': [" ".join(rng.sample(words[-50:], 2)) for _ in range(num_queries)],
+        'long': [" ".join(generator.word(rng) for _ in range(rng.randint(10, 15))) for _ in range(num_queries)],
+        'phrase': [f'"{phrase}" {generator.word(rng)}' for phrase in phrases],
+    }
+    mixes = {name: [(query, None, None) for query in queries] for name, queries in mixes.items()}
+    # The mixed queries again, each restricted to a 30 day window
+    windows = [START_DATE + timedelta(days=rng.randrange(DATE_SPAN_DAYS - 30)) for _ in range(num_queries)]
+    mixes['date_range'] = [(query, date_from, date_from + timedelta(days=30))
+                           for (query, _, _), date_from in zip(mixes['mixed'], windows)]
+    # A few hot queries asked over and over, answered from the result cache after the first time
+    hot = mixes['mixed'][:10]
+    mixes['repeated'] = [hot[i % len(hot)] for i in range(num_queries)]
+    return mixes
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(int(fraction * len(sorted_values)), len(sorted_values) - 1)]
+
+def time_queries(engine, queries, top_k):
+    latencies = []
+    start = time.perf_counter()
+    for query, date_from, date_to in queries:
+        query_start = time.perf_counter()
+        engine.search(query, top_k, 0.3, date_from, date_to)
+        latencies.append((time.perf_counter() - query_start) * 1000)
+    seconds = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'queries': len(queries),
+        'p50_ms': round(percentile(latencies, 0.5), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'max_ms': round(latencies[-1], 3),
+        'qps': round(len(queries) / seconds, 1) if seconds else None,
+    }
+
+def run_size(num_docs, args):
+    directory = args.keep_dir and os.path.join(args.keep_dir, f"docs-{num_docs}")
+    cleanup = directory is None
+    if cleanup:
+        directory = tempfile.mkdtemp(prefix=f"bench-search-{num_docs}-")
+    words = load_words(args.words) if args.words else None
+    try:
+        report = {'docs': num_docs, 'layout': args.layout}
+        data_directory = os.path.join(directory, "data")
+        if not os.path.isdir(data_directory):
+            start = time.perf_counter()
+            write_corpus(data_directory, num_docs, args.layout, args.seed, words)
+            report['generate_seconds'] = round(time.perf_counter() - start, 2)
+
+        engine = SearchEngine(data_directory, STOPWORDS, workers=args.workers)
+        start = time.perf_counter()
+        engine.build_index()
+        report['build_seconds'] = round(time.perf_counter() - start, 2)
+        report['build_docs_per_second'] = round(num_docs / report['build_seconds'], 1) if report['build_seconds'] else None
+        report['terms'] = len(engine.index)
+
+        index_path = os.path.join(directory, "index.bin")
+        start = time.perf_counter()
+        engine.save_index(index_path)
+        report['save_seconds'] = round(time.perf_counter() - start, 2)
+        report['index_bytes'] = os.path.getsize(index_path)
+        report['peak_rss_mb_build'] = peak_rss_mb()
+        engine.tokenizer.close()
+        engine.documents.close()
+        del engine
+
+        # Startup as the GUI or the search server would do it, then the first (cold) query
+        start = time.perf_counter()
+        engine = SearchEngine(data_directory, STOPWORDS)
+        engine.load_index(index_path)
+        report['load_seconds'] = round(time.perf_counter() - start, 3)
+        start = time.perf_counter()
+        engine.search("giá vàng hà nội", args.top_k)
+        report['first_query_ms'] = round((time.perf_counter() - start) * 1000, 3)
+
+        mixes = query_mixes(CorpusGenerator(args.seed, words), min(args.queries, num_docs), args.seed)
+        report['search'] = {name: time_queries(engine, mixes[name], args.top_k) for name in MIXES}
+        report['peak_rss_mb'] = peak_rss_mb()
+        report['peak_rss_mb_tokenizers'] = peak_rss_mb(children=True)
+        engine.close_index_file()
+        return report
+    finally:
+        if cleanup:
+            shutil.rmtree(directory, ignore_errors=True)
+
+def run_size_in_child(num_docs, args, results):
+    try:
+        results.put(run_size(num_docs, args))
+    except Exception as e:
+        results.put({'docs': num_docs, 'error': f"{type(e).__name__}: {e}"})
+        raise
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark indexing and search on synthetic corpora")
+    parser.add_argument("--docs", type=int, nargs="+", default=[1000])
+    parser.add_argument("--layout", choices=("json", "corpus"), default="json")
+    parser.add_argument("--queries", type=int, default=200, help="queries per mix")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=None, help="tokenizer processes for build_index")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--words", default=None, help="word list for the corpus, one word per line")
+    parser.add_argument("--keep-dir", default=None, help="keep corpora and indexes here and reuse them")
+    parser.add_argument("--output", default=None, help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    sizes = []
+    for num_docs in args.docs:
+        # A fresh process per size, so that peak RSS is not carried over from the previous one
+        results = multiprocessing.Queue()
+        process = multiprocessing.Process(target=run_size_in_child, args=(num_docs, args, results))
+        process.start()
+        report = None
+        while report is None:
+            try:
+                report = results.get(timeout=RESULT_POLL)
+            except queue.Empty:
+                if process.is_alive():
+                    continue
+                # The report may have been sent just before the process exited
+                try:
+                    report = results.get(timeout=1)
+                except queue.Empty:
+                    # Killed without reporting, e.g. by the OOM killer on the largest sizes
+                    report = {'docs': num_docs, 'error': f"benchmark process exited with code {process.exitcode}"}
+        process.join()
+        sizes.append(report)
+
+    report = {
+        'benchmark': 'search',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'seed': args.seed,
+        'sizes': sizes,
+    }
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Generate a synthetic Vietnamese news corpus in the crawler's NewsItem schema.
+
+Run from the repository root:
+    python -m benchmarks.synthetic_corpus OUTPUT_DIR [--docs 1000] [--layout json|corpus] [--words words.txt]
+
+Text mixes news vocabulary, drawn with Zipf-like frequencies, with the bundled stop words
+at roughly the rate they occur in real articles. With --layout json every article is an
+OUTPUT_DIR/<postId>.json file like the crawler's --json-files output; with --layout corpus
+the articles go to compressed JSONL shards in OUTPUT_DIR/corpus. The same seed always
+produces the same corpus.
+"""
+import argparse
+import json
+import os
+import random
+from datetime import datetime, timedelta
+
+from corpus import CorpusWriter
+
+STOPWORDS_FILE = "vietnamese-stopwords.txt"
+NEWS_WORDS = """
+kinh tế, xã hội, giáo dục, y tế, thể thao, bóng đá, thời sự, pháp luật, chính phủ, thủ tướng,
+quốc hội, bộ trưởng, thành phố, hà nội, sài gòn, đà nẵng, giao thông, tai nạn, cảnh sát, điều tra,
+doanh nghiệp, ngân hàng, lãi suất, giá vàng, chứng khoán, bất động sản, nhà ở, du lịch, văn hóa,
+nghệ thuật, âm nhạc, điện ảnh, học sinh, sinh viên, giáo viên, trường học, bệnh viện, bác sĩ,
+bệnh nhân, dịch bệnh, vắc xin, môi trường, khí hậu, mưa lũ, bão, nông dân, nông nghiệp, xuất khẩu,
+nhập khẩu, công nghệ, điện thoại, internet, mạng xã hội, an ninh, quốc phòng, biển đông, hợp tác,
+đầu tư, dự án, ngân sách, thuế, lao động, việc làm, tiền lương, hưu trí, bảo hiểm, xe máy, ô tô,
+đường sắt, sân bay, hàng không, cao tốc, cây cầu, con đường, khu vực, người dân, chính quyền,
+địa phương, tỉnh, huyện, phường, quận, thị trường, giá cả, xăng dầu, điện, nước sạch, thực phẩm,
+an toàn, vệ sinh, trẻ em, phụ nữ, gia đình, cộng đồng, tình nguyện, từ thiện, lễ hội, tết,
+mùa xuân, mùa hè, thế giới, mỹ, trung quốc, nhật bản, hàn quốc, châu âu, nga, bầu cử, tổng thống,
+chiến tranh, hòa bình, đội tuyển, huấn luyện viên, cầu thủ, trận đấu, chiến thắng, thất bại,
+giải đấu, vô địch, huy chương, marathon, khởi nghiệp, sáng tạo, trí tuệ nhân tạo, dữ liệu,
+phần mềm, điện tử, năng lượng, điện mặt trời, khai thác, khoáng sản, rừng, biển, dòng sông,
+đất đai, quy hoạch, xây dựng, nhà máy, sản xuất, tiêu dùng, bán lẻ, siêu thị, chợ, thương mại,
+hải quan, buôn lậu, ma túy, lừa đảo, tội phạm, tòa án, xét xử, bị cáo, luật sư, hiến pháp,
+nghị định, thông tư, chính sách, cải cách, hành chính, cán bộ, công chức, tham nhũng, kỷ luật,
+đại biểu, cử tri, báo chí, truyền hình, phóng viên, bạn đọc, tuổi trẻ, thanh niên, chiến sĩ,
+bộ đội, biên giới, hải đảo, ngư dân, tàu cá, cứu hộ, cứu nạn, hỏa hoạn, động đất, sạt lở, hạn hán,
+xâm nhập mặn, lúa, cà phê, cao su, thủy sản, tôm, cá tra, trái cây, sầu riêng, thanh long, gạo,
+tăng trưởng, lạm phát, tỉ giá, đô la, tiền đồng, hội nghị, diễn đàn, ký kết, thỏa thuận, đối tác
+"""
+CATEGORIES = ["thoi-su", "the-gioi", "phap-luat", "kinh-doanh", "xe", "nhip-song-tre", "van-hoa",
+              "giai-tri", "the-thao", "giao-duc", "suc-khoe", "du-lich", "cong-nghe"]
+START_DATE = datetime(2023, 1, 1)
+DATE_SPAN_DAYS = 730
+STOPWORD_RATE = 0.35  # share of the words in a sentence that are stop words
+
+def load_words(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+def news_words():
+    return [word.strip() for word in NEWS_WORDS.replace("\n", " ").split(",") if word.strip()]
+
+class CorpusGenerator:
+    """Deterministic stream of NewsItem dicts; articles depend only on the seed and their number."""
+
+    def __init__(self, seed=0, words=None, stopwords=None):
+        self.seed = seed
+        self.words = words or news_words()
+        self.stopwords = stopwords if stopwords is not None else load_words(STOPWORDS_FILE)
+        # Zipf-like: the r-th most common word is r times rarer than the most common one
+        self.cumulative = []
+        total = 0.0
+        for rank in range(len(self.words)):
+            total += 1 / (rank + 1)
+            self.cumulative.append(total)
+
+    def word(self, rng):
+        return rng.choices(self.words, cum_weights=self.cumulative)[0]
+
+    def sentence(self, rng, length):
+        words = [rng.choice(self.stopwords) if self.stopwords and rng.random() < STOPWORD_RATE else self.word(rng)
+                 for _ in range(length)]
+        text = " ".join(words)
+        return text[:1].upper() + text[1:] + "."
+
+    def article(self, number):
+        rng = random.Random(f"{self.seed}:{number}")
+        post_id = str(20240000000000 + number)
+        date = START_DATE + timedelta(minutes=rng.randrange(DATE_SPAN_DAYS * 24 * 60))
+        paragraphs = [" ".join(self.sentence(rng, rng.randint(8, 25)) for _ in range(rng.randint(2, 5)))
+                      for _ in range(rng.randint(2, 6))]
+        comments = [{
+            'commentId': f"{post_id}{i}",
+            'author': f"Bạn đọc {rng.randint(1, 99999)}",
+            'text': self.sentence(rng, rng.randint(5, 20)),
+            'date': (date + timedelta(hours=rng.randint(1, 48))).strftime("%d/%m/%Y %H:%M"),
+            'reactions': [],
+            'replies': [],
+        } for i in range(rng.choice([0, 0, 0, 1, 2, 5]))]
+        category = rng.choice(CATEGORIES)
+        return {
+            "postId": post_id,
+            "title": self.sentence(rng, rng.randint(6, 14))[:-1],
+            "content": "\n".join(paragraphs),
+            "author": f"Phóng viên {rng.randint(1, 500)}",
+            "date": date.strftime("%d/%m/%Y %H:%M GMT+7"),
+            "category": category,
+            "url": f"https://tuoitre.vn/{category}/bai-viet-{post_id}.htm",
+            "audio_podcast": None,
+            "comments": comments,
+        }
+
+    def articles(self, num_docs):
+        for number in range(num_docs):
+            yield self.article(number)
+
+def write_corpus(directory, num_docs, layout="json", seed=0, words=None):
+    """Write num_docs articles under directory and return the directory to index."""
+    generator = CorpusGenerator(seed, words)
+    os.makedirs(directory, exist_ok=True)
+    if layout == "corpus":
+        with CorpusWriter(os.path.join(directory, "corpus"), prefix="synthetic") as writer:
+            for article in generator.articles(num_docs):
+                writer.append(article)
+    else:
+        for article in generator.articles(num_docs):
+            with open(os.path.join(directory, f"{article['postId']}.json"), "w", encoding="utf-8") as f:
+                json.dump(article, f, ensure_ascii=False)
+    return directory
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic Vietnamese news corpus")
+    parser.add_argument("output")
+    parser.add_argument("--docs", type=int, default=1000)
+    parser.add_argument("--layout", choices=("json", "corpus"), default="json")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--words", default=None, help="word list, one word per line, instead of the built-in one")
+    args = parser.parse_args()
+    write_corpus(args.output, args.docs, args.layout, args.seed, load_words(args.words) if args.words else None)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import lxml.etree
+import lxml.html
+import requests
+
+# CONSTANTS
+# JSON endpoint behind the site's comment widget, one page of comments or replies per call.
+# It answers {"Success": true, "Data": "<JSON-encoded list of comments>"}; each comment has
+# id, sender_fullname, content, created_date, reactions ({reaction id: count}), child_count
+# and its first replies in child_comments.
+COMMENT_API = "https://id.tuoitre.vn/api/getlist-comment.api"
+COMMENT_FIELDS = ('id', 'sender_fullname', 'content', 'created_date')
+PAGE_SIZE = 50
+MAX_PAGES = 200
+
+# Reaction ids used by the comment API, named like the CSS classes of the popup
+REACTION_IDS = {
+    '1': 'like',
+    '2': 'heart',
+    '3': 'laugh',
+    '4': 'sad',
+    '5': 'surprised',
+    '6': 'angry',
+}
+
+# CSS classes of the popup's reaction icons
+REACTION_CLASSES = {
+    'icolikereact': 'like',
+    'icoheartreact': 'heart',
+    'icolaughreact': 'laugh',
+    'icosadreact': 'sad',
+    'icosurprisedreact': 'surprised',
+    'icoanggyreact': 'angry',
+}
+
+# Reaction cells anywhere under a comment's wrapreact, like the CSS selector div.listreact > div.colreact
+COLREACT_XPATH = lxml.etree.XPath(
+    ".//div[contains(concat(' ', normalize-space(@class), ' '), ' listreact ')]"
+    "/div[contains(concat(' ', normalize-space(@class), ' '), ' colreact ')]"
+)
+
+def classes_of(element):
+    return (element.get('class') or '').split()
+
+def is_comment(element):
+    return element.tag == 'li' and 'item-comment' in classes_of(element)
+
+def parse_reactions_html(wrapreact):
+    reactions = []
+    for colreact in COLREACT_XPATH(wrapreact):
+        reaction_type = None
+        count = '0'
+        for span in colreact.iter('span'):
+            span_classes = classes_of(span)
+            if reaction_type is None and 'spritecmt' in span_classes:
+                reaction_type = next((REACTION_CLASSES[c] for c in span_classes if c in REACTION_CLASSES), None)
+            elif 'num' in span_classes:
+                count = span.text_content().strip()
+                break
+        if reaction_type:
+            reactions.append({
+                'type': reaction_type,
+                'count': count
+            })
+    return reactions
+
+def parse_comment_html(li, replies):
+    """Read one comment in a single walk, nested comments are appended to replies."""
+    comment = {
+        'commentId': li.get('data-cmid'),
+        'author': None,
+        'text': None,
+        'date': None,
+        'reactions': [],
+    }
+    stack = list(reversed(li))
+    while stack:
+        element = stack.pop()
+        if not isinstance(element.tag, str):
+            continue
+        if is_comment(element):
+            # Reserve the slot first so deeper replies stay in document order
+            replies.append(None)
+            index = len(replies) - 1
+            replies[index] = parse_comment_html(element, replies)
+            continue
+
+        element_classes = classes_of(element)
+        if element.tag == 'span':
+            if comment['author'] is None and 'name' in element_classes:
+                comment['author'] = element.text_content()
+            elif comment['text'] is None and 'contentcomment' in element_classes:
+                comment['text'] = element.text_content()
+            elif comment['date'] is None and 'timeago' in element_classes:
+                comment['date'] = element.get('title')
+        elif element.tag == 'div' and 'wrapreact' in element_classes and not comment['reactions']:
+            comment['reactions'] = parse_reactions_html(element)
+            continue
+        stack.extend(reversed(element))
+    return comment
+
+def parse_comments_html(html):
+    """Parse the comment popup HTML into comments with their replies, replies are not repeated at the top level."""
+    root = lxml.html.fromstring(html)
+    if 'lstcommentpopup' in classes_of(root):
+        container = root
+    else:
+        containers = root.find_class('lstcommentpopup')
+        if not containers:
+            return []
+        container = containers[0]
+
+    comments = []
+    stack = list(reversed(container))
+    while stack:
+        element = stack.pop()
+        if not isinstance(element.tag, str):
+            continue
+        if is_comment(element):
+            # Replies may be nested at any depth, they all belong to this thread
+            replies = []
+            comment = parse_comment_html(element, replies)
+            comment['replies'] = replies
+            comments.append(comment)
+            continue
+        stack.extend(reversed(element))
+    return comments
+
+def build_reactions(raw_reactions):
+    reactions = []
+    for reaction_id, count in (raw_reactions or {}).items():
+        reaction_type = REACTION_IDS.get(str(reaction_id))
+        if reaction_type and int(count) > 0:
+            reactions.append({
+                'type': reaction_type,
+                'count': str(count)
+            })
+    return reactions
+
+def build_comment(raw):
+    # Same shape as the comments parsed from the popup HTML
+    return {
+        'commentId': str(raw['id']),
+        'author': raw['sender_fullname'],
+        'text': raw['content'],
+        'date': raw['created_date'],
+        'reactions': build_reactions(raw.get('reactions')),
+    }
+
+def parse_comment_page(data):
+    """The comments of one API response; raises ValueError if it is not shaped like a comment page."""
+    if not isinstance(data, dict) or not data.get('Success') or not isinstance(data.get('Data'), str):
+        raise ValueError(f"unexpected comment API response {str(data)[:100]!r}")
+    comments = json.loads(data['Data']) if data['Data'].strip() else []
+    if not isinstance(comments, list):
+        raise ValueError(f"unexpected comment list {data['Data'][:100]!r}")
+    for raw in comments:
+        missing = [name for name in COMMENT_FIELDS if not isinstance(raw, dict) or name not in raw]
+        if missing:
+            raise ValueError(f"comment without {', '.join(missing)} in the API response")
+        for reply in raw.get('child_comments') or []:
+            if not isinstance(reply, dict) or any(name not in reply for name in COMMENT_FIELDS):
+                raise ValueError("reply without the expected fields in the API response")
+    return comments
+
+class CommentHarvester:
+    """Fetch complete comment threads of an article from the comment API, several pages at a time."""
+
+    def __init__(self, scheduler, max_workers=4, page_size=PAGE_SIZE, api_url=COMMENT_API):
+        self.scheduler = scheduler
+        self.page_size = page_size
+        self.api_url = api_url
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="comments")
+
+    def fetch_page(self, post_id, page, parent_id=None):
+        params = {
+            'pageindex': page,
+            'pagesize': self.page_size,
+            'objId': post_id,
+            'objType': 1,
+            'sort': 2,
+        }
+        if parent_id is not None:
+            params['parentid'] = parent_id
+        response = self.scheduler.get(self.api_url, params=params)
+        if response.status_code != 200:
+            raise requests.HTTPError(f"Status code {response.status_code} for comment page {page} of {post_id}")
+        return parse_comment_page(response.json())
+
+    def fetch_all_pages(self, post_id, parent_id=None):
+        # Fetch waves of pages concurrently until a wave comes back short
+        items = []
+        page = 1
+        while page <= MAX_PAGES:
+            pages = range(page, min(page + self.max_workers, MAX_PAGES + 1))
+            results = list(self.executor.map(lambda p: self.fetch_page(post_id, p, parent_id), pages))
+            for result in results:
+                items.extend(result)
+            if any(len(result) < self.page_size for result in results):
+                break
+            page += len(pages)
+        return items
+
+    def fetch_reply_pages(self, post_id, parent_id):
+        # Runs inside the pool, so it pages sequentially instead of submitting nested work
+        replies = []
+        for page in range(1, MAX_PAGES + 1):
+            result = self.fetch_page(post_id, page, parent_id)
+            replies.extend(result)
+            if len(result) < self.page_size:
+                break
+        return replies
+
+    def harvest(self, post_id):
+        """Return the full comment list of post_id, or None if the API could not be read."""
+        try:
+            raw_comments = self.fetch_all_pages(post_id)
+
+            # The first replies come inline, longer threads are paged separately and in parallel
+            long_threads = [
+                raw for raw in raw_comments
+                if int(raw.get('child_count') or 0) > len(raw.get('child_comments') or [])
+            ]
+            thread_ids = [raw['id'] for raw in long_threads]
+            paged_replies = dict(zip(
+                thread_ids,
+                self.executor.map(lambda parent_id: self.fetch_reply_pages(post_id, parent_id), thread_ids),
+            ))
+        except (requests.RequestException, ValueError) as e:
+            print(f"Error harvesting comments of {post_id}: {str(e)}")
+            return None
+
+        comments = []
+        seen = set()
+        for raw in raw_comments:
+            comment = build_comment(raw)
+            if comment['commentId'] in seen:
+                continue
+            seen.add(comment['commentId'])
+            replies = paged_replies.get(raw['id'], raw.get('child_comments') or [])
+            comment['replies'] = [build_comment(reply) for reply in replies]
+            comments.append(comment)
+        print(f"Total comments found: {len(comments)}")
+        return comments
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+def test_parse_comments_html():
+    """Parse a popup whose reaction list sits deeper than directly under wrapreact."""
+    html = (
+        '<div class="lstcommentpopup"><ul>'
+        '<li class="item-comment" data-cmid="1"><span class="name">An</span>'
+        '<span class="contentcomment">Hay quá</span><span class="timeago" title="05/03/2024 09:00"></span>'
+        '<div class="wrapreact"><div class="reactbox"><div class="listreact show">'
+        '<div class="colreact"><span class="spritecmt icolikereact"></span><span class="num">3</span></div>'
+        '<div class="colreact"><span class="spritecmt icosadreact"></span><span class="num">1</span></div>'
+        '</div></div></div>'
+        '<ul><li class="item-comment" data-cmid="2"><span class="name">Bình</span>'
+        '<span class="contentcomment">Đồng ý</span><span class="timeago" title="05/03/2024 09:30"></span>'
+        '<div class="wrapreact"><div class="listreact"><div class="colreact">'
+        '<span class="spritecmt icoheartreact"></span><span class="num">2</span></div></div></div></li></ul>'
+        '</li></ul></div>'
+    )
+    comments = parse_comments_html(html)
+    assert len(comments) == 1
+    assert comments[0]['reactions'] == [{'type': 'like', 'count': '3'}, {'type': 'sad', 'count': '1'}]
+    assert [reply['commentId'] for reply in comments[0]['replies']] == ['2']
+    assert comments[0]['replies'][0]['reactions'] == [{'type': 'heart', 'count': '2'}]
+    print("Comment popup parsing OK")
+
+def test_comment_harvester():
+    """Harvest paged comments and replies, and give up with None on responses of another shape."""
+    def raw_comment(comment_id, child_count=0, child_comments=()):
+        return {'id': comment_id, 'sender_fullname': f"Bạn đọc {comment_id}", 'content': f"Bình luận {comment_id}",
+                'created_date': "2024-03-05T08:15:00", 'reactions': {'1': comment_id % 3, '2': 1},
+                'child_count': child_count, 'child_comments': list(child_comments)}
+
+    class PageScheduler:
+        # Answers the API's query params from a dict of (parentid, pageindex) -> payload, pages past the end are empty
+        def __init__(self, pages):
+            self.pages = pages
+
+        def get(self, url, params=None):
+            response = requests.Response()
+            payload = self.pages.get((params.get('parentid'), params['pageindex']), page([]))
+            response.status_code = 200
+            response._content = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            return response
+
+    def page(comments):
+        return {'Success': True, 'Data': json.dumps(comments, ensure_ascii=False)}
+
+    top = [raw_comment(i) for i in range(1, 4)] + [raw_comment(4, 3, [raw_comment(40)])]
+    pages = {(None, 1): page(top[:2]), (None, 2): page(top[2:]),
+             (4, 1): page([raw_comment(40), raw_comment(41)]), (4, 2): page([raw_comment(42)])}
+    harvester = CommentHarvester(PageScheduler(pages), max_workers=2, page_size=2)
+    try:
+        comments = harvester.harvest("20240305081500123")
+        assert [comment['commentId'] for comment in comments] == ['1', '2', '3', '4']
+        assert comments[0]['author'] == "Bạn đọc 1" and comments[0]['text'] == "Bình luận 1"
+        assert comments[0]['reactions'] == [{'type': 'like', 'count': '1'}, {'type': 'heart', 'count': '1'}]
+        assert [reply['commentId'] for reply in comments[3]['replies']] == ['40', '41', '42']
+
+        # An empty answer is a page without comments, an answer of another shape is an error
+        empty = CommentHarvester(PageScheduler({}))
+        assert empty.harvest("1") == []
+        empty.close()
+        for payload in ({'data': []}, {'Success': False, 'Data': ''}, page([{'id': 1, 'text': 'x'}]), None):
+            broken = CommentHarvester(PageScheduler({(None, 1): payload}))
+            assert broken.harvest("1") is None, payload
+            broken.close()
+    finally:
+        harvester.close()
+
+    print("Comment harvester OK")
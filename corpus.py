@@ -0,0 +1,350 @@
+import argparse
+import glob
+import gzip
+import json
+import os
+import socket
+import threading
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# CONSTANTS
+CORPUS_DIR = os.path.join("data", "corpus")
+SHARD_SIZE = 256 * 1024 * 1024
+BATCH_SIZE = 64
+EXTENSIONS = {None: ".jsonl", "gzip": ".jsonl.gz", "zstd": ".jsonl.zst"}
+INDEX_EXTENSION = ".idx"
+
+def compressor_for(compression):
+    if compression is None:
+        return lambda data: data
+    if compression == "gzip":
+        return lambda data: gzip.compress(data, compresslevel=6)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd compression needs the zstandard package")
+        return zstandard.ZstdCompressor(level=3).compress
+    raise ValueError(f"Unknown compression: {compression}")
+
+def decompress(shard_name, data):
+    if shard_name.endswith(".gz"):
+        return gzip.decompress(data)
+    if shard_name.endswith(".zst"):
+        if zstandard is None:
+            raise ValueError("reading zstd shards needs the zstandard package")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+def is_corpus(directory):
+    return bool(glob.glob(os.path.join(directory, "*" + INDEX_EXTENSION)))
+
+class CorpusWriter:
+    """Append articles to rotating JSONL shards, one compressed block per batch.
+
+    Every block is a complete gzip member or zstd frame, so a reader can seek to it
+    and decompress it alone. The sidecar index maps postId to (shard, block, line).
+    Shards are append-only: a comment refresh appends a new version of the article and
+    the old one stays behind until compact() rewrites the corpus.
+    """
+
+    def __init__(self, directory=CORPUS_DIR, compression="gzip", shard_size=SHARD_SIZE,
+                 batch_size=BATCH_SIZE, prefix=None):
+        if compression == "zstd" and zstandard is None:
+            print("zstandard is not installed, writing gzip shards instead")
+            compression = "gzip"
+        if not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.compression = compression
+        self.compress = compressor_for(compression)
+        self.extension = EXTENSIONS[compression]
+        self.shard_size = shard_size
+        self.batch_size = batch_size
+        # One prefix per writing process, so several crawlers can share the directory
+        self.prefix = prefix or f"part-{socket.gethostname()}-{os.getpid()}"
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.shard_number = len(glob.glob(os.path.join(directory, f"{self.prefix}-*{self.extension}")))
+        self.shard_name = None
+        self.next_shard()
+        self.index_file = open(os.path.join(directory, self.prefix + INDEX_EXTENSION), "a", encoding="utf-8")
+        self.reader = CorpusReader(directory)
+
+    def next_shard(self):
+        self.shard_number += 1
+        self.shard_name = f"{self.prefix}-{self.shard_number:05d}{self.extension}"
+
+    def append(self, record):
+        line = json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n"
+        with self.lock:
+            self.buffer.append((str(record.get("postId")), line))
+            if len(self.buffer) >= self.batch_size:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if not self.buffer:
+            return
+        block = self.compress(b"".join(line for _, line in self.buffer))
+        shard_path = os.path.join(self.directory, self.shard_name)
+        with open(shard_path, "ab") as f:
+            offset = f.tell()
+            f.write(block)
+            shard_bytes = f.tell()
+
+        written_at = time.time()
+        for line_number, (post_id, _) in enumerate(self.buffer):
+            self.index_file.write(f"{post_id}\t{self.shard_name}\t{offset}\t{len(block)}\t{line_number}\t{written_at}\n")
+            self.reader.entries[post_id] = (self.shard_name, offset, len(block), line_number, written_at)
+        self.index_file.flush()
+        self.buffer = []
+
+        if shard_bytes >= self.shard_size:
+            self.next_shard()
+
+    def get(self, post_id):
+        """Read back an article this corpus already holds, including unflushed ones."""
+        with self.lock:
+            for buffered_id, line in reversed(self.buffer):
+                if buffered_id == str(post_id):
+                    return json.loads(line)
+        return self.reader.get(post_id)
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            self.index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+class CorpusReader:
+    """Random access by postId and sequential scans over a corpus directory."""
+
+    def __init__(self, directory=CORPUS_DIR):
+        self.directory = directory
+        self.entries = {}
+        for index_path in sorted(glob.glob(os.path.join(directory, "*" + INDEX_EXTENSION))):
+            with open(index_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    fields = line.rstrip("\n").split("\t")
+                    if len(fields) != 6:
+                        # A writer died mid-line, the block it points to is incomplete too
+                        continue
+                    post_id, shard_name, offset, length, line_number, written_at = fields
+                    entry = (shard_name, int(offset), int(length), int(line_number), float(written_at))
+                    current = self.entries.get(post_id)
+                    if current is None or entry[4] >= current[4]:
+                        self.entries[post_id] = entry
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, post_id):
+        return str(post_id) in self.entries
+
+    def post_ids(self):
+        return list(self.entries)
+
+    def read_block(self, f, shard_name, offset, length):
+        f.seek(offset)
+        return decompress(shard_name, f.read(length)).split(b"\n")
+
+    def get(self, post_id):
+        entry = self.entries.get(str(post_id))
+        if entry is None:
+            return None
+        shard_name, offset, length, line_number, _ = entry
+        with open(os.path.join(self.directory, shard_name), "rb") as f:
+            return json.loads(self.read_block(f, shard_name, offset, length)[line_number])
+
+    def block_lines(self, post_ids=None):
+        """[((shard, offset, length), [(line, postId), ...]), ...] of the latest versions, in file order."""
+        blocks = {}
+        for post_id, (shard_name, offset, length, line_number, _) in self.entries.items():
+            if post_ids is None or post_id in post_ids:
+                blocks.setdefault((shard_name, offset, length), []).append((line_number, post_id))
+        return [(block, sorted(blocks[block])) for block in sorted(blocks)]
+
+    def ordered_post_ids(self):
+        """postIds in the order a scan yields them, worked out from the sidecar indexes alone."""
+        return [post_id for _, lines in self.block_lines() for _, post_id in lines]
+
+    def __iter__(self):
+        return self.scan()
+
+    def scan(self, post_ids=None):
+        """Yield the latest version of every article, or only of those in post_ids, reading each shard front to back."""
+        current_shard = None
+        f = None
+        try:
+            for (shard_name, offset, length), lines in self.block_lines(post_ids):
+                if shard_name != current_shard:
+                    if f is not None:
+                        f.close()
+                    f = open(os.path.join(self.directory, shard_name), "rb")
+                    current_shard = shard_name
+                block = self.read_block(f, shard_name, offset, length)
+                for line_number, _ in lines:
+                    yield json.loads(block[line_number])
+        finally:
+            if f is not None:
+                f.close()
+
+def corpus_files(directory):
+    """Every shard and sidecar index in a corpus directory."""
+    return [path for path in glob.glob(os.path.join(directory, "*"))
+            if path.endswith(INDEX_EXTENSION) or path.endswith(tuple(EXTENSIONS.values()))]
+
+def compact(directory=CORPUS_DIR, compression="gzip"):
+    """Rewrite a corpus keeping only the latest version of every article; returns (bytes before, after).
+
+    Run it while no crawler is writing to the directory. The new shards get a later
+    written_at, so if it is interrupted the next reader still sees every article once.
+    Every article moves, so the next search index sync re-indexes the whole corpus.
+    """
+    old_files = corpus_files(directory)
+    before = sum(os.path.getsize(path) for path in old_files)
+    reader = CorpusReader(directory)
+    with CorpusWriter(directory, compression=compression, prefix=f"compacted-{int(time.time() * 1000)}") as writer:
+        for record in reader:
+            writer.append(record)
+    # old_files was listed before the writer started, so it holds none of the new shards
+    for path in old_files:
+        os.remove(path)
+    after = sum(os.path.getsize(path) for path in corpus_files(directory))
+    print(f"Compacted {len(reader)} articles in {directory}: {before / 1024 / 1024:.1f} MB -> {after / 1024 / 1024:.1f} MB")
+    return before, after
+
+def migrate(source, destination=CORPUS_DIR, compression="gzip"):
+    """Copy every data/<postId>.json article into a corpus directory."""
+    count = 0
+    with CorpusWriter(destination, compression=compression, prefix="migrated") as writer:
+        for filename in sorted(os.listdir(source)):
+            if not filename.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(source, filename), "r", encoding="utf-8") as f:
+                    record = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Skipping {filename}: {str(e)}")
+                continue
+            if not record.get("postId"):
+                record["postId"] = filename[:-len(".json")]
+            writer.append(record)
+            count += 1
+    print(f"Migrated {count} articles from {source} to {destination}")
+    return count
+
+def test_corpus():
+    """Round-trip articles through rotating shards, refreshes, compaction and migrate."""
+    import tempfile
+    global zstandard
+
+    def article(number, comments=0):
+        return {"postId": str(20240000000000 + number), "title": f"Bài {number}", "content": "nội dung " * 20,
+                "comments": [{"commentId": str(i), "text": "hay"} for i in range(comments)]}
+
+    with tempfile.TemporaryDirectory() as directory:
+        corpus_dir = os.path.join(directory, "corpus")
+        # Tiny shards and batches, so the 20 articles span several blocks and shards
+        with CorpusWriter(corpus_dir, shard_size=200, batch_size=3, prefix="test") as writer:
+            for number in range(20):
+                writer.append(article(number))
+            # Unflushed articles are read back from the buffer
+            assert writer.get(article(19)["postId"]) == article(19)
+        shards = sorted(name for name in os.listdir(corpus_dir) if name.endswith(".jsonl.gz"))
+        assert len(shards) > 1 and is_corpus(corpus_dir)
+
+        # Every .idx entry points at a block that decompresses alone to the article's line
+        reader = CorpusReader(corpus_dir)
+        assert len(reader) == 20
+        for post_id, (shard_name, offset, length, line_number, _) in reader.entries.items():
+            with open(os.path.join(corpus_dir, shard_name), "rb") as f:
+                f.seek(offset)
+                line = gzip.decompress(f.read(length)).split(b"\n")[line_number]
+            assert json.loads(line)["postId"] == post_id
+        assert reader.get(article(7)["postId"]) == article(7) and reader.get("missing") is None
+
+        # A comment refresh appends a second version, and the latest one wins in get and in scans
+        with CorpusWriter(corpus_dir, shard_size=200, batch_size=3, prefix="refresh") as writer:
+            writer.append(article(7, comments=2))
+        reader = CorpusReader(corpus_dir)
+        assert reader.get(article(7)["postId"]) == article(7, comments=2)
+        scanned = list(reader)
+        assert len(scanned) == 20 and sorted(record["postId"] for record in scanned) == sorted(reader.post_ids())
+        assert article(7, comments=2) in scanned and article(7) not in scanned
+
+        # Compaction drops the superseded version and keeps every article
+        before, after = compact(corpus_dir)
+        assert after < before
+        compacted = CorpusReader(corpus_dir)
+        assert sorted(compacted, key=lambda record: record["postId"]) == sorted(scanned, key=lambda record: record["postId"])
+
+        # migrate copies data/*.json files, naming articles without a postId after their file
+        source = os.path.join(directory, "data")
+        os.makedirs(source)
+        for number in range(3):
+            with open(os.path.join(source, f"{article(number)['postId']}.json"), "w", encoding="utf-8") as f:
+                json.dump(dict(article(number), postId=None if number == 2 else article(number)["postId"]), f)
+        with open(os.path.join(source, "broken.json"), "w", encoding="utf-8") as f:
+            f.write("{")
+        assert migrate(source, os.path.join(directory, "migrated"), compression=None) == 3
+        migrated = CorpusReader(os.path.join(directory, "migrated"))
+        assert [migrated.get(article(number)["postId"]) for number in range(3)] == [article(number) for number in range(3)]
+
+        # Without the zstandard package zstd shards are written as gzip instead
+        installed, zstandard = zstandard, None
+        try:
+            with CorpusWriter(os.path.join(directory, "zstd"), compression="zstd", prefix="z") as writer:
+                writer.append(article(1))
+            assert os.listdir(os.path.join(directory, "zstd")) != [] and \
+                all(not name.endswith(".zst") for name in os.listdir(os.path.join(directory, "zstd")))
+            assert CorpusReader(os.path.join(directory, "zstd")).get(article(1)["postId"]) == article(1)
+        finally:
+            zstandard = installed
+
+    print("Corpus OK")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the JSONL article corpus")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = subparsers.add_parser("migrate", help="copy data/*.json articles into a corpus")
+    migrate_parser.add_argument("source", nargs="?", default="data")
+    migrate_parser.add_argument("destination", nargs="?", default=CORPUS_DIR)
+    migrate_parser.add_argument("--compression", choices=["none", "gzip", "zstd"], default="gzip")
+
+    get_parser = subparsers.add_parser("get", help="print one article by postId")
+    get_parser.add_argument("post_id")
+    get_parser.add_argument("directory", nargs="?", default=CORPUS_DIR)
+
+    stats_parser = subparsers.add_parser("stats", help="show article and shard counts")
+    stats_parser.add_argument("directory", nargs="?", default=CORPUS_DIR)
+
+    compact_parser = subparsers.add_parser("compact", help="drop superseded article versions, with no crawler running")
+    compact_parser.add_argument("directory", nargs="?", default=CORPUS_DIR)
+    compact_parser.add_argument("--compression", choices=["none", "gzip", "zstd"], default="gzip")
+
+    args = parser.parse_args()
+    if args.command == "migrate":
+        migrate(args.source, args.destination, None if args.compression == "none" else args.compression)
+    elif args.command == "compact":
+        compact(args.directory, None if args.compression == "none" else args.compression)
+    elif args.command == "get":
+        print(json.dumps(CorpusReader(args.directory).get(args.post_id), ensure_ascii=False, indent=4))
+    else:
+        reader = CorpusReader(args.directory)
+        shards = {entry[0] for entry in reader.entries.values()}
+        size = sum(os.path.getsize(os.path.join(args.directory, shard)) for shard in shards)
+        print(f"{len(reader)} articles in {len(shards)} shards, {size / 1024 / 1024:.1f} MB")
@@ -1,23 +1,50 @@
+import argparse
 import json
+import multiprocessing
 import os
+import socket
+import threading
 import time
 import re
 import requests
+from requests.adapters import HTTPAdapter
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, NoSuchElementException
+from selenium.common.exceptions import TimeoutException, NoSuchElementException, WebDriverException
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.service import Service
 from bs4 import BeautifulSoup
+from comments import COMMENT_API, CommentHarvester, parse_comments_html
+from corpus import CORPUS_DIR, CorpusWriter
+from crawl_state import STATE_DB, CrawlState, content_hash, count_comments
+from downloader import MediaDownloader, download_file
+from scheduler import RequestScheduler
+from frontier import FAILED, FRONTIER_DB, Frontier
+from replay import ArchiveWriter, RecordingSession, replay_url
 from openpyxl import Workbook
 from openpyxl.utils.exceptions import IllegalCharacterError
-from urllib.parse import urlparse
+from urllib.parse import urljoin, urlparse
 
 # CONSTANTS
 URL = "https://tuoitre.vn/"
+HTML_PARSER = "lxml"
+REQUEST_TIMEOUT = 10
+MAX_TASK_RETRIES = 2
+IDLE_POLL = 2
+SCROLL_TIMEOUT = 3
+LOAD_TIMEOUT = 10
+MAX_LISTING_PAGES = 50
+# "Xem thêm" loads further listing pages from this endpoint, keyed by the category's zone id
+TIMELINE_URL = URL + "timeline/{zone_id}/trang-{page}.htm"
+ZONE_ID_PATTERNS = [
+    r"/timeline/(\d+)/",
+    r"data-cd-key=\"[^\"]*zone(\d+)",
+    r"cateid\s*[=:]\s*[\"']?(\d+)",
+]
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"
 
 # Global variables
 max_comments = 0
@@ -88,6 +115,14 @@ class NewsItem:
     def get_comments(self):
         return self.comments
 
+    @classmethod
+    def from_dict(cls, data):
+        news_item = cls()
+        for key, value in data.items():
+            if hasattr(news_item, key):
+                setattr(news_item, key, value)
+        return news_item
+
     def to_dict(self):
         return {
             "postId": self.postId,
@@ -101,9 +136,22 @@ class NewsItem:
             "comments": self.comments,
         }
 
+def use_base_url(base_url):
+    # Crawl a copy of the site, e.g. a replay server, instead of tuoitre.vn
+    global URL, TIMELINE_URL
+    URL = base_url.rstrip("/") + "/"
+    TIMELINE_URL = URL + "timeline/{zone_id}/trang-{page}.htm"
+
+def open_page(driver, url, scheduler=None):
+    if scheduler is not None:
+        scheduler.navigate(driver, url)
+    else:
+        driver.get(url)
+
 class MainScreenTransition:
-    def __init__(self, driver):
+    def __init__(self, driver, scheduler=None):
         self.driver = driver
+        self.scheduler = scheduler
         self.wait = WebDriverWait(self.driver, 1)
         self.workbook = Workbook()
         self.worksheet = self.workbook.active
@@ -111,32 +159,66 @@ class MainScreenTransition:
         self.category_links = []
 
     def extract_categories(self):
-        self.driver.get(URL)
+        # The menu is server-rendered, so the plain-HTTP page is enough when it loads
+        if self.scheduler is not None and self.extract_categories_static():
+            return
+        if self.driver is None:
+            print("Could not load the home page without a browser")
+            return
+        self.extract_categories_browser()
+
+    def set_categories(self, menu_links):
+        temp_categories = []
+        temp_links = []
+
+        for category, href in menu_links:
+            if category and href and category != "Trang chủ" and category != "Video":
+                temp_categories.append(category)
+                full_link = URL + href if not href.startswith('http') else href
+                temp_links.append(full_link)
+
+        try:
+            kinh_doanh_index = temp_categories.index("Kinh doanh")
+            temp_categories.insert(0, temp_categories.pop(kinh_doanh_index))
+            temp_links.insert(0, temp_links.pop(kinh_doanh_index))
+        except ValueError:
+            print("Category 'Kinh doanh' not found")
+
+        self.categories = temp_categories
+        self.category_links = temp_links
+
+    def extract_categories_static(self):
+        try:
+            response = self.scheduler.get(URL)
+            if response.status_code != 200:
+                print(f"Failed to fetch {URL}: Status code {response.status_code}")
+                return False
+            soup = BeautifulSoup(response.text, HTML_PARSER)
+        except requests.RequestException as e:
+            print(f"Error fetching {URL}: {str(e)}")
+            return False
+
+        menu_links = []
+        for item in soup.select("div.header__nav-flex ul.menu-nav > li"):
+            link = item.find("a")
+            if link is not None and link.get("href"):
+                # Resolve relative links the way the browser does for get_attribute("href")
+                menu_links.append((link.get("title"), urljoin(URL, link.get("href"))))
+        if not menu_links:
+            return False
+        self.set_categories(menu_links)
+        return True
+
+    def extract_categories_browser(self):
+        open_page(self.driver, URL, self.scheduler)
         try:
             category_items = self.driver.find_elements(By.CSS_SELECTOR, "div.header__nav-flex ul.menu-nav > li")
             
-            temp_categories = []
-            temp_links = []
-            
+            menu_links = []
             for item in category_items:
                 link = item.find_element(By.TAG_NAME, "a")
-                category = link.get_attribute("title")
-                href = link.get_attribute("href")
-                
-                if category and href and category != "Trang chủ" and category != "Video":
-                    temp_categories.append(category)
-                    full_link = URL + href if not href.startswith('http') else href
-                    temp_links.append(full_link)
-            
-            try:
-                kinh_doanh_index = temp_categories.index("Kinh doanh")
-                temp_categories.insert(0, temp_categories.pop(kinh_doanh_index))
-                temp_links.insert(0, temp_links.pop(kinh_doanh_index))
-            except ValueError:
-                print("Category 'Kinh doanh' not found")
-            
-            self.categories = temp_categories
-            self.category_links = temp_links
+                menu_links.append((link.get_attribute("title"), link.get_attribute("href")))
+            self.set_categories(menu_links)
         
         except TimeoutException:
             print("Timed out waiting for menu-nav to load")
@@ -144,66 +226,162 @@ class MainScreenTransition:
             print("Could not find the required elements")
 
 class CategoryScreenTransition:
-    def __init__(self, url, category, driver):
+    def __init__(self, url, category, driver, scheduler=None):
         self.url = url
         self.category = category
         self.driver = driver
-        self.wait = WebDriverWait(self.driver, 1)
+        self.scheduler = scheduler
+        self.wait = WebDriverWait(self.driver, 1) if driver else None
         self.workbook = Workbook()
         self.worksheet = self.workbook.active
         self.news_titles = []
         self.news_links = []
+        self.news_comment_counts = {}
+        self.seen_ids = set()
+
+    def needs_more(self):
+        return len(self.news_titles) < 25 or max_comments < 20
+
+    def add_news(self, title, link, comment_count):
+        global max_comments
+        if comment_count is not None:
+            max_comments = max(max_comments, comment_count)
+
+        if not title or not link:
+            return False
+        full_link = URL + link.lstrip('/') if not link.startswith('http') else link
+        key = extract_post_id(full_link) or full_link
+        if key in self.seen_ids:
+            return False
+        self.seen_ids.add(key)
+        self.news_titles.append(title)
+        self.news_links.append(full_link)
+        self.news_comment_counts[full_link] = comment_count
+        return True
+
+    def add_news_from_html(self, soup):
+        added = 0
+        for item in soup.select(".box-category-item"):
+            title_element = item.select_one(".box-category-link-title")
+            if not title_element:
+                continue
+            comment_count = None
+            comment_element = item.select_one("div.ico-data-type.type-data-comment span.value")
+            if comment_element:
+                try:
+                    comment_count = int(comment_element.get_text().strip())
+                except ValueError:
+                    pass
+            if self.add_news(title_element.get("title"), title_element.get("href"), comment_count):
+                added += 1
+        return added
 
     def extract_news(self):
-        self.driver.get(self.url)
+        # The listing's own paginated endpoint is much cheaper than scrolling a browser
+        if self.scheduler is not None and self.extract_news_static():
+            print(f"Total news items collected: {len(self.news_titles)}")
+            print("\n")
+            return
+        if self.driver is None:
+            print(f"Could not list {self.category} without a browser")
+            return
+        self.extract_news_browser()
+
+    def extract_news_static(self):
         try:
-            global max_comments
-            while len(self.news_titles) < 25 or max_comments < 20:
-                self.wait.until(EC.presence_of_element_located((By.CLASS_NAME, "box-category-item")))
+            response = self.scheduler.get(self.url)
+            if response.status_code != 200:
+                print(f"Failed to fetch {self.url}: Status code {response.status_code}")
+                return False
+            html = response.text
+        except requests.RequestException as e:
+            print(f"Error fetching {self.url}: {str(e)}")
+            return False
+
+        zone_id = None
+        for pattern in ZONE_ID_PATTERNS:
+            match = re.search(pattern, html)
+            if match:
+                zone_id = match.group(1)
+                break
+        if zone_id is None:
+            print(f"No listing endpoint found for {self.category}, using the browser")
+            return False
+
+        self.add_news_from_html(BeautifulSoup(html, HTML_PARSER))
+        page = 1
+        while self.needs_more() and page < MAX_LISTING_PAGES:
+            page += 1
+            timeline_url = TIMELINE_URL.format(zone_id=zone_id, page=page)
+            try:
+                response = self.scheduler.get(timeline_url)
+            except requests.RequestException as e:
+                print(f"Error fetching {timeline_url}: {str(e)}")
+                break
+            if response.status_code != 200:
+                break
+            if not self.add_news_from_html(BeautifulSoup(response.text, HTML_PARSER)):
+                # An empty or fully repeated page means the listing is exhausted
+                break
+        return True
+
+    def item_count(self):
+        return self.driver.execute_script("return document.getElementsByClassName('box-category-item').length")
+
+    def wait_for_more(self, count, timeout):
+        # Return as soon as new items are appended instead of sleeping a fixed time
+        try:
+            WebDriverWait(self.driver, timeout, poll_frequency=0.2).until(lambda driver: self.item_count() > count)
+            return True
+        except TimeoutException:
+            return False
+
+    def extract_news_browser(self):
+        open_page(self.driver, self.url, self.scheduler)
+        try:
+            self.wait.until(EC.presence_of_element_located((By.CLASS_NAME, "box-category-item")))
+            processed = 0
+            while self.needs_more():
                 news_items = self.driver.find_elements(By.CLASS_NAME, "box-category-item")
                 
-                for item in news_items:
+                # Only items appended since the last pass need to be read
+                for item in news_items[processed:]:
                     try:
                         title_element = item.find_element(By.CLASS_NAME, "box-category-link-title")
                         title = title_element.get_attribute("title")
                         link = title_element.get_attribute("href")
                         
+                        comment_count = None
                         try:
                             comment_element = item.find_element(By.CSS_SELECTOR, "div.ico-data-type.type-data-comment span.value")
                             comment_count = int(comment_element.text)
-                            max_comments = max(max_comments, comment_count)
                         except (NoSuchElementException, ValueError):
                             pass
                         
-                        if title and link and title not in self.news_titles:
-                            self.news_titles.append(title)
-                            full_link = URL + link if not link.startswith('http') else link
-                            self.news_links.append(full_link)
+                        self.add_news(title, link, comment_count)
                     except NoSuchElementException:
                         continue
+                processed = len(news_items)
                 
-                if len(self.news_titles) >= 25 and max_comments >= 20:
+                if not self.needs_more():
                     break
                 
-                last_height = self.driver.execute_script("return document.body.scrollHeight")
-                while True:
-                    self.driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-                    time.sleep(1)
-                    
-                    new_height = self.driver.execute_script("return document.body.scrollHeight")
-                    
-                    if new_height == last_height:
-                        time.sleep(3)
-                        break
-                    last_height = new_height
+                # Infinite scroll first, then the 'Xem thêm' button
+                self.driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+                if self.wait_for_more(processed, SCROLL_TIMEOUT):
+                    continue
                 
                 try:
                     view_more_button = self.driver.find_element(By.CLASS_NAME, "view-more")
-                    view_more_button.click()
-                    time.sleep(2)
-                except TimeoutException:
+                    if self.scheduler is not None:
+                        self.scheduler.pace(self.url)
+                    self.driver.execute_script("arguments[0].click();", view_more_button)
+                except NoSuchElementException:
                     print("No more 'Xem thêm' button found or it's not clickable")
                     break
+                if not self.wait_for_more(processed, LOAD_TIMEOUT):
+                    print("No more news items loaded")
+                    break
         
         except TimeoutException:
             print("Timed out waiting for page to load")
@@ -214,79 +392,267 @@ class CategoryScreenTransition:
             print(f"Total news items collected: {len(self.news_titles)}")
             print("\n")
 
+def extract_post_id(url):
+    id = re.search(r"(\d+)(?=\D*$)", url)
+    return id.group(1) if id else None
+
+def element_text(element):
+    # Collapse whitespace the same way Selenium's .text does for rendered text
+    return " ".join(element.get_text().split()) if element else None
+
+def make_session(pool_size=10, archive=None):
+    # With an archive every response is also recorded, for replaying the crawl offline
+    session = RecordingSession(archive) if archive is not None else requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"User-Agent": USER_AGENT})
+    return session
+
 class PageTextCrawl:
-    def __init__(self, url, category, driver):
+    def __init__(self, url, category, driver=None, scheduler=None, downloader=None, state=None, comment_count=None,
+                 comment_harvester=None, corpus=None):
         self.url = url
         self.category = category
         self.file_name = None
         self.driver = driver
-        self.wait = WebDriverWait(self.driver, 3)
+        self.scheduler = scheduler
+        self.downloader = downloader
+        self.state = state
+        self.comment_count = comment_count
+        self.comment_harvester = comment_harvester
+        self.corpus = corpus
+        self.skipped = False
+        self.wait = WebDriverWait(self.driver, 3) if driver else None
         self.workbook = Workbook()
         self.worksheet = self.workbook.active
         self.image_dir = None
         self.audio_dir = None
         self.data_dir = "data"
+        # (url, path, label) of the media found on the page, downloaded once the article is kept
+        self.media = []
 
-    def save_image(self, img_url, index):
-        try:
-            response = requests.get(img_url)
-            if response.status_code == 200:
-                if not os.path.exists(self.image_dir):
-                    os.makedirs(self.image_dir)
-                
-                ext = os.path.splitext(urlparse(img_url).path)[1]
-                if not ext:
-                    ext = '.jpg'
-                
-                image_path = os.path.join(self.image_dir, f'image{index}{ext}')
-                with open(image_path, 'wb') as f:
-                    f.write(response.content)
-                print(f"Saved image {index} to {image_path}")
+    def save_media(self, url, path, label):
+        self.media.append((url, path, label))
+
+    def download_media(self):
+        # Hand the files to the background downloader when there is one
+        for url, path, label in self.media:
+            if self.downloader is not None:
+                self.downloader.submit(self.file_name, url, path, label)
             else:
-                print(f"Failed to download image {index}: Status code {response.status_code}")
-        except Exception as e:
-            print(f"Error saving image {index}: {str(e)}")
+                download_file(self.scheduler or requests, url, path, label)
+        self.media = []
+        # Media keep downloading in the background, the next article does not wait for them
+        if self.downloader is not None and self.file_name:
+            self.downloader.finish_article(self.file_name)
+
+    def save_image(self, img_url, index):
+        ext = os.path.splitext(urlparse(img_url).path)[1]
+        if not ext:
+            ext = '.jpg'
+        
+        image_path = os.path.join(self.image_dir, f'image{index}{ext}')
+        self.save_media(img_url, image_path, f"image {index}")
 
     def save_audio(self, audio_url):
+        ext = os.path.splitext(urlparse(audio_url).path)[1]
+        if not ext:
+            ext = '.mp3'
+        
+        # Save the audio file
+        audio_path = os.path.join(self.audio_dir, f'{self.file_name}{ext}')
+        self.save_media(audio_url, audio_path, "audio")
+
+    def new_news_item(self):
+        news_item = NewsItem()
+        # A page parsed again after a failed attempt starts without the media of that attempt
+        self.media = []
+
+        # Extract post ID from the URL first
+        postID = extract_post_id(self.url)
+        if postID:
+            self.file_name = postID
+        else:
+            print("Post ID not found in the URL.")
+            self.file_name = "unknown"
+        news_item.set_postId(postID)
+
+        # Set up directories after getting postID
+        self.image_dir = f"images/{postID}" if postID else "images/unknown"
+        self.audio_dir = "audio"
+        return news_item
+
+    def crawl_page(self):
+        if self.state is not None:
+            action = self.state.plan(extract_post_id(self.url), self.comment_count)
+            if action == "skip":
+                print(f"Skipping unchanged {self.url}")
+                self.skipped = True
+                return None
+            if action == "comments":
+                news_item = self.refresh_comments()
+                if news_item is not None:
+                    return news_item
+
+        news_item = self.fetch_news_item()
+        if news_item is None:
+            return None
+        if self.state is not None and self.state.unchanged(
+                news_item.get_postId(), content_hash(news_item.to_dict()), self.recorded_comment_count(news_item)):
+            # A re-check found the stored copy current, so it is neither rewritten, re-indexed nor re-downloaded
+            print(f"Skipping unchanged {self.url}")
+            self.state.touch(news_item.get_postId())
+            self.skipped = True
+            return None
+        self.download_media()
+        return news_item
+
+    def recorded_comment_count(self, news_item):
+        # Keep the listing's count so the next run compares like with like
+        if self.comment_count is not None:
+            return self.comment_count
+        return count_comments(news_item.get_comments())
+
+    def fetch_news_item(self):
+        # Try the plain-HTTP fast path first, keep the browser for pages that need JS
+        if self.scheduler is not None:
+            news_item = self.crawl_page_static()
+            if news_item is not None or self.driver is None:
+                return news_item
+            print(f"Falling back to browser for {self.url}")
+        return self.crawl_page_browser()
+
+    def load_saved(self):
+        if self.corpus is not None:
+            return self.corpus.get(self.file_name)
+        json_path = os.path.join(self.data_dir, f"{self.file_name}.json")
+        if not os.path.exists(json_path):
+            return None
+        with open(json_path, "r", encoding="utf-8") as file:
+            return json.load(file)
+
+    def refresh_comments(self):
+        # Only the comment thread grew, reuse the stored article and refetch its comments
+        self.new_news_item()
+        if self.driver is None and self.comment_harvester is None:
+            return None
         try:
-            response = requests.get(audio_url)
-            if response.status_code == 200:
-                if not os.path.exists(self.audio_dir):
-                    os.makedirs(self.audio_dir)
-                
-                ext = os.path.splitext(urlparse(audio_url).path)[1]
-                if not ext:
-                    ext = '.mp3'
-                
-                # Save the audio file
-                audio_path = os.path.join(self.audio_dir, f'{self.file_name}{ext}')
-                with open(audio_path, 'wb') as f:
-                    f.write(response.content)
-                print(f"Saved audio to {audio_path}")
+            saved = self.load_saved()
+            if saved is None:
+                return None
+            news_item = NewsItem.from_dict(saved)
+            print(f"Refreshing comments of {self.url}")
+            news_item.set_comments(self.fetch_comments())
+            return news_item
+        except (OSError, ValueError) as e:
+            print(f"Error refreshing comments of {self.url}: {str(e)}")
+            return None
+
+    def crawl_page_static(self):
+        try:
+            response = self.scheduler.get(self.url, timeout=REQUEST_TIMEOUT)
+            if response.status_code != 200:
+                print(f"Failed to fetch {self.url}: Status code {response.status_code}")
+                return None
+            soup = BeautifulSoup(response.content, HTML_PARSER)
+        except requests.RequestException as e:
+            print(f"Error fetching {self.url}: {str(e)}")
+            return None
+
+        try:
+            news_item = self.new_news_item()
+
+            # Set title, a page without one was not server-rendered
+            title_meta = soup.select_one("meta[itemprop='name']")
+            title = title_meta.get("content") if title_meta else None
+            if not title:
+                title = element_text(soup.select_one(".detail-title.article-title"))
+            if not title:
+                print(f"No server-rendered article found at {self.url}")
+                return None
+            news_item.set_title(title)
+
+            # Set content, with None fallback
+            sapo = soup.select_one(".detail-sapo")
+            if sapo:
+                content_paragraphs = soup.select("div.detail-content.afcbc-body > p")
+                content_text = '\n'.join([element_text(p) for p in content_paragraphs])
+                content = element_text(sapo) + '\n' + content_text
             else:
-                print(f"Failed to download audio: Status code {response.status_code}")
+                content = None
+            news_item.set_content(content)
+
+            # Set author and date, with None fallback
+            news_item.set_author(element_text(soup.select_one(".detail-author-bot")))
+            news_item.set_date(element_text(soup.select_one(".detail-time")))
+
+            # Set audio_podcast
+            audio_player = soup.select_one("div.audioplayer")
+            audio_podcast = audio_player.get("data-file") if audio_player else None
+            if audio_podcast and self.file_name:
+                self.save_audio(audio_podcast)
+                news_item.set_audio_podcast(audio_podcast)
+            else:
+                news_item.set_audio_podcast(None)
+
+            news_item.set_comments(self.fetch_comments())
+
+            news_item.set_category(self.category)
+            news_item.set_url(self.url)
+
+            # Add image extraction
+            figures = soup.select('figure.VCSortableInPreviewMode[type="Photo"]')
+            for i, figure in enumerate(figures, 1):
+                img_tag = figure.find('img')
+                if not img_tag:
+                    continue
+                img_url = img_tag.get('data-original') or img_tag.get('src')
+                if img_url:
+                    self.save_image(img_url, i)
+
+            return news_item
         except Exception as e:
-            print(f"Error saving audio: {str(e)}")
+            print(f"An error occurred while parsing the page: {e}")
+            return None
 
-    def crawl_page(self):
-        self.driver.get(self.url)
+    def fetch_comments(self, page_open=False):
+        # The listing already showed no comments, so there is nothing to fetch or open the browser for
+        if self.comment_count == 0:
+            return []
+        # The comment API returns whole threads, the popup is only a fallback
+        if self.comment_harvester is not None and self.file_name != "unknown":
+            comments = self.comment_harvester.harvest(self.file_name)
+            # An empty answer for an article the listing showed comments on is a failed call, not an empty thread
+            if comments or (comments is not None and not self.comment_count):
+                return comments
+            if comments is not None:
+                print(f"Comment API returned no comments for {self.file_name}, expected {self.comment_count}")
+        if self.driver is None:
+            return None
+        if not page_open:
+            open_page(self.driver, self.url, self.scheduler)
+        return self.crawl_comments()
+
+    def crawl_comments(self):
+        # Open the comment popup on the current page, with None fallback
         try:
-            news_item = NewsItem()
+            vote_reactions = self.driver.find_element(By.CLASS_NAME, "ico.comment")
+            vote_reactions.click()
+            time.sleep(1)
 
-            # Extract post ID from the URL first
-            id = re.search(r"(\d+)(?=\D*$)", self.url)
-            if id:
-                postID = id.group(1)
-                self.file_name = postID
-            else:
-                print("Post ID not found in the URL.")
-                postID = None
-                self.file_name = "unknown"
-            news_item.set_postId(postID)
+            # Only serialize the popup once comments are loaded, not the whole page
+            popup_html = self.driver.find_element(By.CLASS_NAME, "lstcommentpopup").get_attribute("outerHTML")
+            comments = parse_comments_html(popup_html)
+            print(f"Total comments found: {len(comments)}")
+            return comments
+        except NoSuchElementException:
+            return None
 
-            # Set up directories after getting postID
-            self.image_dir = f"images/{postID}" if postID else "images/unknown"
-            self.audio_dir = "audio"
+    def crawl_page_browser(self):
+        open_page(self.driver, self.url, self.scheduler)
+        try:
+            news_item = self.new_news_item()
 
             # Set title, with None fallback
             try:
@@ -332,101 +698,7 @@ class PageTextCrawl:
                 news_item.set_audio_podcast(None)
 
             # Set vote_reactions, comments with None fallback
-            try:
-                vote_reactions = self.driver.find_element(By.CLASS_NAME, "ico.comment")
-                vote_reactions.click()
-                time.sleep(1)
-
-                # Get the page source after comments are loaded
-                page_source = self.driver.page_source
-                soup = BeautifulSoup(page_source, 'html.parser')
-                
-                def extract_reactions(reaction_element):
-                    if not reaction_element:
-                        return []
-                    
-                    # Define mapping of CSS classes to reaction types
-                    reaction_types = {
-                        'icolikereact': 'like',
-                        'icoheartreact': 'heart',
-                        'icolaughreact': 'laugh',
-                        'icosadreact': 'sad',
-                        'icosurprisedreact': 'surprised',
-                        'icoanggyreact': 'angry'
-                    }
-                    
-                    reactions = []
-                    reaction_divs = reaction_element.select('div.listreact > div.colreact')
-                    
-                    for div in reaction_divs:
-                        # Find the span with spritecmt class and another reaction class
-                        reaction_span = div.find('span', class_='spritecmt')
-                        if reaction_span:
-                            # Get all classes and find the matching reaction type
-                            span_classes = reaction_span.get('class', [])
-                            reaction_type = None
-                            for class_name in span_classes:
-                                if class_name in reaction_types:
-                                    reaction_type = reaction_types[class_name]
-                                    break
-                        
-                        # Get the reaction count
-                        count_span = div.find('span', class_='num')
-                        count = count_span.text.strip() if count_span else '0'
-                        
-                        if reaction_type:
-                            reactions.append({
-                                'type': reaction_type,
-                                'count': count
-                            })
-                    
-                    return reactions
-
-                def extract_comments(soup):
-                    comments = []
-                    comments_container = soup.find('div', class_='lstcommentpopup')
-                    comment_elements = comments_container.find_all('li', class_='item-comment')
-                    print(f"Total comments found: {len(comment_elements)}")
-                    for comment_element in comment_elements:    
-                        comment_id = comment_element['data-cmid']
-                        author = comment_element.find('span', class_='name').text
-                        text = comment_element.find('span', class_='contentcomment').text
-                        date = comment_element.find('span', class_='timeago')['title']
-                        reaction_element = comment_element.find('div', class_='wrapreact')
-                        reactions = extract_reactions(reaction_element) if reaction_element else []
-
-                        # Extract replies
-                        replies = []
-                        reply_elements = comment_element.find_all('li', class_='item-comment')
-                        for reply_element in reply_elements:
-                            reply_id = reply_element['data-cmid']
-                            reply_author = reply_element.find('span', class_='name').text
-                            reply_text = reply_element.find('span', class_='contentcomment').text
-                            reply_date = reply_element.find('span', class_='timeago')['title']
-                            reply_reaction_element = reply_element.find('div', class_='wrapreact')
-                            reply_reactions = extract_reactions(reply_reaction_element) if reply_reaction_element else []
-                            replies.append({
-                                'commentId': reply_id,
-                                'author': reply_author,
-                                'text': reply_text,
-                                'date': reply_date,
-                                'reactions': reply_reactions
-                            })
-
-                        comments.append({
-                            'commentId': comment_id,
-                            'author': author,
-                            'text': text,
-                            'date': date,
-                            'reactions': reactions,
-                            'replies': replies
-                        })
-
-                    return comments
-
-                comments_data = extract_comments(soup)
-            except NoSuchElementException:
-                comments_data = None
+            comments_data = self.fetch_comments(page_open=True)
             news_item.set_comments(comments_data)
 
             # Set category, URL, and post ID which are expected to exist already
@@ -457,50 +729,380 @@ class PageTextCrawl:
         
     def save_to_json(self, news_item):
         if news_item is not None:
-            # Create data directory if it doesn't exist
-            if not os.path.exists(self.data_dir):
-                os.makedirs(self.data_dir)
-            
-            # Save JSON file in the data directory
-            json_path = os.path.join(self.data_dir, f"{self.file_name}.json")
-            with open(json_path, "w", encoding="utf-8") as file:
-                json.dump(news_item.to_dict(), file, indent=4, ensure_ascii=False)
+            if self.corpus is not None:
+                # Append to the shared JSONL corpus instead of one file per article
+                self.corpus.append(news_item.to_dict())
+            else:
+                # Create data directory if it doesn't exist
+                if not os.path.exists(self.data_dir):
+                    os.makedirs(self.data_dir)
+                
+                # Save JSON file in the data directory
+                json_path = os.path.join(self.data_dir, f"{self.file_name}.json")
+                with open(json_path, "w", encoding="utf-8") as file:
+                    json.dump(news_item.to_dict(), file, indent=4, ensure_ascii=False)
+
+            if self.state is not None and news_item.get_postId():
+                self.state.record(news_item.get_postId(), self.url, content_hash(news_item.to_dict()),
+                                  self.recorded_comment_count(news_item))
         else:
             print(f"Skipping JSON save for {self.url} due to crawl failure")
 
-if __name__ == "__main__":
+def make_driver(headless=True):
     chrome_options = Options()
     chrome_options.add_argument('--ssl_client_socket_impl=yes')
     chrome_options.add_argument('--ignore-certificate-errors')
+    if headless:
+        chrome_options.add_argument('--headless=new')
+    return webdriver.Chrome(options=chrome_options)
+
+def driver_alive(driver):
+    try:
+        driver.current_url
+        return True
+    except WebDriverException:
+        return False
+
+class CrawlPool:
+    def __init__(self, num_workers, frontier, scheduler=None, downloader=None, state=None, comment_harvester=None,
+                 corpus=None, headless=True, use_browser=True):
+        self.num_workers = max(1, num_workers)
+        self.frontier = frontier
+        self.scheduler = scheduler
+        self.downloader = downloader
+        self.state = state
+        self.comment_harvester = comment_harvester
+        self.corpus = corpus
+        self.headless = headless
+        # Without a browser only server-rendered pages can be crawled
+        self.use_browser = use_browser
+        self.lock = threading.Lock()
+        self.items_saved = 0
+        self.items_skipped = 0
+        self.items_failed = 0
 
-    driver = webdriver.Chrome(options=chrome_options)
-    
-    web = MainScreenTransition(driver)
-    web.extract_categories()
-    print(web.category_links)
-    print(web.categories)
-    print("Done extracting categories!")
-    
-    news_items = []
-
-    for category_link, category in zip(web.category_links, web.categories):
-        print(f"Extracting news from {category}")
-        web_category = CategoryScreenTransition(category_link, category, driver)
-        if web_category:
+    def run_task(self, driver, item):
+        kind, url, category = item["kind"], item["url"], item["category"]
+        if kind == "home":
+            web = MainScreenTransition(driver, self.scheduler)
+            web.extract_categories()
+            print(f"Done extracting categories: {web.categories}")
+            for category_link, category_name in zip(web.category_links, web.categories):
+                self.frontier.add("category", category_link, category_name)
+            return True
+
+        if kind == "category":
+            print(f"Extracting news from {category}")
+            web_category = CategoryScreenTransition(url, category, driver, self.scheduler)
             web_category.extract_news()
+            # The frontier ignores articles already queued from another category
             for link in web_category.news_links:
-                print(f"Extracting news from {link}")
-                page = PageTextCrawl(link, category, driver)
-                news_item = page.crawl_page()
-                if news_item:
-                    page.save_to_json(news_item)
-                else:
-                    print(f"Skipping {link} due to crawl failure")
-        else:
-            print(f"Failed to extract_news() from {category}")
-        
-            
-    print(f"Total items collected: {len(news_items)}")
-    
+                self.frontier.add("article", link, category, web_category.news_comment_counts.get(link))
+            return True
+
+        print(f"Extracting news from {url}")
+        page = PageTextCrawl(url, category, driver, self.scheduler, self.downloader,
+                             self.state, item["comment_count"], self.comment_harvester, self.corpus)
+        news_item = page.crawl_page()
+        if page.skipped:
+            with self.lock:
+                self.items_skipped += 1
+            return True
+        if news_item:
+            page.save_to_json(news_item)
+            with self.lock:
+                self.items_saved += 1
+            return True
+        return False
+
+    def worker(self, worker_id):
+        owner = f"{socket.gethostname()}:{os.getpid()}:{worker_id}"
+        driver = None
+        while True:
+            item = self.frontier.lease(owner)
+            if item is None:
+                # Other workers may still add links from the pages they hold
+                if not self.frontier.has_work():
+                    break
+                time.sleep(IDLE_POLL)
+                continue
+
+            url = item["url"]
+            try:
+                if driver is None and self.use_browser:
+                    driver = make_driver(self.headless)
+                ok = self.run_task(driver, item)
+            except Exception as e:
+                print(f"Worker {worker_id}: error on {url}: {str(e)}")
+                ok = False
+
+            if ok:
+                self.frontier.done(url)
+                continue
+
+            if self.use_browser and (driver is None or not driver_alive(driver)):
+                # Replace a crashed browser, the retry runs on a fresh one
+                print(f"Worker {worker_id}: restarting crashed driver")
+                if driver is not None:
+                    try:
+                        driver.quit()
+                    except WebDriverException:
+                        pass
+                    driver = None
+
+            if self.frontier.fail(url) == FAILED:
+                print(f"Giving up on {url} after {item['retries'] + 1} attempts")
+                if item["kind"] == "article":
+                    with self.lock:
+                        self.items_failed += 1
+
+        if driver is not None:
+            driver.quit()
+
+    def run(self):
+        workers = []
+        for worker_id in range(self.num_workers):
+            thread = threading.Thread(target=self.worker, args=(worker_id,), daemon=True)
+            thread.start()
+            workers.append(thread)
+        for thread in workers:
+            thread.join()
+
+# A saved article page, trimmed to the markup the static path reads
+TEST_ARTICLE_HTML = """<!DOCTYPE html>
+<html lang="vi"><head><meta charset="utf-8">
+<meta itemprop="name" content="Giá vàng hôm nay tăng mạnh">
+</head><body>
+<h1 class="detail-title article-title">Giá vàng hôm nay tăng mạnh</h1>
+<div class="detail-author-bot"><a class="name" href="/tac-gia/an-nhien.htm">  An   Nhiên </a></div>
+<div class="detail-time"><div data-role="publishdate"> 05/03/2024 08:15 GMT+7 </div></div>
+<div class="audioplayer" data-file="{base_url}media/20240305081500123.m4a"></div>
+<h2 class="detail-sapo">Sáng nay giá vàng
+    trong nước tăng theo giá thế giới.</h2>
+<div class="detail-content afcbc-body">
+<p>Giá vàng miếng tăng <b>1 triệu</b> đồng mỗi lượng.</p>
+<figure class="VCSortableInPreviewMode" type="Photo"><img src="data:," data-original="{base_url}media/vang.jpg"></figure>
+<p>Nhiều người xếp hàng mua vàng.</p>
+<figure class="VCSortableInPreviewMode" type="Video"><img src="{base_url}media/video.jpg"></figure>
+<figure class="VCSortableInPreviewMode" type="Photo"><img src="{base_url}media/cua-hang.png"></figure>
+</div>
+</body></html>
+"""
+
+def test_crawl_page_static():
+    """Crawl a saved article served over HTTP and check what the static path extracts and downloads."""
+    import tempfile
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    media_requests = []
+
+    class ArticleHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.startswith("/media/"):
+                media_requests.append(self.path)
+                body = self.path.encode("utf-8")
+            elif self.path == "/kinh-doanh/gia-vang-20240305081500123.htm":
+                body = TEST_ARTICLE_HTML.replace("{base_url}", base_url).encode("utf-8")
+            elif self.path == "/kinh-doanh/trang-js-20240305081500999.htm":
+                body = b'<html><body><div id="app"></div><script src="/app.js"></script></body></html>'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ArticleHandler)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    cwd = os.getcwd()
+    scheduler = RequestScheduler(make_session(), host_limits={"127.0.0.1": (1000, 1000, 8)})
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            page = PageTextCrawl(base_url + "kinh-doanh/gia-vang-20240305081500123.htm", "Kinh doanh",
+                                 scheduler=scheduler, comment_count=0)
+            news_item = page.crawl_page()
+            assert news_item.get_postId() == "20240305081500123"
+            assert news_item.get_title() == "Giá vàng hôm nay tăng mạnh"
+            assert news_item.get_content() == ("Sáng nay giá vàng trong nước tăng theo giá thế giới.\n"
+                                               "Giá vàng miếng tăng 1 triệu đồng mỗi lượng.\n"
+                                               "Nhiều người xếp hàng mua vàng.")
+            assert news_item.get_author() == "An Nhiên"
+            assert news_item.get_date() == "05/03/2024 08:15 GMT+7"
+            assert news_item.get_audio_podcast() == base_url + "media/20240305081500123.m4a"
+            assert news_item.get_comments() == []
+            assert news_item.get_category() == "Kinh doanh"
+            # Only photo figures are saved, numbered in page order, from data-original when there is one
+            assert sorted(os.listdir("images/20240305081500123")) == ["image1.jpg", "image2.png"]
+            with open("images/20240305081500123/image1.jpg", "rb") as f:
+                assert f.read() == b"/media/vang.jpg"
+            assert os.listdir("audio") == ["20240305081500123.m4a"]
+
+            # Once its recheck is due the article is fetched again, but an unchanged copy is not rewritten
+            state = CrawlState("state.db", recheck_after=-1)
+            page.state = state
+            page.save_to_json(news_item)
+            page = PageTextCrawl(page.url, "Kinh doanh", scheduler=scheduler, state=state)
+            downloads = len(media_requests)
+            assert page.crawl_page() is None and page.skipped
+            assert len(media_requests) == downloads == 3, media_requests
+            state.close()
+
+            # An empty comment API answer only counts when the listing showed no comments either
+            class EmptyHarvester:
+                def harvest(self, post_id):
+                    return []
+
+            page = PageTextCrawl(page.url, "Kinh doanh", scheduler=scheduler, comment_count=5,
+                                 comment_harvester=EmptyHarvester())
+            page.file_name = "20240305081500123"
+            assert page.fetch_comments() is None
+            page.comment_count = None
+            assert page.fetch_comments() == []
+
+            # A page without a server-rendered title is left to the browser
+            page = PageTextCrawl(base_url + "kinh-doanh/trang-js-20240305081500999.htm", "Kinh doanh",
+                                 scheduler=scheduler, comment_count=0)
+            assert page.crawl_page() is None
+    finally:
+        os.chdir(cwd)
+        scheduler.close()
+        server.shutdown()
+        server.server_close()
+
+    print("Static article crawl OK")
+
+def test_extract_news_static():
+    """List a category through its timeline pages with a stub scheduler, stopping once no new items come."""
+    global max_comments
+
+    def listing(numbers):
+        return "".join(f'<div class="box-category-item"><a class="box-category-link-title" title="Tin {n}" '
+                       f'href="/tin-{n}-2024030508150{n:04d}.htm"></a><div class="ico-data-type type-data-comment">'
+                       f'<span class="value">{n}</span></div></div>' for n in numbers)
+
+    class StubScheduler:
+        def __init__(self, pages):
+            self.pages = pages
+            self.requested = []
+
+        def get(self, url):
+            self.requested.append(url)
+            response = requests.Response()
+            response.status_code = 200 if url in self.pages else 404
+            response._content = self.pages.get(url, "").encode("utf-8")
+            response.encoding = "utf-8"
+            return response
+
+    category_url = URL + "the-thao.htm"
+    saved_max_comments = max_comments
+    try:
+        # Each pattern finds the zone id the timeline pages are keyed by
+        for marker in ('<a href="/timeline/1209/trang-2.htm">', '<div data-cd-key="siteid198:newsinzone:zone1209">',
+                       "<script>var cateid = '1209';</script>"):
+            max_comments = 0
+            scheduler = StubScheduler({category_url: marker + listing([1, 2, 3]),
+                                       TIMELINE_URL.format(zone_id=1209, page=2): listing([3, 4, 5]),
+                                       TIMELINE_URL.format(zone_id=1209, page=3): listing([4, 5]),
+                                       TIMELINE_URL.format(zone_id=1209, page=4): listing([6])})
+            category = CategoryScreenTransition(category_url, "Thể thao", None, scheduler)
+            assert category.extract_news_static()
+            # Page 3 only repeats items, so the listing stops there without asking for page 4
+            assert scheduler.requested == [category_url] + [TIMELINE_URL.format(zone_id=1209, page=page)
+                                                            for page in (2, 3)], marker
+            assert category.news_titles == [f"Tin {n}" for n in range(1, 6)]
+            assert category.news_comment_counts[URL + "tin-4-20240305081500004.htm"] == 4
+
+        # Without a zone id the listing is left to the browser
+        scheduler = StubScheduler({category_url: listing([1])})
+        assert not CategoryScreenTransition(category_url, "Thể thao", None, scheduler).extract_news_static()
+        assert scheduler.requested == [category_url]
+    finally:
+        max_comments = saved_max_comments
+
+    print("Static category listing OK")
+
+def run_crawler(args):
+    comment_api = COMMENT_API
+    if args.base_url:
+        use_base_url(args.base_url)
+        comment_api = replay_url(COMMENT_API, args.base_url)
+    # Each process records to its own archive
+    archive = None
+    if args.record:
+        archive = ArchiveWriter(args.record if args.processes == 1 else f"{args.record}.{os.getpid()}")
+    frontier = Frontier(args.frontier_db, max_retries=MAX_TASK_RETRIES + 1)
+    scheduler = RequestScheduler(make_session(pool_size=max(10, args.workers * 2 + args.media_workers), archive=archive))
+    downloader = MediaDownloader(scheduler, max_workers=args.media_workers)
+    state = CrawlState(args.state_db, force=args.full)
+    comment_harvester = CommentHarvester(scheduler, max_workers=args.comment_workers, api_url=comment_api)
+    corpus = None if args.json_files else CorpusWriter(args.corpus, compression=args.compression, batch_size=16)
+    pool = CrawlPool(args.workers, frontier, scheduler, downloader, state, comment_harvester, corpus,
+                     headless=not args.no_headless, use_browser=not args.no_browser)
+    pool.run()
+    print("Waiting for media downloads to finish")
+    downloader.close()
+    comment_harvester.close()
+    if corpus is not None:
+        corpus.close()
+    state.close()
+    frontier.close()
+    scheduler.close()
+    if archive is not None:
+        archive.close()
+        print(f"[{os.getpid()}] Recorded {archive.records} responses to {archive.path}")
+
+    print(f"[{os.getpid()}] Total items collected: {pool.items_saved}")
+    print(f"[{os.getpid()}] Total items skipped as unchanged: {pool.items_skipped}")
+    print(f"[{os.getpid()}] Total items failed: {pool.items_failed}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crawl tuoitre.vn news articles")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="number of parallel browser workers per process")
+    parser.add_argument("-p", "--processes", type=int, default=1, help="number of crawler processes sharing the frontier")
+    parser.add_argument("--media-workers", type=int, default=8, help="number of concurrent media downloads")
+    parser.add_argument("--comment-workers", type=int, default=4, help="number of comment pages fetched concurrently")
+    parser.add_argument("--corpus", default=CORPUS_DIR, help="directory of the JSONL article corpus")
+    parser.add_argument("--compression", choices=["gzip", "zstd"], default="gzip", help="compression of corpus shards")
+    parser.add_argument("--json-files", action="store_true", help="write one data/<postId>.json per article instead")
+    parser.add_argument("--state-db", default=STATE_DB, help="SQLite file recording already crawled articles")
+    parser.add_argument("--frontier-db", default=FRONTIER_DB, help="SQLite file holding the crawl frontier")
+    parser.add_argument("--fresh", action="store_true", help="start a new crawl instead of resuming the frontier")
+    parser.add_argument("--retry-failed", action="store_true", help="requeue items that failed in earlier runs")
+    parser.add_argument("--full", action="store_true", help="re-crawl every article even if the crawl state has it")
+    parser.add_argument("--no-headless", action="store_true", help="show the browser windows")
+    parser.add_argument("--no-browser", action="store_true", help="crawl with plain HTTP only, never start Chrome")
+    parser.add_argument("--base-url", default=None, help="crawl this copy of the site, e.g. a replay.py server")
+    parser.add_argument("--record", default=None, help="record every HTTP response to this WARC-style archive")
+    args = parser.parse_args()
+    if args.base_url:
+        use_base_url(args.base_url)
+
+    frontier = Frontier(args.frontier_db)
+    if args.fresh:
+        frontier.clear()
+    if args.retry_failed:
+        frontier.retry_failed()
+    # Listings are expanded on every run, so a daily run finds the articles published since the last one
+    frontier.reseed(URL)
+    print(f"Frontier: {frontier.counts()}")
+    frontier.close()
+
+    if args.processes > 1:
+        processes = [multiprocessing.Process(target=run_crawler, args=(args,)) for _ in range(args.processes)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+    else:
+        run_crawler(args)
+
+    frontier = Frontier(args.frontier_db)
+    print(f"Frontier: {frontier.counts()}")
+    frontier.close()
     print("Done extracting news!")
-    driver.quit()
\ No newline at end of file
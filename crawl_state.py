@@ -0,0 +1,95 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+# CONSTANTS
+STATE_DB = os.path.join("data", "crawl_state.db")
+# Articles without a known comment count are re-fetched after this many seconds
+RECHECK_AFTER = 7 * 24 * 3600
+
+def content_hash(news_dict):
+    """Hash the fields of an article that only change when the article itself is edited."""
+    digest = hashlib.sha1()
+    for field in ("title", "content", "author", "date", "audio_podcast"):
+        digest.update((news_dict.get(field) or "").encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def count_comments(comments):
+    if not comments:
+        return 0
+    return sum(1 + len(comment.get('replies') or []) for comment in comments)
+
+class CrawlState:
+    """Persistent record of crawled articles, keyed by postId."""
+
+    def __init__(self, path=STATE_DB, recheck_after=RECHECK_AFTER, force=False):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.recheck_after = recheck_after
+        self.force = force
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS articles ("
+            "post_id TEXT PRIMARY KEY, url TEXT, fetched_at REAL, "
+            "content_hash TEXT, comment_count INTEGER)"
+        )
+        self.conn.commit()
+
+    def get(self, post_id):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT post_id, url, fetched_at, content_hash, comment_count FROM articles WHERE post_id = ?",
+                (post_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("post_id", "url", "fetched_at", "content_hash", "comment_count"), row))
+
+    def plan(self, post_id, comment_count=None):
+        """Return 'full', 'comments' or 'skip' for an article seen on a listing page."""
+        if self.force or post_id is None:
+            return "full"
+        row = self.get(post_id)
+        if row is None:
+            return "full"
+        if comment_count is None:
+            # The listing did not show a count, fall back to the age of our copy
+            if time.time() - row["fetched_at"] > self.recheck_after:
+                return "full"
+            return "skip"
+        if comment_count > (row["comment_count"] or 0):
+            return "comments"
+        return "skip"
+
+    def unchanged(self, post_id, content_hash, comment_count):
+        """True if a re-fetched article matches the stored copy, so it need not be written again."""
+        if self.force or post_id is None:
+            return False
+        row = self.get(post_id)
+        return row is not None and row["content_hash"] == content_hash and row["comment_count"] == comment_count
+
+    def touch(self, post_id):
+        # The stored copy was just confirmed current, restart its recheck clock
+        with self.lock:
+            self.conn.execute("UPDATE articles SET fetched_at = ? WHERE post_id = ?", (time.time(), post_id))
+            self.conn.commit()
+
+    def record(self, post_id, url, content_hash, comment_count):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO articles (post_id, url, fetched_at, content_hash, comment_count) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (post_id, url, time.time(), content_hash, comment_count),
+            )
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,94 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# CONSTANTS
+CHUNK_SIZE = 64 * 1024
+DOWNLOAD_TIMEOUT = 30
+
+def download_file(scheduler, url, path, label, timeout=DOWNLOAD_TIMEOUT):
+    """Stream url to path through a temp file, so a partial download never shows up as the real file."""
+    tmp_path = f"{path}.part"
+    try:
+        with scheduler.get(url, stream=True, timeout=timeout) as response:
+            if response.status_code != 200:
+                print(f"Failed to download {label}: Status code {response.status_code}")
+                return False
+
+            directory = os.path.dirname(path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory, exist_ok=True)
+
+            with open(tmp_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    f.write(chunk)
+        os.replace(tmp_path, path)
+        print(f"Saved {label} to {path}")
+        return True
+    except (requests.RequestException, OSError) as e:
+        print(f"Error saving {label}: {str(e)}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+
+class MediaDownloader:
+    """Background media downloads with bounded concurrency and per-article completion."""
+
+    def __init__(self, scheduler, max_workers=8, on_article_done=None):
+        self.scheduler = scheduler
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="media")
+        self.on_article_done = on_article_done
+        self.lock = threading.Lock()
+        self.articles = {}
+        self.finished = threading.Condition(self.lock)
+
+    def submit(self, article_id, url, path, label):
+        with self.lock:
+            state = self.articles.setdefault(article_id, {'total': 0, 'done': 0, 'ok': 0, 'closed': False})
+            state['total'] += 1
+        future = self.executor.submit(download_file, self.scheduler, url, path, label)
+        future.add_done_callback(lambda f: self._file_done(article_id, f))
+        return future
+
+    def _file_done(self, article_id, future):
+        with self.lock:
+            state = self.articles[article_id]
+            state['done'] += 1
+            if not future.cancelled() and future.exception() is None and future.result():
+                state['ok'] += 1
+            complete = self._pop_if_complete(article_id)
+        if complete:
+            self._report(article_id, complete)
+
+    def finish_article(self, article_id):
+        """Mark that no more media will be submitted for article_id."""
+        with self.lock:
+            state = self.articles.setdefault(article_id, {'total': 0, 'done': 0, 'ok': 0, 'closed': False})
+            state['closed'] = True
+            complete = self._pop_if_complete(article_id)
+        if complete:
+            self._report(article_id, complete)
+
+    def _pop_if_complete(self, article_id):
+        state = self.articles[article_id]
+        if state['closed'] and state['done'] == state['total']:
+            del self.articles[article_id]
+            self.finished.notify_all()
+            return state
+        return None
+
+    def _report(self, article_id, state):
+        if state['total']:
+            print(f"Downloaded {state['ok']}/{state['total']} media files for {article_id}")
+        if self.on_article_done:
+            self.on_article_done(article_id, state['ok'], state['total'])
+
+    def wait_article(self, article_id, timeout=None):
+        """Block until every media file of a finished article is on disk."""
+        with self.lock:
+            return self.finished.wait_for(lambda: article_id not in self.articles, timeout)
+
+    def close(self, wait=True):
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,219 @@
+import os
+import sqlite3
+import threading
+import time
+
+# CONSTANTS
+FRONTIER_DB = os.path.join("data", "frontier.db")
+LEASE_TIMEOUT = 600
+MAX_RETRIES = 3
+
+PENDING = "pending"
+IN_FLIGHT = "in_flight"
+DONE = "done"
+FAILED = "failed"
+
+# Drain articles before expanding more listings so the frontier stays small
+KIND_PRIORITY = {"article": 0, "category": 1, "home": 2}
+
+class Frontier:
+    """Durable crawl queue shared by every worker thread and process using the same file.
+
+    The file runs in WAL mode, which needs memory shared between its users, so every
+    crawler must run on the machine holding it; it must not live on a network filesystem.
+    """
+
+    def __init__(self, path=FRONTIER_DB, lease_timeout=LEASE_TIMEOUT, max_retries=MAX_RETRIES):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.lease_timeout = lease_timeout
+        self.max_retries = max_retries
+        self.lock = threading.Lock()
+        # Autocommit mode, transactions are opened explicitly where they matter
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS items ("
+            "url TEXT PRIMARY KEY, kind TEXT NOT NULL, category TEXT, comment_count INTEGER, "
+            "priority INTEGER NOT NULL, state TEXT NOT NULL, retries INTEGER NOT NULL DEFAULT 0, "
+            "lease_owner TEXT, lease_until REAL, updated_at REAL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS items_state ON items (state, priority)")
+
+    def add(self, kind, url, category=None, comment_count=None):
+        """Queue url unless it is already known. Returns True if it was new."""
+        with self.lock:
+            cursor = self.conn.execute(
+                "INSERT OR IGNORE INTO items (url, kind, category, comment_count, priority, state, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, kind, category, comment_count, KIND_PRIORITY.get(kind, 0), PENDING, time.time()),
+            )
+            return cursor.rowcount == 1
+
+    def lease(self, owner):
+        """Claim the next pending item, or one whose lease ran out, for owner."""
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(
+                    "SELECT url, kind, category, comment_count, retries FROM items "
+                    "WHERE state = ? OR (state = ? AND lease_until < ?) "
+                    "ORDER BY priority, rowid LIMIT 1",
+                    (PENDING, IN_FLIGHT, now),
+                ).fetchone()
+                if row is not None:
+                    self.conn.execute(
+                        "UPDATE items SET state = ?, lease_owner = ?, lease_until = ?, updated_at = ? WHERE url = ?",
+                        (IN_FLIGHT, owner, now + self.lease_timeout, now, row[0]),
+                    )
+                self.conn.execute("COMMIT")
+            except sqlite3.Error:
+                self.conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return dict(zip(("url", "kind", "category", "comment_count", "retries"), row))
+
+    def done(self, url):
+        self._set_state(url, DONE)
+
+    def fail(self, url):
+        """Put url back in the queue, or mark it failed once it ran out of retries."""
+        with self.lock:
+            self.conn.execute(
+                "UPDATE items SET retries = retries + 1, lease_owner = NULL, lease_until = NULL, updated_at = ?, "
+                "state = CASE WHEN retries + 1 >= ? THEN ? ELSE ? END WHERE url = ?",
+                (time.time(), self.max_retries, FAILED, PENDING, url),
+            )
+            row = self.conn.execute("SELECT state FROM items WHERE url = ?", (url,)).fetchone()
+        return row[0] if row else None
+
+    def release(self, url):
+        """Hand an unfinished item back without counting it as a failure."""
+        self._set_state(url, PENDING)
+
+    def _set_state(self, url, state):
+        with self.lock:
+            self.conn.execute(
+                "UPDATE items SET state = ?, lease_owner = NULL, lease_until = NULL, updated_at = ? WHERE url = ?",
+                (state, time.time(), url),
+            )
+
+    def counts(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT state, COUNT(*) FROM items GROUP BY state").fetchall()
+        counts = {PENDING: 0, IN_FLIGHT: 0, DONE: 0, FAILED: 0}
+        counts.update(dict(rows))
+        return counts
+
+    def has_work(self):
+        counts = self.counts()
+        return counts[PENDING] + counts[IN_FLIGHT] > 0
+
+    def retry_failed(self):
+        with self.lock:
+            self.conn.execute(
+                "UPDATE items SET state = ?, retries = 0, updated_at = ? WHERE state = ?",
+                (PENDING, time.time(), FAILED),
+            )
+
+    def reseed(self, home_url):
+        """Queue the home page and every known category page again at the start of a run.
+
+        Once the previous run has drained the frontier its finished articles are dropped as
+        well, so the listings queue them again and the crawl state decides what to re-fetch.
+        An interrupted run keeps them and resumes.
+        """
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                busy = self.conn.execute(
+                    "SELECT COUNT(*) FROM items WHERE state IN (?, ?)", (PENDING, IN_FLIGHT)
+                ).fetchone()[0]
+                if not busy:
+                    self.conn.execute("DELETE FROM items WHERE kind = 'article' AND state = ?", (DONE,))
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO items (url, kind, priority, state, updated_at) VALUES (?, ?, ?, ?, ?)",
+                    (home_url, "home", KIND_PRIORITY["home"], PENDING, now),
+                )
+                self.conn.execute(
+                    "UPDATE items SET state = ?, retries = 0, updated_at = ? "
+                    "WHERE kind IN ('home', 'category') AND state = ?",
+                    (PENDING, now, DONE),
+                )
+                self.conn.execute("COMMIT")
+            except sqlite3.Error:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM items")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+def test_frontier():
+    """Check leasing, lease expiry, retries and reseeding on a temporary frontier file."""
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "frontier.db")
+        frontier = Frontier(path, max_retries=3)
+        frontier.reseed("home")
+        assert frontier.add("category", "c1", "Thời sự") and not frontier.add("category", "c1", "Thời sự")
+        for i in range(50):
+            frontier.add("article", f"a{i}", "Thời sự", i)
+
+        # Workers on two connections to the file never lease the same item
+        other = Frontier(path, max_retries=3)
+        def drain(args):
+            store, owner = args
+            leased = []
+            while (item := store.lease(owner)) is not None:
+                leased.append(item["url"])
+            return leased
+        with ThreadPoolExecutor(4) as pool:
+            batches = list(pool.map(drain, [(frontier, "w0"), (frontier, "w1"), (other, "w2"), (other, "w3")]))
+        leased = [url for batch in batches for url in batch]
+        assert sorted(leased) == sorted([f"a{i}" for i in range(50)] + ["c1", "home"])
+        assert frontier.counts()[IN_FLIGHT] == 52
+        other.close()
+
+        # An expired lease can be claimed again by another worker
+        frontier.release("a0")
+        short = Frontier(path, lease_timeout=-1, max_retries=3)
+        assert short.lease("dead")["url"] == "a0"
+        item = frontier.lease("alive")
+        assert item["url"] == "a0" and item["comment_count"] == 0
+        short.close()
+
+        # Failures go back to pending until the retries run out, --retry-failed requeues them
+        assert frontier.fail("a0") == PENDING
+        assert frontier.lease("w")["url"] == "a0" and frontier.fail("a0") == PENDING
+        assert frontier.lease("w")["url"] == "a0" and frontier.fail("a0") == FAILED
+        assert frontier.lease("w") is None and frontier.counts()[FAILED] == 1
+        frontier.retry_failed()
+        item = frontier.lease("w")
+        assert item["url"] == "a0" and item["retries"] == 0
+
+        # Reseeding an unfinished run keeps its done articles and requeues the listings
+        for url in [f"a{i}" for i in range(49)] + ["c1", "home"]:
+            frontier.done(url)
+        frontier.reseed("home")
+        assert frontier.counts() == {PENDING: 2, IN_FLIGHT: 1, DONE: 49, FAILED: 0}
+        # After a finished run the done articles are dropped so the listings queue them again
+        frontier.done("a49")
+        while (item := frontier.lease("w")) is not None:
+            frontier.done(item["url"])
+        frontier.reseed("home")
+        assert frontier.counts() == {PENDING: 2, IN_FLIGHT: 0, DONE: 0, FAILED: 0}
+        assert frontier.add("article", "a0")
+        frontier.close()
+
+    print("Frontier OK")
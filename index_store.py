@@ -0,0 +1,617 @@
+import json
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+from collections.abc import MutableMapping
+
+import numpy as np
+
+# CONSTANTS
+MAGIC = b"TTIDX\0"
+FORMAT_VERSION = 5
+HEADER = struct.Struct("<6sHQ")  # magic, version, length of the JSON table of contents
+ALIGNMENT = 8
+# The article fields search needs; comments and everything else are never kept
+DOC_FIELDS = ("title", "content", "date")
+
+def document_meta(doc):
+    return {field: doc.get(field) for field in DOC_FIELDS}
+
+def varbyte_encode(values):
+    """Variable-byte encode non-negative integers: 7 bits per byte, low bits first,
+    high bit set on every byte but the last of a value."""
+    values = np.asarray(values, dtype=np.uint64)
+    lengths = np.ones(values.size, dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        lengths += rest > 0
+        rest >>= np.uint64(7)
+    starts = np.cumsum(lengths) - lengths
+    position = np.arange(int(lengths.sum())) - np.repeat(starts, lengths)
+    encoded = ((np.repeat(values, lengths) >> (np.uint64(7) * position.astype(np.uint64))) & np.uint64(0x7F)).astype(np.uint8)
+    encoded[position < np.repeat(lengths, lengths) - 1] |= 0x80
+    return encoded
+
+def varbyte_decode(data):
+    data = np.asarray(data, dtype=np.uint8)
+    if not data.size:
+        return np.zeros(0, dtype=np.uint64)
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    position = np.arange(data.size) - np.repeat(starts, ends - starts + 1)
+    parts = (data & 0x7F).astype(np.uint64) << (np.uint64(7) * position.astype(np.uint64))
+    return np.add.reduceat(parts, starts)
+
+def varbyte_append(buffer, value):
+    while value >= 0x80:
+        buffer.append(value & 0x7F | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+def decode_postings(doc_bytes, tf_bytes):
+    """Doc numbers (delta encoded, the first one from 0) and term frequencies of one posting list."""
+    return np.cumsum(varbyte_decode(doc_bytes)), varbyte_decode(tf_bytes)
+
+def decode_runs(data, counts):
+    """Decode runs of delta gaps that restart from 0 every counts[i] values."""
+    totals = np.cumsum(varbyte_decode(data))
+    counts = np.asarray(counts, dtype=np.int64)
+    starts = np.cumsum(counts) - counts
+    # Subtract the running total reached before each run
+    before = np.zeros(starts.size, dtype=np.uint64)
+    before[starts > 0] = totals[starts[starts > 0] - 1]
+    return totals - np.repeat(before, counts)
+
+def split_positions(doc_ids, positions, tfs):
+    """{doc_id: positions} from the concatenated positions of a posting list, tf of them per document."""
+    return dict(zip(doc_ids, np.split(positions, np.cumsum(tfs)[:-1]) if len(doc_ids) else []))
+
+def encode_strings(strings):
+    """Pack strings into one UTF-8 blob plus an offsets array, so lookups never build Python objects."""
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+    if encoded:
+        offsets[1:] = np.cumsum([len(b) for b in encoded], dtype=np.uint64)
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+def write_index(path, terms, postings, positions, doc_ids, doc_norms, doc_timestamps, doc_meta, doc_sources,
+                header_fields):
+    """Write the index atomically.
+
+    terms: sorted list of terms; postings: {term: {doc_id: raw term frequency}};
+    positions: function term -> {doc_id: token positions}, as many positions as the term frequency;
+    doc_ids: list of document ids; doc_norms: {doc_id: norm};
+    doc_timestamps: {doc_id: parsed date in seconds, or None if it has no valid date};
+    doc_meta: {doc_id: dict of fields needed to display a result};
+    doc_sources: {doc_id: signature of the file the document was read from};
+    header_fields: extra JSON fields for the table of contents (fingerprints).
+    """
+    doc_numbers = {doc_id: number for number, doc_id in enumerate(doc_ids)}
+
+    # Posting lists are sorted by doc number and stored as variable-byte delta gaps; term
+    # frequencies are small integers, mostly one byte each. Each posting's token positions
+    # are delta gaps too, restarting from 0 for every document.
+    posting_offsets = np.zeros(len(terms) + 1, dtype=np.uint64)
+    doc_byte_offsets = np.zeros(len(terms) + 1, dtype=np.uint64)
+    tf_byte_offsets = np.zeros(len(terms) + 1, dtype=np.uint64)
+    pos_byte_offsets = np.zeros(len(terms) + 1, dtype=np.uint64)
+    doc_chunks = []
+    tf_chunks = []
+    pos_chunks = []
+    for i, term in enumerate(terms):
+        term_postings = sorted((doc_numbers[doc_id], tf, doc_id) for doc_id, tf in postings[term].items())
+        numbers = np.array([number for number, _, _ in term_postings], dtype=np.uint64)
+        doc_chunks.append(varbyte_encode(np.diff(numbers, prepend=np.uint64(0))))
+        tf_chunks.append(varbyte_encode([tf for _, tf, _ in term_postings]))
+        gaps = []
+        term_positions = positions(term)
+        for _, tf, doc_id in term_postings:
+            doc_positions = np.asarray(term_positions[doc_id], dtype=np.uint64)
+            if doc_positions.size != tf:
+                raise ValueError(f"positions of {term!r} in {doc_id} do not match its term frequency")
+            gaps.append(np.diff(doc_positions, prepend=np.uint64(0)))
+        pos_chunks.append(varbyte_encode(np.concatenate(gaps) if gaps else []))
+        posting_offsets[i + 1] = posting_offsets[i] + len(term_postings)
+        doc_byte_offsets[i + 1] = doc_byte_offsets[i] + doc_chunks[-1].size
+        tf_byte_offsets[i + 1] = tf_byte_offsets[i] + tf_chunks[-1].size
+        pos_byte_offsets[i + 1] = pos_byte_offsets[i] + pos_chunks[-1].size
+
+    term_blob, term_offsets = encode_strings(terms)
+    doc_id_blob, doc_id_offsets = encode_strings(doc_ids)
+    meta_blob, meta_offsets = encode_strings(
+        [json.dumps(doc_meta[doc_id], ensure_ascii=False) for doc_id in doc_ids]
+    )
+    source_blob, source_offsets = encode_strings([doc_sources.get(doc_id) or "" for doc_id in doc_ids])
+    sections = {
+        "term_blob": term_blob,
+        "term_offsets": term_offsets,
+        "posting_offsets": posting_offsets,
+        "doc_byte_offsets": doc_byte_offsets,
+        "posting_doc_bytes": np.concatenate(doc_chunks) if doc_chunks else np.zeros(0, dtype=np.uint8),
+        "tf_byte_offsets": tf_byte_offsets,
+        "posting_tf_bytes": np.concatenate(tf_chunks) if tf_chunks else np.zeros(0, dtype=np.uint8),
+        "pos_byte_offsets": pos_byte_offsets,
+        "posting_pos_bytes": np.concatenate(pos_chunks) if pos_chunks else np.zeros(0, dtype=np.uint8),
+        "doc_norms": np.array([doc_norms.get(doc_id, 0.0) for doc_id in doc_ids], dtype=np.float64),
+        # NaN marks a document without a valid date
+        "doc_timestamps": np.array([np.nan if doc_timestamps.get(doc_id) is None else doc_timestamps[doc_id]
+                                    for doc_id in doc_ids], dtype=np.float64),
+        "doc_id_blob": doc_id_blob,
+        "doc_id_offsets": doc_id_offsets,
+        "meta_blob": meta_blob,
+        "meta_offsets": meta_offsets,
+        "source_blob": source_blob,
+        "source_offsets": source_offsets,
+    }
+
+    # Lay sections out after the header and table of contents, each aligned for zero-copy views
+    toc = dict(header_fields, num_terms=len(terms), num_docs=len(doc_ids), sections={})
+    offset = 0
+    for name, array in sections.items():
+        offset = -(-offset // ALIGNMENT) * ALIGNMENT
+        toc["sections"][name] = [offset, array.dtype.str, int(array.size)]
+        offset += array.nbytes
+    toc_bytes = json.dumps(toc).encode("utf-8")
+    data_start = -(-(HEADER.size + len(toc_bytes)) // ALIGNMENT) * ALIGNMENT
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(toc_bytes)))
+        f.write(toc_bytes)
+        for name, array in sections.items():
+            f.seek(data_start + toc["sections"][name][0])
+            f.write(array.tobytes())
+    os.replace(tmp_path, path)
+
+def read_header(path):
+    """Return the table of contents of an index file, or None if it is missing or of another version."""
+    try:
+        with open(path, "rb") as f:
+            magic, version, toc_length = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC or version != FORMAT_VERSION:
+                return None
+            return json.loads(f.read(toc_length))
+    except (OSError, struct.error, ValueError):
+        return None
+
+class IndexFile:
+    """Read-only view of an index file; every array is a view into the memory map."""
+
+    def __init__(self, path):
+        toc = read_header(path)
+        if toc is None:
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} index file")
+        self.path = path
+        self.toc = toc
+        self.num_terms = toc["num_terms"]
+        self.num_docs = toc["num_docs"]
+        with open(path, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        toc_length = HEADER.unpack(self.mmap[:HEADER.size])[2]
+        data_start = -(-(HEADER.size + toc_length) // ALIGNMENT) * ALIGNMENT
+        for name, (offset, dtype, count) in toc["sections"].items():
+            setattr(self, name, np.frombuffer(self.mmap, dtype=np.dtype(dtype), count=count,
+                                               offset=data_start + offset))
+
+    def close(self):
+        for name in self.toc["sections"]:
+            delattr(self, name)
+        try:
+            self.mmap.close()
+        except BufferError:
+            # A caller still holds a view; the map is released when that view goes away
+            pass
+
+    def string_at(self, blob, offsets, i):
+        return bytes(blob[int(offsets[i]):int(offsets[i + 1])]).decode("utf-8")
+
+    def term_at(self, i):
+        return self.string_at(self.term_blob, self.term_offsets, i)
+
+    def find_term(self, term):
+        # Binary search over the sorted term blob, comparing raw UTF-8 bytes
+        key = term.encode("utf-8")
+        lo, hi = 0, self.num_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            current = bytes(self.term_blob[int(self.term_offsets[mid]):int(self.term_offsets[mid + 1])])
+            if current < key:
+                lo = mid + 1
+            elif current > key:
+                hi = mid
+            else:
+                return mid
+        return -1
+
+    def doc_ids(self):
+        return [self.string_at(self.doc_id_blob, self.doc_id_offsets, i) for i in range(self.num_docs)]
+
+    def doc_sources(self):
+        return [self.string_at(self.source_blob, self.source_offsets, i) for i in range(self.num_docs)]
+
+    def timestamps(self):
+        return [None if np.isnan(ts) else ts for ts in self.doc_timestamps.tolist()]
+
+    def doc_meta(self, number):
+        return json.loads(self.string_at(self.meta_blob, self.meta_offsets, number))
+
+    def postings(self, term_number):
+        doc_start, doc_end = int(self.doc_byte_offsets[term_number]), int(self.doc_byte_offsets[term_number + 1])
+        tf_start, tf_end = int(self.tf_byte_offsets[term_number]), int(self.tf_byte_offsets[term_number + 1])
+        return decode_postings(self.posting_doc_bytes[doc_start:doc_end], self.posting_tf_bytes[tf_start:tf_end])
+
+    def positions(self, term_number, tfs):
+        """Token positions of every posting of a term, concatenated in doc number order."""
+        start, end = int(self.pos_byte_offsets[term_number]), int(self.pos_byte_offsets[term_number + 1])
+        return decode_runs(self.posting_pos_bytes[start:end], tfs)
+
+    def all_postings(self):
+        """Doc numbers and term frequencies of every posting list, concatenated in term order."""
+        # The doc number gaps restart at every term
+        docs = decode_runs(self.posting_doc_bytes, np.diff(self.posting_offsets))
+        return docs, varbyte_decode(self.posting_tf_bytes)
+
+class OverlayIndex(MutableMapping):
+    """term -> {doc_id: raw tf} over read-only integer-id posting lists with token positions,
+    plus in-memory overrides for changed terms.
+
+    Reading a term decodes a fresh dict. Documents are changed with add_document() and
+    remove_document(), which first copy the touched posting lists and their positions into
+    the overrides. Subclasses provide the base lists through base_number(), base_terms(),
+    base_postings(), base_positions() and base_arrays().
+    """
+
+    def __init__(self, doc_ids):
+        self.doc_ids = doc_ids
+        self.overrides = {}
+        self.position_overrides = {}
+
+    def decode(self, term):
+        number = self.base_number(term)
+        if number < 0:
+            return None
+        docs, tfs = self.base_postings(number)
+        return dict(zip([self.doc_ids[d] for d in docs.tolist()], tfs.tolist()))
+
+    def decode_positions(self, term):
+        number = self.base_number(term)
+        if number < 0:
+            return None
+        docs, tfs = self.base_postings(number)
+        return split_positions([self.doc_ids[d] for d in docs.tolist()], self.base_positions(number, tfs), tfs)
+
+    def positions(self, term):
+        """{doc_id: array of token positions} for a term, empty if it is not indexed."""
+        if term in self.position_overrides:
+            return self.position_overrides[term] or {}
+        return self.decode_positions(term) or {}
+
+    def override(self, term):
+        """Copy a term's postings and positions into the overrides, and return both."""
+        if self.overrides.get(term) is None:
+            postings = None if term in self.overrides else self.decode(term)
+            self.overrides[term] = postings if postings is not None else {}
+            self.position_overrides[term] = self.decode_positions(term) if postings is not None else {}
+        return self.overrides[term], self.position_overrides[term]
+
+    def __getitem__(self, term):
+        postings = self.overrides[term] if term in self.overrides else self.decode(term)
+        if postings is None:
+            raise KeyError(term)
+        return postings
+
+    def __contains__(self, term):
+        if term in self.overrides:
+            return self.overrides[term] is not None
+        return self.base_number(term) >= 0
+
+    def setdefault(self, term, default=None):
+        # Postings added this way have no positions, so phrase queries never match them
+        return self.override(term)[0]
+
+    def __setitem__(self, term, postings):
+        self.overrides[term] = postings
+        self.position_overrides[term] = {}
+
+    def __delitem__(self, term):
+        if term not in self:
+            raise KeyError(term)
+        self.overrides[term] = None
+        self.position_overrides[term] = None
+
+    def __iter__(self):
+        for term in self.base_terms():
+            if self.overrides.get(term, True) is not None:
+                yield term
+        for term, postings in self.overrides.items():
+            if postings is not None and self.base_number(term) < 0:
+                yield term
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def add_document(self, doc_id, term_positions):
+        """Index a document given {term: its token positions}."""
+        for term, positions in term_positions.items():
+            postings, term_positions_by_doc = self.override(term)
+            postings[doc_id] = len(positions)
+            term_positions_by_doc[doc_id] = np.asarray(positions, dtype=np.uint64)
+
+    def remove_document(self, doc_id, terms):
+        for term in terms:
+            if term not in self:
+                continue
+            postings, term_positions_by_doc = self.override(term)
+            postings.pop(doc_id, None)
+            term_positions_by_doc.pop(doc_id, None)
+            if not postings:
+                del self[term]
+
+    def base_square_sums(self, num_docs, idf_df=None):
+        """Sum of squared TF-IDF weights per base doc number, over terms without overrides.
+
+        idf_df gives the document frequency to compute each term's IDF from, if it is not
+        the length of the term's posting list here.
+        """
+        df, docs, tfs = self.base_arrays()
+        idf_df = df if idf_df is None else np.asarray(idf_df)
+        keep = np.ones(df.size, dtype=bool)
+        for term in self.overrides:
+            number = self.base_number(term)
+            if number >= 0:
+                keep[number] = False
+        posting_keep = np.repeat(keep, df)
+        idf = np.zeros(df.size)
+        idf[idf_df > 0] = 1 + np.log10(num_docs / idf_df[idf_df > 0])
+        tf = tfs[posting_keep].astype(np.float64)
+        weights = (1 + np.log10(tf)) * np.repeat(idf, df)[posting_keep]
+        return np.bincount(docs[posting_keep].astype(np.int64), weights=weights ** 2, minlength=len(self.doc_ids))
+
+class MappedIndex(OverlayIndex):
+    """OverlayIndex whose base posting lists are read from an index file's memory map."""
+
+    def __init__(self, index_file, doc_ids):
+        super().__init__(doc_ids)
+        self.file = index_file
+
+    def base_number(self, term):
+        return self.file.find_term(term)
+
+    def base_terms(self):
+        return (self.file.term_at(i) for i in range(self.file.num_terms))
+
+    def base_postings(self, number):
+        return self.file.postings(number)
+
+    def base_positions(self, number, tfs):
+        return self.file.positions(number, tfs)
+
+    def base_arrays(self):
+        docs, tfs = self.file.all_postings()
+        return np.diff(self.file.posting_offsets).astype(np.int64), docs, tfs
+
+class CompactIndex(OverlayIndex):
+    """OverlayIndex built in memory, with terms and documents interned to integer ids.
+
+    Each posting list is three bytearrays holding variable-byte doc number gaps, term
+    frequencies and token position gaps, a few bytes per posting instead of a dict entry.
+    New documents are appended to the lists; a document indexed again gets a new number,
+    since its old postings were moved to the overrides when it was removed.
+    """
+
+    def __init__(self):
+        super().__init__([])
+        self.term_numbers = {}
+        self.terms = []
+        self.doc_bytes = []
+        self.tf_bytes = []
+        self.pos_bytes = []
+        self.last_doc = array("I")
+        self.counts = array("I")
+
+    def base_number(self, term):
+        return self.term_numbers.get(term, -1)
+
+    def base_terms(self):
+        return iter(self.terms)
+
+    def base_postings(self, number):
+        return decode_postings(np.frombuffer(self.doc_bytes[number], dtype=np.uint8),
+                               np.frombuffer(self.tf_bytes[number], dtype=np.uint8))
+
+    def base_positions(self, number, tfs):
+        return decode_runs(np.frombuffer(self.pos_bytes[number], dtype=np.uint8), tfs)
+
+    def base_arrays(self):
+        docs, tfs = [], []
+        for number in range(len(self.terms)):
+            term_docs, term_tfs = self.base_postings(number)
+            docs.append(term_docs)
+            tfs.append(term_tfs)
+        if not docs:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.uint64)
+        return np.frombuffer(self.counts, dtype=np.uint32).astype(np.int64), np.concatenate(docs), np.concatenate(tfs)
+
+    def add_document(self, doc_id, term_positions):
+        doc_number = len(self.doc_ids)
+        self.doc_ids.append(doc_id)
+        for term, positions in term_positions.items():
+            if term in self.overrides:
+                postings, term_positions_by_doc = self.override(term)
+                postings[doc_id] = len(positions)
+                term_positions_by_doc[doc_id] = np.asarray(positions, dtype=np.uint64)
+                continue
+            number = self.term_numbers.get(term)
+            if number is None:
+                number = len(self.terms)
+                self.term_numbers[term] = number
+                self.terms.append(term)
+                self.doc_bytes.append(bytearray())
+                self.tf_bytes.append(bytearray())
+                self.pos_bytes.append(bytearray())
+                self.last_doc.append(0)
+                self.counts.append(0)
+            varbyte_append(self.doc_bytes[number], doc_number - self.last_doc[number])
+            varbyte_append(self.tf_bytes[number], len(positions))
+            previous = 0
+            for position in positions:
+                varbyte_append(self.pos_bytes[number], position - previous)
+                previous = position
+            self.last_doc[number] = doc_number
+            self.counts[number] += 1
+
+class MappedDocuments(MutableMapping):
+    """doc_id -> stored display fields, decoded from the memory map on access, with in-memory changes."""
+
+    def __init__(self, index_file, doc_ids):
+        self.file = index_file
+        self.doc_ids = doc_ids
+        self.numbers = {doc_id: number for number, doc_id in enumerate(doc_ids)}
+        self.changed = DocumentStore()
+        self.deleted = set()
+
+    def __getitem__(self, doc_id):
+        if doc_id in self.changed:
+            return self.changed[doc_id]
+        if doc_id in self.deleted or doc_id not in self.numbers:
+            raise KeyError(doc_id)
+        return self.file.doc_meta(self.numbers[doc_id])
+
+    def __contains__(self, doc_id):
+        return doc_id in self.changed or (doc_id in self.numbers and doc_id not in self.deleted)
+
+    def __setitem__(self, doc_id, doc):
+        self.deleted.discard(doc_id)
+        self.changed[doc_id] = doc
+
+    def __delitem__(self, doc_id):
+        if doc_id not in self:
+            raise KeyError(doc_id)
+        self.changed.pop(doc_id, None)
+        if doc_id in self.numbers:
+            self.deleted.add(doc_id)
+
+    def __iter__(self):
+        for doc_id in self.doc_ids:
+            if doc_id not in self.deleted:
+                yield doc_id
+        for doc_id in self.changed:
+            if doc_id not in self.numbers:
+                yield doc_id
+
+    def __len__(self):
+        added = sum(1 for doc_id in self.changed if doc_id not in self.numbers)
+        return len(self.doc_ids) - len(self.deleted) + added
+
+class DocumentStore(MutableMapping):
+    """doc_id -> display fields, appended to a temporary file and read back through a memory map.
+
+    Only the offset and length of each document stay in memory, and only the fields in
+    DOC_FIELDS are stored. Replaced and deleted documents leave dead bytes in the file,
+    which goes away with the store.
+    """
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        self.size = 0
+        self.mmap = None
+        self.locations = {}
+
+    def remap(self):
+        self.file.flush()
+        if self.mmap is not None:
+            self.mmap.close()
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __getitem__(self, doc_id):
+        offset, length = self.locations[doc_id]
+        if self.mmap is None or len(self.mmap) < offset + length:
+            # The document was appended after the file was last mapped
+            self.remap()
+        return json.loads(self.mmap[offset:offset + length])
+
+    def __contains__(self, doc_id):
+        return doc_id in self.locations
+
+    def __setitem__(self, doc_id, doc):
+        data = json.dumps(document_meta(doc), ensure_ascii=False).encode("utf-8")
+        self.file.write(data)
+        self.locations[doc_id] = (self.size, len(data))
+        self.size += len(data)
+
+    def __delitem__(self, doc_id):
+        del self.locations[doc_id]
+
+    def __iter__(self):
+        return iter(self.locations)
+
+    def __len__(self):
+        return len(self.locations)
+
+    def close(self):
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+        self.file.close()
+
+def test_document_store():
+    """Append, replace, delete and read back documents, including ones written after the file was mapped."""
+    store = DocumentStore()
+    try:
+        store["a.json"] = {"title": "Giá vàng", "content": "tăng mạnh", "date": "05/03/2024", "comments": [1, 2]}
+        store["b.json"] = {"title": "Bóng đá", "content": "", "date": None}
+        # Only the display fields are kept
+        assert store["a.json"] == {"title": "Giá vàng", "content": "tăng mạnh", "date": "05/03/2024"}
+        assert store.mmap is not None
+        # Appended after the file was mapped, so reading it remaps
+        store["c.json"] = {"title": "Giao thông"}
+        assert store["c.json"] == {"title": "Giao thông", "content": None, "date": None}
+        store["a.json"] = {"title": "Giá vàng giảm", "content": "", "date": ""}
+        del store["b.json"]
+        assert store["a.json"]["title"] == "Giá vàng giảm" and "b.json" not in store
+        assert sorted(store) == ["a.json", "c.json"] and len(store) == 2
+        assert store["c.json"]["title"] == "Giao thông"
+    finally:
+        store.close()
+    assert store.mmap is None and store.file.closed
+
+    print("Document store OK")
+
+def test_compact_index():
+    """CompactIndex postings survive the variable-byte round trip, with gaps and tfs over one byte."""
+    values = [0, 1, 127, 128, 255, 16383, 16384, 2 ** 21, 2 ** 32 + 5, 2 ** 63 - 1]
+    buffer = bytearray()
+    for value in values:
+        varbyte_append(buffer, value)
+    assert bytes(varbyte_encode(values)) == bytes(buffer)
+    assert varbyte_decode(np.frombuffer(buffer, dtype=np.uint8)).tolist() == values
+    assert decode_runs(varbyte_encode([3, 2, 7, 1, 1]), [2, 3]).tolist() == [3, 5, 7, 8, 9]
+
+    index = CompactIndex()
+    expected, expected_positions = {}, {}
+    for number in range(400):
+        doc_id = f"doc{number}.json"
+        term_positions = {"filler": [number]}
+        if number in (0, 1, 200, 399):
+            # tf 300 and position gaps of over two bytes in doc 200
+            positions = list(range(0, 300 * 70000, 70000)) if number == 200 else [number, number + 1000]
+            term_positions["giá"] = positions
+            expected[doc_id] = len(positions)
+            expected_positions[doc_id] = positions
+        index.add_document(doc_id, term_positions)
+
+    assert index["giá"] == expected and max(index["giá"].values()) == 300
+    assert {doc_id: positions.tolist() for doc_id, positions in index.positions("giá").items()} == expected_positions
+    assert len(index["filler"]) == 400 and index.positions("filler")["doc399.json"].tolist() == [399]
+    df, docs, tfs = index.base_arrays()
+    assert df.tolist() == [400, 4] and docs[400:].tolist() == [0, 1, 200, 399] and tfs[400:].tolist() == [2, 2, 300, 2]
+
+    # A removed document moves the term to the overrides; indexed again it gets a new number
+    index.remove_document("doc200.json", ["giá", "filler"])
+    index.add_document("doc200.json", {"giá": [5, 100000]})
+    assert index["giá"]["doc200.json"] == 2 and index.positions("giá")["doc200.json"].tolist() == [5, 100000]
+    assert index.doc_ids[-1] == "doc200.json" and len(index.doc_ids) == 401
+
+    print("Compact index OK")
@@ -0,0 +1,432 @@
+import argparse
+import glob
+import gzip
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import requests
+from requests.utils import requote_uri
+
+# CONSTANTS
+ARCHIVE = "crawl.warc.gz"
+INDEX_EXTENSION = ".idx"
+SITE_HOST = "tuoitre.vn"
+# Hop-by-hop and encoding headers; bodies are stored decoded, so these would be wrong on replay
+DROPPED_HEADERS = {"content-encoding", "transfer-encoding", "content-length", "connection", "keep-alive"}
+TEXT_TYPES = ("text/", "application/json", "application/javascript", "application/xml", "application/xhtml")
+CHUNK_SIZE = 64 * 1024
+# Streamed bodies are spooled in memory up to this size while recording, larger ones go to a temp file
+SPOOL_MEMORY = 1024 * 1024
+
+def archive_key(method, url):
+    # Scheme-less, percent-encoded like requests sends it and with the query sorted, so requests
+    # built from the same params always match
+    parts = urlsplit(requote_uri(url))
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return f"{method.upper()} {parts.hostname}{parts.path or '/'}{'?' + query if query else ''}"
+
+def replay_url(url, base_url, site_host=SITE_HOST):
+    """Where the replay server at base_url serves url: the site at its root, other hosts under /~host/."""
+    parts = urlsplit(url)
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    if parts.hostname == site_host:
+        return base_url.rstrip("/") + path
+    return f"{base_url.rstrip('/')}/~{parts.hostname}{path}"
+
+def parse_record(data):
+    """(url, status, reason, headers, body) of one decompressed archive record."""
+    warc_header, _, rest = data.partition(b"\r\n\r\n")
+    fields = dict(line.split(": ", 1) for line in warc_header.decode("utf-8").split("\r\n")[1:])
+    block = rest[:int(fields["Content-Length"])]
+    http_header, _, body = block.partition(b"\r\n\r\n")
+    lines = http_header.decode("latin-1").split("\r\n")
+    _, status, reason = (lines[0].split(" ", 2) + [""])[:3]
+    headers = [tuple(line.split(": ", 1)) for line in lines[1:] if ": " in line]
+    return fields["WARC-Target-URI"], int(status), reason, headers, body
+
+def archive_paths(paths=ARCHIVE):
+    """Archive files named by a path, a glob or a list of them, in sorted order.
+
+    A path also takes in the <path>.<pid> archives that a crawl with several processes records.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    found = []
+    for path in paths:
+        if any(c in path for c in "*?["):
+            matches = sorted(glob.glob(path))
+        else:
+            matches = [path] if os.path.exists(path) else []
+            matches += sorted(glob.glob(glob.escape(path) + ".*"), key=lambda match: match.rsplit(".", 1)[1])
+            matches = [match for match in matches if match == path or match.rsplit(".", 1)[1].isdigit()]
+        found += [match for match in matches if not match.endswith(INDEX_EXTENSION) and match not in found]
+    if not found:
+        raise FileNotFoundError(f"No archive matches {' '.join(paths)}")
+    return found
+
+class ArchiveWriter:
+    """Append HTTP responses to a WARC-style archive, one gzip member per record.
+
+    Each record is a WARC/1.1 response record wrapping the status line, headers and decoded
+    body. The sidecar index maps "METHOD host/path?query" to the record's offset and length,
+    so a replay server reads only the records it serves.
+    """
+
+    def __init__(self, path=ARCHIVE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, "ab")
+        self.index_file = open(path + INDEX_EXTENSION, "a", encoding="utf-8")
+        self.records = 0
+        self.bytes = 0
+
+    def record(self, method, url, status, reason, headers, body):
+        self.record_chunks(method, url, status, reason, headers, [body], len(body))
+
+    def record_chunks(self, method, url, status, reason, headers, chunks, length):
+        """Record a body of length bytes given as chunks, compressing it as it is written."""
+        http_header = f"HTTP/1.1 {status} {reason}\r\n"
+        for name, value in headers:
+            if name.lower() not in DROPPED_HEADERS:
+                http_header += f"{name}: {value}\r\n"
+        http_header += f"Content-Length: {length}\r\n\r\n"
+        http_header = http_header.encode("latin-1", "replace")
+        warc_header = (
+            "WARC/1.1\r\n"
+            "WARC-Type: response\r\n"
+            f"WARC-Record-ID: <urn:uuid:{uuid.uuid4()}>\r\n"
+            f"WARC-Date: {datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')}\r\n"
+            f"WARC-Target-URI: {url}\r\n"
+            f"WARC-Request-Method: {method.upper()}\r\n"
+            "Content-Type: application/http; msgtype=response\r\n"
+            f"Content-Length: {len(http_header) + length}\r\n\r\n"
+        )
+        # A gzip member must be contiguous, so the body is compressed straight into the archive under the lock
+        compressor = zlib.compressobj(wbits=31)
+        with self.lock:
+            offset = self.file.tell()
+            self.file.write(compressor.compress(warc_header.encode("utf-8") + http_header))
+            for chunk in chunks:
+                self.file.write(compressor.compress(chunk))
+            self.file.write(compressor.compress(b"\r\n\r\n") + compressor.flush())
+            self.file.flush()
+            self.index_file.write(f"{archive_key(method, url)}\t{offset}\t{self.file.tell() - offset}\n")
+            self.index_file.flush()
+            self.records += 1
+            self.bytes += length
+
+    def record_response(self, response):
+        # Only for responses whose body has been read already, streamed ones go through RecordingStream
+        self.record(response.request.method, response.request.url, response.status_code, response.reason or "",
+                    list(response.headers.items()), response.content)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+            self.index_file.close()
+
+class RecordingStream:
+    """Stands in for a streamed response's raw body, copying the decoded chunks to a spool file.
+
+    The response is recorded once its body has been read to the end, so a download keeps
+    streaming to disk while it is recorded. A body closed early is not recorded.
+    """
+
+    def __init__(self, archive, response):
+        self.archive = archive
+        self.response = response
+        self.raw = response.raw
+        self.spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY)
+        self.length = 0
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+    def stream(self, amt=CHUNK_SIZE, decode_content=None):
+        for chunk in self.raw.stream(amt, decode_content=decode_content):
+            self.copy(chunk)
+            yield chunk
+        self.finish()
+
+    def read(self, amt=None, decode_content=None, **kwargs):
+        data = self.raw.read(amt, decode_content=decode_content, **kwargs)
+        self.copy(data)
+        if not data or amt is None:
+            self.finish()
+        return data
+
+    def copy(self, chunk):
+        if self.spool is not None and chunk:
+            self.spool.write(chunk)
+            self.length += len(chunk)
+
+    def finish(self):
+        if self.spool is None:
+            return
+        spool, self.spool = self.spool, None
+        spool.seek(0)
+        response = self.response
+        self.archive.record_chunks(response.request.method, response.request.url, response.status_code,
+                                   response.reason or "", list(response.headers.items()),
+                                   iter(lambda: spool.read(CHUNK_SIZE), b""), self.length)
+        spool.close()
+
+    def close(self):
+        if self.spool is not None:
+            self.spool.close()
+            self.spool = None
+        self.raw.close()
+
+class RecordingSession(requests.Session):
+    """requests.Session that writes every response it receives, redirects included, to an archive."""
+
+    def __init__(self, archive):
+        super().__init__()
+        self.archive = archive
+
+    def request(self, method, url, *args, **kwargs):
+        response = super().request(method, url, *args, **kwargs)
+        # Redirect bodies are always read by requests, a streamed final body is recorded as it is read
+        for hop in response.history:
+            self.archive.record_response(hop)
+        if kwargs.get("stream"):
+            response.raw = RecordingStream(self.archive, response)
+        else:
+            self.archive.record_response(response)
+        return response
+
+class ArchiveReader:
+    """Random access by request key to the records of one or more archives (see archive_paths).
+
+    The latest record of a key wins, and across archives the one listed last wins.
+    """
+
+    def __init__(self, paths=ARCHIVE):
+        self.paths = archive_paths(paths)
+        self.lock = threading.Lock()
+        self.files = []
+        self.entries = {}
+        for number, path in enumerate(self.paths):
+            self.files.append(open(path, "rb"))
+            try:
+                with open(path + INDEX_EXTENSION, "r", encoding="utf-8") as f:
+                    for line in f:
+                        key, offset, length = line.rstrip("\n").split("\t")
+                        self.entries[key] = (number, int(offset), int(length))
+            except FileNotFoundError:
+                self.scan(number)
+
+    def scan(self, number):
+        # No sidecar index: walk the gzip members and read each record's target
+        data = self.files[number].read()
+        offset = 0
+        while offset < len(data):
+            decompressor = zlib.decompressobj(wbits=31)
+            record = decompressor.decompress(data[offset:])
+            length = len(data) - offset - len(decompressor.unused_data)
+            url, *_ = parse_record(record)
+            method = re.search(rb"WARC-Request-Method: (\w+)", record)
+            self.entries[archive_key(method.group(1).decode() if method else "GET", url)] = (number, offset, length)
+            offset += length
+
+    def __len__(self):
+        return len(self.entries)
+
+    def hosts(self):
+        return {key.split(" ", 1)[1].split("/", 1)[0] for key in self.entries}
+
+    def get(self, method, url):
+        """(status, reason, headers, body) recorded for the request, or None."""
+        entry = self.entries.get(archive_key(method, url))
+        if entry is None:
+            return None
+        number, offset, length = entry
+        with self.lock:
+            self.files[number].seek(offset)
+            member = self.files[number].read(length)
+        _, status, reason, headers, body = parse_record(gzip.decompress(member))
+        return status, reason, headers, body
+
+    def close(self):
+        for f in self.files:
+            f.close()
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.replay(self)
+
+    def log_message(self, format, *args):
+        pass
+
+class ReplayServer(ThreadingHTTPServer):
+    """Serve an archive over HTTP in place of the live site, so a crawl can run offline.
+
+    The site itself is served at the root and every other recorded host (CDN, comment API)
+    under /~host/. Absolute links to recorded hosts in text responses and redirects are
+    rewritten to point back here. latency adds a fixed delay to every response.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, archive_paths=ARCHIVE, address=("127.0.0.1", 0), site_host=SITE_HOST, latency=0.0):
+        super().__init__(address, ReplayHandler)
+        self.archive = ArchiveReader(archive_paths)
+        self.site_host = site_host
+        self.latency = latency
+        host, port = self.server_address[:2]
+        self.base_url = f"http://{host}:{port}/"
+        hosts = sorted(self.archive.hosts() | {site_host}, key=len, reverse=True)
+        self.link_pattern = re.compile(rb"(?:https?:)?//(" + b"|".join(re.escape(h.encode()) for h in hosts) +
+                                       rb")(?=[/\"'?#\s<]|$)")
+        self.lock = threading.Lock()
+        self.stats = Counter()
+
+    def original_url(self, path):
+        if path.startswith("/~"):
+            host, _, rest = path[2:].partition("/")
+            return f"https://{host}/{rest}"
+        return f"https://{self.site_host}{path}"
+
+    def rewrite_link(self, match):
+        host = match.group(1).decode()
+        return replay_url(f"https://{host}/", self.base_url, self.site_host).rstrip("/").encode()
+
+    def replay(self, handler):
+        if self.latency:
+            time.sleep(self.latency)
+        record = self.archive.get("GET", self.original_url(handler.path))
+        if record is None:
+            with self.lock:
+                self.stats["misses"] += 1
+            body = f"{handler.path} is not in the archive\n".encode("utf-8")
+            status, reason, headers = 404, "Not Found", [("Content-Type", "text/plain; charset=utf-8")]
+        else:
+            status, reason, headers, body = record
+            content_type = next((value for name, value in headers if name.lower() == "content-type"), "")
+            if content_type.startswith(TEXT_TYPES):
+                body = self.link_pattern.sub(self.rewrite_link, body)
+
+        handler.send_response(status, reason)
+        for name, value in headers:
+            if name.lower() == "location":
+                value = self.link_pattern.sub(self.rewrite_link, value.encode("latin-1")).decode("latin-1")
+            if name.lower() not in DROPPED_HEADERS:
+                handler.send_header(name, value)
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+        with self.lock:
+            self.stats["responses"] += 1
+            self.stats["bytes"] += len(body)
+
+    def start(self):
+        """Serve from a background thread and return the base URL to crawl."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self.base_url
+
+    def server_close(self):
+        super().server_close()
+        self.archive.close()
+
+def test_record_and_replay():
+    """Record a few responses, then fetch them back through the replay server with rewritten links."""
+    import tempfile
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "test.warc.gz")
+        archive = ArchiveWriter(path)
+        archive.record("GET", "https://tuoitre.vn/", 200, "OK", [("Content-Type", "text/html; charset=utf-8")],
+                       '<a href="https://tuoitre.vn/thời-sự.htm">x</a><img src="https://cdn.tuoitre.vn/a.jpg">'.encode())
+        archive.record("GET", "https://cdn.tuoitre.vn/a.jpg", 200, "OK", [("Content-Type", "image/jpeg")], b"\xff\xd8")
+        archive.record("GET", "https://id.tuoitre.vn/api?b=2&a=1", 200, "OK", [("Content-Type", "application/json")], b"{}")
+        archive.close()
+
+        # The sidecar index and a scan of the archive find the same records
+        reader = ArchiveReader(path)
+        os.remove(path + INDEX_EXTENSION)
+        assert ArchiveReader(path).entries == reader.entries
+        assert reader.get("GET", "https://id.tuoitre.vn/api?a=1&b=2")[3] == b"{}"
+
+        server = ReplayServer(path)
+        base_url = server.start()
+        try:
+            html = requests.get(base_url).text
+            assert f'href="{base_url}thời-sự.htm"' in html
+            assert f'src="{base_url}~cdn.tuoitre.vn/a.jpg"' in html
+            assert requests.get(replay_url("https://cdn.tuoitre.vn/a.jpg", base_url)).content == b"\xff\xd8"
+            assert requests.get(replay_url("https://id.tuoitre.vn/api?a=1&b=2", base_url)).json() == {}
+            assert requests.get(base_url + "missing.htm").status_code == 404
+            assert server.stats["misses"] == 1
+
+            # A recording session records streamed bodies as they are read, and not when closed early
+            recorded = ArchiveWriter(os.path.join(directory, "recorded.warc.gz"))
+            session = RecordingSession(recorded)
+            with session.get(base_url + "~cdn.tuoitre.vn/a.jpg", stream=True) as response:
+                assert b"".join(response.iter_content(chunk_size=1)) == b"\xff\xd8"
+            with session.get(base_url, stream=True) as response:
+                next(response.iter_content(chunk_size=4))
+            session.get(base_url + "~id.tuoitre.vn/api?a=1&b=2")
+            recorded.close()
+            recorded = ArchiveReader(recorded.path)
+            assert len(recorded) == 2 and recorded.get("GET", base_url) is None
+            assert recorded.get("GET", base_url + "~cdn.tuoitre.vn/a.jpg")[3] == b"\xff\xd8"
+            assert recorded.get("GET", base_url + "~id.tuoitre.vn/api?b=2&a=1")[3] == b"{}"
+            recorded.close()
+
+            # A crawl with several processes records one archive per process, replayed together
+            for pid, url in ((101, "https://tuoitre.vn/a.htm"), (102, "https://tuoitre.vn/b.htm")):
+                archive = ArchiveWriter(f"{path}.{pid}")
+                archive.record("GET", url, 200, "OK", [("Content-Type", "text/plain")], str(pid).encode())
+                archive.close()
+            combined = ArchiveReader(path)
+            assert combined.paths == [path, path + ".101", path + ".102"] and len(combined) == 5
+            assert combined.get("GET", "https://tuoitre.vn/b.htm")[3] == b"102"
+            assert combined.get("GET", "https://cdn.tuoitre.vn/a.jpg")[3] == b"\xff\xd8"
+            combined.close()
+            combined = ArchiveReader([path + ".1*"])
+            assert len(combined) == 2
+            combined.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+            reader.close()
+
+    print("Replay serves what was recorded")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve or inspect a recorded crawl archive")
+    parser.add_argument("archive", nargs="*", default=[ARCHIVE],
+                        help="archives or globs; crawl.warc.gz also reads the crawl.warc.gz.<pid> files of --processes")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="delay added to every response")
+    parser.add_argument("--info", action="store_true", help="print the records per host and exit")
+    args = parser.parse_args()
+
+    if args.info:
+        reader = ArchiveReader(args.archive)
+        per_host = Counter(key.split(" ", 1)[1].split("/", 1)[0] for key in reader.entries)
+        for host, count in per_host.most_common():
+            print(f"{host}: {count} records")
+        reader.close()
+    else:
+        server = ReplayServer(args.archive, (args.host, args.port), latency=args.latency_ms / 1000)
+        print(f"Replaying {len(server.archive)} records at {server.base_url}")
+        print(f"Crawl it with: python crawl.py --base-url {server.base_url} --no-browser")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        server.server_close()
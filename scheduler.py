@@ -0,0 +1,314 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+
+# CONSTANTS
+REQUEST_TIMEOUT = 10
+MAX_RETRIES = 4
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# (requests per second, burst, concurrent requests), matched on the longest host suffix
+HOST_LIMITS = {
+    "tuoitre.vn": (2, 4, 4),
+    "cdn.tuoitre.vn": (10, 20, 8),
+    "tuoitre.mediacdn.vn": (10, 20, 8),
+}
+DEFAULT_LIMITS = (5, 10, 4)
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class SlotRelease:
+    """Stands in for a streamed response's raw body, holding its host's connection slot.
+
+    The slot is given back once the body has been read to the end or the response is closed,
+    so a large download counts against the host's concurrency for as long as it runs.
+    """
+
+    def __init__(self, raw, semaphore):
+        self.raw = raw
+        self.semaphore = semaphore
+        self.lock = threading.Lock()
+        self.held = True
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+    def stream(self, amt=2 ** 16, decode_content=None):
+        yield from self.raw.stream(amt, decode_content=decode_content)
+        self.release()
+
+    def read(self, amt=None, decode_content=None, **kwargs):
+        data = self.raw.read(amt, decode_content=decode_content, **kwargs)
+        if not data or amt is None:
+            self.release()
+        return data
+
+    def release(self):
+        with self.lock:
+            if not self.held:
+                return
+            self.held = False
+        self.semaphore.release()
+
+    def release_conn(self):
+        # Response.close() calls this instead of close() once the body was consumed
+        self.release()
+        self.raw.release_conn()
+
+    def close(self):
+        self.release()
+        self.raw.close()
+
+class RequestScheduler:
+    """Single gate for crawler network calls: per-host rate and concurrency limits plus retries."""
+
+    def __init__(self, session=None, host_limits=None, max_retries=MAX_RETRIES,
+                 backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX, timeout=REQUEST_TIMEOUT):
+        self.session = session or requests.Session()
+        self.host_limits = HOST_LIMITS if host_limits is None else host_limits
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.hosts = {}
+
+    def limits_for(self, host):
+        best = None
+        for suffix, limits in self.host_limits.items():
+            if host == suffix or host.endswith("." + suffix):
+                if best is None or len(suffix) > len(best):
+                    best = suffix
+        return self.host_limits[best] if best else DEFAULT_LIMITS
+
+    def host_state(self, url):
+        host = urlparse(url).hostname or ""
+        with self.lock:
+            if host not in self.hosts:
+                rate, burst, concurrency = self.limits_for(host)
+                self.hosts[host] = (TokenBucket(rate, burst), threading.BoundedSemaphore(concurrency))
+            return self.hosts[host]
+
+    @contextmanager
+    def slot(self, url):
+        """Wait for a token and a free connection slot on url's host."""
+        bucket, semaphore = self.host_state(url)
+        bucket.acquire()
+        with semaphore:
+            yield
+
+    def backoff(self, attempt):
+        # Exponential backoff with jitter, so retrying workers do not hit the host in lockstep
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return random.uniform(delay / 2, delay)
+
+    def retry_after(self, response):
+        value = response.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return min(self.backoff_max, float(value))
+        except ValueError:
+            pass
+        try:
+            return min(self.backoff_max, max(0.0, parsedate_to_datetime(value).timestamp() - time.time()))
+        except (TypeError, ValueError):
+            return None
+
+    def send(self, method, url, **kwargs):
+        """One attempt under url's host limits; a streamed response keeps its slot until its body is done."""
+        bucket, semaphore = self.host_state(url)
+        bucket.acquire()
+        semaphore.acquire()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except BaseException:
+            semaphore.release()
+            raise
+        if kwargs.get("stream") and response.raw is not None:
+            response.raw = SlotRelease(response.raw, semaphore)
+        else:
+            semaphore.release()
+        return response
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        attempt = 0
+        while True:
+            try:
+                response = self.send(method, url, **kwargs)
+            except (requests.Timeout, requests.ConnectionError) as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff(attempt)
+                print(f"Retrying {url} in {delay:.1f}s after error: {str(e)}")
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    return response
+                delay = self.retry_after(response) or self.backoff(attempt)
+                print(f"Retrying {url} in {delay:.1f}s after status {response.status_code}")
+                response.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def navigate(self, driver, url):
+        """Load url in a browser under the same per-host limits as plain HTTP requests."""
+        with self.slot(url):
+            driver.get(url)
+
+    def pace(self, url):
+        """Take a token for a request the page itself will make, e.g. after clicking 'Xem thêm'."""
+        bucket, _ = self.host_state(url)
+        bucket.acquire()
+
+    def close(self):
+        self.session.close()
+
+def test_streamed_slot():
+    """A streamed response holds its host's connection slot until the body is read or closed."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class BodyHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = b"x" * 100000
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), BodyHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/file"
+    scheduler = RequestScheduler(host_limits={"127.0.0.1": (1000, 1000, 1)})
+    _, semaphore = scheduler.host_state(url)
+    try:
+        # Read to the end, through iter_content and through read()
+        response = scheduler.get(url, stream=True)
+        assert not semaphore.acquire(blocking=False)
+        assert len(b"".join(response.iter_content(chunk_size=4096))) == 100000
+        assert semaphore.acquire(blocking=False)
+        semaphore.release()
+        response.close()
+
+        response = scheduler.get(url, stream=True)
+        assert not semaphore.acquire(blocking=False)
+        while response.raw.read(30000):
+            pass
+        assert semaphore.acquire(blocking=False)
+        semaphore.release()
+
+        # Closed early, and closed after reading, the slot is given back once
+        with scheduler.get(url, stream=True) as response:
+            next(response.iter_content(chunk_size=10))
+            assert not semaphore.acquire(blocking=False)
+        assert semaphore.acquire(blocking=False)
+        semaphore.release()
+        with scheduler.get(url, stream=True) as response:
+            response.content
+        assert scheduler.get(url).content == b"x" * 100000
+        assert semaphore.acquire(blocking=False) and not semaphore.acquire(blocking=False)
+        semaphore.release()
+    finally:
+        scheduler.close()
+        server.shutdown()
+        server.server_close()
+
+    print("Streamed responses hold their slot")
+
+def test_rate_limits():
+    """Token bucket pacing, and retries that honour Retry-After, against a stub session."""
+    from email.utils import formatdate
+
+    # A full bucket serves its burst at once, then one request per 1/rate seconds
+    bucket = TokenBucket(rate=20, burst=5)
+    start = time.monotonic()
+    for _ in range(5):
+        bucket.acquire()
+    assert time.monotonic() - start < 0.05
+    for _ in range(5):
+        bucket.acquire()
+    assert time.monotonic() - start >= 0.2
+
+    class StubResponse:
+        def __init__(self, status_code, headers=None):
+            self.status_code = status_code
+            self.headers = headers or {}
+            self.raw = None
+            self.closed = False
+
+        def close(self):
+            self.closed = True
+
+    class StubSession:
+        def __init__(self, outcomes):
+            self.outcomes = list(outcomes)
+            self.calls = 0
+
+        def request(self, method, url, **kwargs):
+            self.calls += 1
+            outcome = self.outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        def close(self):
+            pass
+
+    scheduler = RequestScheduler(host_limits={}, backoff_base=0.01, backoff_max=0.3)
+    assert scheduler.retry_after(StubResponse(503, {"Retry-After": "0.2"})) == 0.2
+    assert scheduler.retry_after(StubResponse(503, {"Retry-After": "3600"})) == 0.3
+    assert 0 < scheduler.retry_after(StubResponse(503, {"Retry-After": formatdate(time.time() + 60, usegmt=True)})) <= 0.3
+    assert scheduler.retry_after(StubResponse(503, {"Retry-After": "soon"})) is None
+    assert scheduler.retry_after(StubResponse(503)) is None
+
+    # A throttled response is closed and retried after its Retry-After, other errors back off
+    throttled = StubResponse(503, {"Retry-After": "0.2"})
+    session = StubSession([throttled, requests.ConnectionError("reset"), StubResponse(429), StubResponse(200)])
+    scheduler.session = session
+    start = time.monotonic()
+    assert scheduler.get("http://example.test/").status_code == 200
+    assert time.monotonic() - start >= 0.2 and session.calls == 4 and throttled.closed
+
+    # Out of retries, the last response is returned, or the last error raised
+    scheduler.max_retries = 2
+    scheduler.session = StubSession([StubResponse(503)] * 3)
+    assert scheduler.get("http://example.test/").status_code == 503 and scheduler.session.calls == 3
+    scheduler.session = StubSession([requests.Timeout("slow")] * 3)
+    try:
+        scheduler.get("http://example.test/")
+        assert False, "expected the timeout to be raised"
+    except requests.Timeout:
+        assert scheduler.session.calls == 3
+
+    print("Rate limits and retries OK")
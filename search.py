@@ -1,21 +1,65 @@
+import argparse
+import bisect
+import hashlib
+import heapq
 import json
 import os
+import re
 import math
+import queue
 import numpy as np
-from typing import Dict, List, Set
-from collections import defaultdict
+from typing import Dict, List, Set, Tuple
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import tkinter as tk
 from tkinter import ttk, scrolledtext
-from pyvi import ViTokenizer
 from datetime import datetime
+from corpus import CorpusReader, is_corpus
+import index_store
+import sparse_search
+from token_cache import TOKEN_CACHE, TokenCache, Tokenizer, tokenize
+
+# Dates are stored as seconds since this naive epoch, so differences match datetime arithmetic
+EPOCH = datetime(1970, 1, 1)
+# Entries kept by the query result and query token caches
+RESULT_CACHE_SIZE = 1024
+QUERY_CACHE_SIZE = 4096
+# Quoted phrases ("...", '...' or “...”), NEAR/k operators and plain words of a query
+QUERY_PATTERN = re.compile(r'"([^"]*)"|\'([^\']*)\'|“([^”]*)”|\bNEAR/(\d+)\b|(\S+)')
+# Margin for float rounding when comparing upper bounds with the top-k threshold
+PRUNE_SLACK = 1e-9
 
 class SearchEngine:
-    def __init__(self, data_directory: str, stopwords_file: str):
+    def __init__(self, data_directory: str, stopwords_file: str, token_cache: str = None, workers: int = None):
         self.data_directory = data_directory
-        self.documents = {}
-        self.index = defaultdict(dict)
-        self.document_vectors = {}
+        # Only title, content and date are kept, in a memory-mapped file rather than in RAM
+        self.documents = index_store.DocumentStore()
+        self.stopwords_file = stopwords_file
+        # Terms and documents are interned to integer ids, posting lists are compressed bytes
+        self.index = index_store.CompactIndex()
+        self.doc_norms = {}
+        self.doc_positions = {}
+        self.term_bounds = {}
+        self.sparse_scorer = None
+        self.doc_sources = {}
+        self.doc_timestamps = {}
+        self.date_scores = {}
+        self.max_date_score = 0.0
+        self.date_keys = []
+        self.date_ids = []
+        self.date_order = []
+        self.norms_stale = False
+        self.dates_stale = False
+        # Bumped on every index change; cached results from an older generation are dropped
+        self.generation = 0
+        self.result_cache = OrderedDict()
+        self.result_cache_generation = 0
+        self.query_token_cache = OrderedDict()
+        self.cache_stats = defaultdict(int)
+        self.index_file = None
         self.stop_words = self.load_stopwords(stopwords_file)
+        # Document tokens are cached by text hash, so unchanged articles are never re-tokenized
+        self.tokenizer = Tokenizer(TokenCache(token_cache) if token_cache else None, workers)
         
     def load_stopwords(self, filepath: str) -> Set[str]:
         """Load Vietnamese stopwords from file."""
@@ -30,91 +74,502 @@ class SearchEngine:
         
     def preprocess_text(self, text: str) -> List[str]:
         """Tokenize and remove stop words from Vietnamese text."""
-        text = ViTokenizer.tokenize(text.lower())
-        tokens = text.split()
-        tokens = [token for token in tokens 
-                 if token.strip() and token not in self.stop_words]
-        return tokens
+        return self.remove_stopwords(tokenize(text))
+
+    def remove_stopwords(self, tokens: List[str]) -> List[str]:
+        return [token for token in tokens
+                if token.strip() and token not in self.stop_words]
+
+    def corpus_dirs(self) -> List[str]:
+        return [d for d in (self.data_directory, os.path.join(self.data_directory, 'corpus'))
+                if os.path.isdir(d) and is_corpus(d)]
+
+    def iter_documents(self):
+        """Yield (doc_id, document, source) from a JSONL corpus and data/*.json files.
+
+        source identifies the stored version of the document, sync() compares it to spot changes.
+        """
+        seen = set()
+        # Corpus shards are the newer copy of an article, so they take precedence
+        for corpus_dir in self.corpus_dirs():
+            reader = CorpusReader(corpus_dir)
+            for doc in reader:
+                doc_id = f"{doc['postId']}.json"
+                if doc_id not in seen:
+                    seen.add(doc_id)
+                    yield doc_id, doc, self.corpus_source(reader, doc['postId'])
 
-    def build_index(self):
-        """Build inverted index and calculate TF-IDF scores."""
-        doc_frequencies = defaultdict(int)
-        index_data = defaultdict(lambda: defaultdict(dict))
-        
-        # First pass: collect term frequencies
+        for filename in os.listdir(self.data_directory):
+            if filename.endswith('.json') and filename not in seen:
+                path = os.path.join(self.data_directory, filename)
+                with open(path, 'r', encoding='utf-8') as f:
+                    yield filename, json.load(f), self.file_source(path)
+
+    def corpus_source(self, reader: CorpusReader, post_id: str) -> str:
+        shard_name, offset, _, line_number, _ = reader.entries[str(post_id)]
+        return f"{shard_name}:{offset}:{line_number}"
+
+    def file_source(self, path: str) -> str:
+        stat = os.stat(path)
+        return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+    def document_sources(self) -> Dict[str, tuple]:
+        """Map doc_id -> (source, loader) without reading any document."""
+        sources = {}
         for filename in os.listdir(self.data_directory):
             if filename.endswith('.json'):
-                with open(os.path.join(self.data_directory, filename), 'r', encoding='utf-8') as f:
-                    doc = json.load(f)
-                    self.documents[filename] = doc
-                    
-                    text = f"{doc['title']} {doc['content']}"
-                    tokens = self.preprocess_text(text)
-                    
-                    # Calculate term frequencies for this document
-                    term_freq = defaultdict(int)
-                    for token in tokens:
-                        term_freq[token] += 1
-                        
-                    # Update document frequencies
-                    for token in set(tokens):
-                        doc_frequencies[token] += 1
-                        
-                    # Store raw term frequencies
-                    for token, freq in term_freq.items():
-                        self.index[token][filename] = freq
-                        index_data[filename][token]['tf'] = freq
-
-        # Calculate and store IDF and TF-IDF scores
-        num_docs = len(self.documents)
-        for term in self.index:
-            idf = 1 + math.log10(num_docs / doc_frequencies[term])
+                path = os.path.join(self.data_directory, filename)
+                sources[filename] = (self.file_source(path), lambda path=path: self.load_json(path))
+        for corpus_dir in self.corpus_dirs():
+            reader = CorpusReader(corpus_dir)
+            for post_id in reader.post_ids():
+                sources[f"{post_id}.json"] = (self.corpus_source(reader, post_id),
+                                              lambda reader=reader, post_id=post_id: reader.get(post_id))
+        return sources
+
+    def load_json(self, path: str) -> dict:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def build_index(self):
+        """Build inverted index of raw term frequencies; TF-IDF weights are derived at query time."""
+        self.close_index_file()
+        self.documents = index_store.DocumentStore()
+        # Terms and documents are interned to integer ids, posting lists are compressed bytes
+        self.index = index_store.CompactIndex()
+        self.doc_sources = {}
+        self.doc_timestamps = {}
+        self.generation += 1
+        # Documents are tokenized across a process pool in chunks, cached ones are not tokenized again
+        documents = ((self.document_text(doc), (filename, doc, source))
+                     for filename, doc, source in self.iter_documents())
+        for (filename, doc, source), tokens in self.tokenizer.tokenize_stream(documents):
+            self.index_document(filename, doc, tokens)
+            self.doc_sources[filename] = source
+        if self.tokenizer.cache is not None:
+            self.tokenizer.cache.retain(self.tokenizer.hashes_seen)
+        self.compute_doc_norms()
+        self.compute_dates()
+
+    def document_text(self, doc: dict) -> str:
+        return f"{doc['title']} {doc['content']}"
+
+    def document_tokens(self, doc: dict) -> List[str]:
+        return self.remove_stopwords(self.tokenizer.tokenize(self.document_text(doc)))
+
+    def index_document(self, doc_id: str, doc: dict, tokens: List[str] = None):
+        """Index a document; tokens is its pyvi output before stop word removal, if already known."""
+        self.documents[doc_id] = doc
+        if tokens is None:
+            tokens = self.tokenizer.tokenize(self.document_text(doc))
+        
+        # Positions count every token, stop words included, so phrases must match exactly
+        term_positions = defaultdict(list)
+        for position, token in enumerate(tokens):
+            if token.strip() and token not in self.stop_words:
+                term_positions[token].append(position)
             
-            for doc_id in self.index[term]:
-                raw_tf = self.index[term][doc_id]
-                tf = 1 + math.log10(raw_tf) if raw_tf > 0 else 0
-                tf_idf = tf * idf
-                
-                # Store in main index
-                self.index[term][doc_id] = tf_idf
-                
-                # Store in index_data for JSON
-                index_data[doc_id][term].update({
-                    'tf': tf,
-                    'idf': idf,
-                    'tf_idf': tf_idf
-                })
-
-        # Save index to JSON file
+        # Store raw term frequencies, the document frequency is the posting list length
+        if isinstance(self.index, index_store.OverlayIndex):
+            self.index.add_document(doc_id, term_positions)
+        else:
+            for token, positions in term_positions.items():
+                self.index.setdefault(token, {})[doc_id] = len(positions)
+        self.doc_timestamps[doc_id] = self.parse_timestamp(doc.get('date'))
+        self.norms_stale = True
+        self.dates_stale = True
+        self.generation += 1
+
+    def add_document(self, doc_id: str, doc: dict, source: str = None, tokens: List[str] = None):
+        """Add a document, or replace it if doc_id is already indexed."""
+        if doc_id in self.documents:
+            self.remove_document(doc_id)
+        self.index_document(doc_id, doc, tokens)
+        self.doc_sources[doc_id] = source
+
+    def update_document(self, doc_id: str, doc: dict, source: str = None, tokens: List[str] = None):
+        """Re-index a changed document."""
+        self.add_document(doc_id, doc, source, tokens)
+
+    def remove_document(self, doc_id: str) -> bool:
+        """Drop a document and its postings; returns False if it was not indexed."""
+        if doc_id not in self.documents:
+            return False
+        # Re-tokenizing the stored text tells which posting lists hold the document
+        terms = set(self.document_tokens(self.documents[doc_id]))
+        if isinstance(self.index, index_store.OverlayIndex):
+            self.index.remove_document(doc_id, terms)
+        else:
+            for token in terms:
+                if token in self.index:
+                    postings = self.index[token]
+                    postings.pop(doc_id, None)
+                    if not postings:
+                        del self.index[token]
+        del self.documents[doc_id]
+        self.doc_norms.pop(doc_id, None)
+        self.doc_sources.pop(doc_id, None)
+        self.doc_timestamps.pop(doc_id, None)
+        self.norms_stale = True
+        self.dates_stale = True
+        self.generation += 1
+        return True
+
+    def sync(self) -> bool:
+        """Index new and changed documents in data/ and drop deleted ones. Returns True if anything changed."""
+        sources = self.document_sources()
+        removed = [doc_id for doc_id in self.documents if doc_id not in sources]
+        for doc_id in removed:
+            self.remove_document(doc_id)
+
+        changed = 0
+        stale = ((doc_id, load(), source) for doc_id, (source, load) in sources.items()
+                 if self.doc_sources.get(doc_id) != source)
+        documents = ((self.document_text(doc), (doc_id, doc, source)) for doc_id, doc, source in stale)
+        for (doc_id, doc, source), tokens in self.tokenizer.tokenize_stream(documents):
+            self.update_document(doc_id, doc, source, tokens)
+            changed += 1
+        if changed or removed:
+            print(f"Index sync: {changed} added or changed, {len(removed)} removed")
+        return bool(changed or removed)
+
+    @staticmethod
+    def log_tf(raw_tf: int) -> float:
+        return 1 + math.log10(raw_tf) if raw_tf > 0 else 0
+
+    def idf(self, df: int) -> float:
+        return 1 + math.log10(self.corpus_size() / df)
+
+    def corpus_size(self) -> int:
+        """Number of documents IDF is computed over; a shard answers for the whole corpus."""
+        return len(self.documents)
+
+    def term_df(self, term: str, postings: dict) -> int:
+        """Number of documents containing the term, given its posting list in this index."""
+        return len(postings)
+
+    def base_dfs(self):
+        """Document frequencies of the OverlayIndex base terms by term number, None for their own lengths."""
+        return None
+
+    def latest_timestamp(self) -> float:
+        """Timestamp recency is measured from, None if no document has a valid date."""
+        return max((ts for ts in self.doc_timestamps.values() if ts is not None), default=None)
+
+    def compute_doc_norms(self):
+        """Compute each document vector's magnitude once, instead of on every query.
+
+        IDF depends on the corpus size, so norms go stale when documents change and are
+        recomputed lazily by the next search.
+        """
+        squares = defaultdict(float)
+        terms = self.index
+        if isinstance(self.index, index_store.OverlayIndex):
+            # Untouched posting lists are summed straight from the compact arrays; a document
+            # indexed again has an old doc number whose postings all moved to the overrides
+            base_sums = self.index.base_square_sums(self.corpus_size(), self.base_dfs())
+            for number, doc_id in enumerate(self.index.doc_ids):
+                squares[doc_id] += float(base_sums[number])
+            terms = {term: postings for term, postings in self.index.overrides.items() if postings is not None}
+        for term in terms:
+            postings = terms[term]
+            if not postings:
+                continue
+            idf = self.idf(self.term_df(term, postings))
+            for doc_id, raw_tf in postings.items():
+                squares[doc_id] += (self.log_tf(raw_tf) * idf) ** 2
+        self.doc_norms = {doc_id: math.sqrt(squares[doc_id]) for doc_id in self.documents}
+        # Search results break score ties by document order
+        self.doc_positions = {doc_id: position for position, doc_id in enumerate(self.documents)}
+        self.term_bounds = {}
+        self.sparse_scorer = None
+        self.norms_stale = False
+
+    def stopwords_fingerprint(self) -> str:
+        return hashlib.sha1("\n".join(sorted(self.stop_words)).encode('utf-8')).hexdigest()
+
+    def corpus_fingerprint(self) -> str:
+        """Hash names, sizes and mtimes of every input the index depends on."""
+        digest = hashlib.sha1(f"format {index_store.FORMAT_VERSION}".encode('utf-8'))
+        paths = []
+        if os.path.isdir(self.data_directory):
+            paths += sorted(os.path.join(self.data_directory, name)
+                            for name in os.listdir(self.data_directory) if name.endswith(('.json', '.idx')))
+            corpus_dir = os.path.join(self.data_directory, 'corpus')
+            if os.path.isdir(corpus_dir):
+                paths += sorted(os.path.join(corpus_dir, name) for name in os.listdir(corpus_dir) if name.endswith('.idx'))
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}\n".encode('utf-8'))
+            except OSError:
+                digest.update(f"{path}:missing\n".encode('utf-8'))
+        return digest.hexdigest()
+
+    def save_index(self, path: str, fingerprint: str = None):
+        """Write the index to a binary file that load_index can memory-map."""
+        if fingerprint is None:
+            fingerprint = self.corpus_fingerprint()
+        if self.norms_stale:
+            self.compute_doc_norms()
+        doc_meta = {doc_id: index_store.document_meta(doc) for doc_id, doc in self.documents.items()}
+        postings = {term: self.index[term] for term in self.index}
+        header_fields = {'fingerprint': fingerprint, 'stopwords': self.stopwords_fingerprint()}
+
+        # The file being replaced may be the one this engine has mapped
+        mapped = self.index_file is not None and os.path.abspath(self.index_file.path) == os.path.abspath(path)
+        target = f"{path}.new" if mapped else path
+        index_store.write_index(target, sorted(postings, key=lambda term: term.encode('utf-8')), postings,
+                                self.index.positions, list(self.documents), self.doc_norms, self.doc_timestamps, doc_meta,
+                                self.doc_sources, header_fields)
+        if mapped:
+            self.close_index_file()
+            os.replace(target, path)
+            self.load_index(path)
+
+    def load_index(self, path: str):
+        """Open a saved index; postings and documents are decoded from the memory map on demand."""
+        self.close_index_file()
+        self.index_file = index_store.IndexFile(path)
+        doc_ids = self.index_file.doc_ids()
+        self.index = index_store.MappedIndex(self.index_file, doc_ids)
+        self.documents = index_store.MappedDocuments(self.index_file, doc_ids)
+        self.doc_norms = dict(zip(doc_ids, self.index_file.doc_norms.tolist()))
+        self.doc_positions = {doc_id: position for position, doc_id in enumerate(doc_ids)}
+        self.term_bounds = {}
+        self.sparse_scorer = None
+        self.doc_sources = dict(zip(doc_ids, self.index_file.doc_sources()))
+        self.doc_timestamps = dict(zip(doc_ids, self.index_file.timestamps()))
+        self.generation += 1
+        self.norms_stale = False
+        self.compute_dates()
+
+    def close_index_file(self):
+        if self.index_file is not None:
+            self.index_file.close()
+            self.index_file = None
+
+    def load_or_build(self, path: str):
+        """Load the saved index and sync it with data/, or build it from scratch if it cannot be reused."""
+        fingerprint = self.corpus_fingerprint()
+        header = index_store.read_header(path)
+        if header is None or header.get('stopwords') != self.stopwords_fingerprint():
+            print("No usable index found, building index...")
+            self.build_index()
+        else:
+            self.load_index(path)
+            if header.get('fingerprint') == fingerprint or not self.sync():
+                return
         try:
-            with open('index.json', 'w', encoding='utf-8') as f:
-                json.dump(index_data, f, ensure_ascii=False, indent=2)
-        except Exception as e:
+            self.save_index(path, fingerprint)
+        except OSError as e:
             print(f"Error saving index file: {e}")
 
-        # Create document vectors
-        for doc_id in self.documents:
-            vector = {}
-            for term in self.index:
-                if doc_id in self.index[term]:
-                    vector[term] = self.index[term][doc_id]
-            self.document_vectors[doc_id] = vector
+    def term_bound(self, term: str) -> float:
+        """Largest normalized weight of the term in any document, the most it can add to a cosine."""
+        bound = self.term_bounds.get(term)
+        if bound is None:
+            postings = self.index[term]
+            idf = self.idf(self.term_df(term, postings))
+            bound = max(self.log_tf(raw_tf) * idf / self.doc_norms[doc_id] for doc_id, raw_tf in postings.items())
+            self.term_bounds[term] = bound
+        return bound
+
+    def content_scores(self, query_vector: Dict[str, float], query_magnitude: float, top_k: int,
+                       date_weight: float, date_scores: Dict[str, float], allowed: Set[str] = None) -> Dict[str, float]:
+        """
+        Cosine scores of the matching documents that can still make the top k (MaxScore).
+        If allowed is given, documents outside it are skipped.
+
+        Terms are walked from the largest upper bound down. Once the k-th best partial score
+        beats everything an unseen document could still collect (the remaining term bounds
+        plus the best date score), later posting lists only top up documents already seen,
+        and those whose upper bound falls below the k-th score are dropped.
+        """
+        term_postings = {}
+        for term in query_vector:
+            # A shard may not hold every term of the global query vector
+            postings = self.index[term] if term in self.index else {}
+            term_postings[term] = (postings, self.idf(self.term_df(term, postings)) if postings else 0.0)
+
+        content_weight = 1 - date_weight
+        if term_postings and query_magnitude and top_k > 0 and 0 <= date_weight <= 1:
+            bounds = {term: content_weight * weight / query_magnitude * self.term_bound(term)
+                      if term_postings[term][0] else 0.0
+                      for term, weight in query_vector.items()}
+            remaining = sum(bounds.values())
+            date_bound = date_weight * self.max_date_score
+            # Partial combined scores, a lower bound of each document's final score
+            partial = {}
+            threshold = None
+            for term in sorted(bounds, key=bounds.get, reverse=True):
+                postings, idf = term_postings[term]
+                scale = content_weight * query_vector[term] / query_magnitude * idf
+                if threshold is None or threshold <= remaining + date_bound + PRUNE_SLACK:
+                    for doc_id, raw_tf in postings.items():
+                        if allowed is not None and doc_id not in allowed:
+                            continue
+                        gain = scale * self.log_tf(raw_tf) / self.doc_norms[doc_id]
+                        if doc_id in partial:
+                            partial[doc_id] += gain
+                        else:
+                            partial[doc_id] = date_weight * date_scores[doc_id] + gain
+                else:
+                    partial = {doc_id: score for doc_id, score in partial.items()
+                               if score + remaining + PRUNE_SLACK >= threshold}
+                    for doc_id in partial:
+                        raw_tf = postings.get(doc_id)
+                        if raw_tf:
+                            partial[doc_id] += scale * self.log_tf(raw_tf) / self.doc_norms[doc_id]
+                remaining -= bounds[term]
+                if len(partial) >= top_k:
+                    threshold = heapq.nlargest(top_k, partial.values())[-1]
+            candidates = partial
+        else:
+            candidates = set()
+            for postings, idf in term_postings.values():
+                candidates.update(postings)
+            if allowed is not None:
+                candidates &= allowed
+
+        # Exact scores for the survivors, summed in query order like a full dot product
+        scores = {}
+        for doc_id in candidates:
+            dot_product = 0.0
+            for term, query_weight in query_vector.items():
+                postings, idf = term_postings[term]
+                raw_tf = postings.get(doc_id)
+                if raw_tf:
+                    dot_product += query_weight * (self.log_tf(raw_tf) * idf)
+            doc_magnitude = self.doc_norms[doc_id]
+            if query_magnitude and doc_magnitude:
+                scores[doc_id] = dot_product / (query_magnitude * doc_magnitude)
+            else:
+                scores[doc_id] = 0
+        return scores
 
     # Sort function for search results
     def _get_score(self, doc_score_pair: tuple) -> float:
         return doc_score_pair[1]
 
-    def search(self, query: str, top_k: int = 5, date_weight: float = 0.3) -> List[dict]:
+    def query_tokens(self, query: str) -> List[str]:
+        return self.parse_query(query)[0]
+
+    def parse_query(self, query: str) -> Tuple[List[str], tuple]:
         """
-        Search for documents matching the query.
-        Args:
-            query: Search query string
-            top_k: Number of top results to return
-            date_weight: Weight for date score (0 to 1), default 0.3
+        Split a query into the tokens it is scored on and its phrase and proximity constraints,
+        memoized since the same hot queries come back again and again.
+
+        "exact phrase" (or '...', “...”) only matches documents containing the phrase.
+        a NEAR/k b only matches documents where a and b, words or quoted phrases, occur with
+        at most k tokens between them. Every word of the query is still scored as usual.
+        Constraints are ('phrase', phrase) and ('near', phrase, phrase, k), a phrase being
+        ((term, offset), ...) with stop words left as gaps in the offsets.
         """
-        # Preprocess query
-        query_tokens = self.preprocess_text(query)
-        
+        parsed = self.query_token_cache.get(query)
+        if parsed is not None:
+            self.cache_stats['token_hits'] += 1
+            self.query_token_cache.move_to_end(query)
+            return parsed
+        self.cache_stats['token_misses'] += 1
+
+        parts = []
+        for match in QUERY_PATTERN.finditer(query):
+            phrase = next((group for group in match.groups()[:3] if group is not None), None)
+            if phrase is not None:
+                parts.append(('phrase', phrase))
+            elif match.group(4) is not None:
+                parts.append(('near', int(match.group(4))))
+            else:
+                parts.append(('word', match.group(5)))
+
+        words = []
+        constraints = []
+        for i, (kind, value) in enumerate(parts):
+            if kind == 'near':
+                if 0 < i < len(parts) - 1 and parts[i - 1][0] != 'near' and parts[i + 1][0] != 'near':
+                    first, second = self.query_phrase(parts[i - 1][1]), self.query_phrase(parts[i + 1][1])
+                    if first and second:
+                        constraints.append(('near', first, second, value))
+                    continue
+                # A NEAR/k without two operands is just a word
+                value = f"NEAR/{value}"
+            elif kind == 'phrase':
+                phrase = self.query_phrase(value)
+                if phrase:
+                    constraints.append(('phrase', phrase))
+            words.append(value)
+
+        parsed = (self.preprocess_text(" ".join(words)), tuple(constraints))
+        self.query_token_cache[query] = parsed
+        if len(self.query_token_cache) > QUERY_CACHE_SIZE:
+            self.query_token_cache.popitem(last=False)
+        return parsed
+
+    def query_phrase(self, text: str) -> tuple:
+        """((term, offset), ...) of the indexed words of a phrase; stop words only leave gaps."""
+        phrase = []
+        first = None
+        for position, token in enumerate(tokenize(text)):
+            if token.strip() and token not in self.stop_words:
+                if first is None:
+                    first = position
+                phrase.append((token, position - first))
+        return tuple(phrase)
+
+    def match_phrase(self, phrase: tuple) -> Dict[str, np.ndarray]:
+        """Start positions of the phrase in every document containing it, by intersecting positional postings."""
+        term_positions = []
+        for term, offset in phrase:
+            positions = self.index.positions(term)
+            if not positions:
+                return {}
+            term_positions.append((positions, offset))
+        # Walk the documents of the rarest term, shifting every term's positions back to the phrase start
+        term_positions.sort(key=lambda pair: len(pair[0]))
+        rarest, rarest_offset = term_positions[0]
+        matches = {}
+        for doc_id, positions in rarest.items():
+            starts = np.asarray(positions, dtype=np.int64) - rarest_offset
+            for other, offset in term_positions[1:]:
+                if doc_id not in other:
+                    break
+                starts = np.intersect1d(starts, np.asarray(other[doc_id], dtype=np.int64) - offset, assume_unique=True)
+                if not starts.size:
+                    break
+            else:
+                matches[doc_id] = starts
+        return matches
+
+    def match_near(self, first: tuple, second: tuple, distance: int) -> Set[str]:
+        """Documents where the two phrases occur, in either order, with at most distance tokens between them."""
+        first_starts, second_starts = self.match_phrase(first), self.match_phrase(second)
+        first_span, second_span = first[-1][1], second[-1][1]
+        matches = set()
+        for doc_id in first_starts.keys() & second_starts.keys():
+            a, b = first_starts[doc_id], second_starts[doc_id]
+            # Tokens between each pair of occurrences, negative when they overlap
+            after = np.subtract.outer(b, a + first_span) - 1
+            before = np.subtract.outer(a, b + second_span).T - 1
+            if (np.maximum(after, before) <= distance).any():
+                matches.add(doc_id)
+        return matches
+
+    def match_constraints(self, constraints: tuple) -> Set[str]:
+        """Documents satisfying every phrase and NEAR constraint of a query."""
+        allowed = None
+        for constraint in constraints:
+            if constraint[0] == 'phrase':
+                matches = set(self.match_phrase(constraint[1]))
+            else:
+                matches = self.match_near(*constraint[1:])
+            allowed = matches if allowed is None else allowed & matches
+            if not allowed:
+                break
+        return allowed
+
+    def query_vector(self, query_tokens: List[str]) -> Dict[str, float]:
+        """TF-IDF weights of the query terms that appear in the index."""
         # Create query term frequencies
         query_tf = defaultdict(int)
         for token in query_tokens:
@@ -122,98 +577,210 @@ class SearchEngine:
         
         # Calculate query TF-IDF
         query_vector = defaultdict(float)
-        num_docs = len(self.documents)
+        num_docs = self.corpus_size()
         for token, freq in query_tf.items():
             if token in self.index:
+                df = self.term_df(token, self.index[token])
+            else:
+                df = self.term_df(token, {})
+            if df:
                 # Calculate TF (1 + log10(freq))
                 tf = 1 + math.log10(freq) if freq > 0 else 0
                 # Calculate IDF (1 + log10(N/df))
-                df = len(self.index[token])
                 idf = 1 + math.log10(num_docs / df)
                 # Store TF-IDF score
                 query_vector[token] = tf * idf
+        return query_vector
 
-        # Calculate cosine similarity scores
-        content_scores = {}
-        for doc_id, doc_vector in self.document_vectors.items():
-            # Calculate dot product
-            dot_product = sum(query_vector[term] * doc_vector.get(term, 0)
-                             for term in query_vector)
-            
-            # Calculate magnitudes
-            query_magnitude = math.sqrt(sum(score ** 2 for score in query_vector.values()))
-            doc_magnitude = math.sqrt(sum(score ** 2 for score in doc_vector.values()))
-            
-            # Calculate cosine similarity
-            if query_magnitude and doc_magnitude:
-                content_scores[doc_id] = dot_product / (query_magnitude * doc_magnitude)
-            else:
-                content_scores[doc_id] = 0
+    @staticmethod
+    def parse_timestamp(date) -> float:
+        """Seconds since EPOCH of an article date like '01/02/2024 08:00 GMT+7', or None if it is invalid."""
+        try:
+            if date:  # Check if date exists and is not None
+                date_str = date.split('GMT')[0].strip()
+                return (datetime.strptime(date_str, '%d/%m/%Y %H:%M') - EPOCH).total_seconds()
+        except (AttributeError, ValueError):
+            pass
+        return None
+
+    def compute_dates(self):
+        """
+        Recency scores, decaying with the days before the latest article, and the documents
+        sorted by date. Dates are parsed at index time, so this runs once per index change
+        instead of on every query.
+        """
+        positions = {doc_id: position for position, doc_id in enumerate(self.documents)}
+        dated = [(ts, doc_id) for doc_id in self.documents
+                 for ts in [self.doc_timestamps.get(doc_id)] if ts is not None]
 
-        # Adding date scores
-        date_scores = {}
-        
-        # Get all valid dates first
-        valid_dates = []
-        for doc in self.documents.values():
-            try:
-                if doc.get('date'):  # Check if date exists and is not None
-                    date_str = doc['date'].split('GMT')[0].strip()
-                    doc_date = datetime.strptime(date_str, '%d/%m/%Y %H:%M')
-                    valid_dates.append(doc_date)
-            except (AttributeError, ValueError) as e:
-                continue
-        
         # If no valid dates found, use equal weights for all documents
-        if not valid_dates:
-            latest_date = datetime.now()
-            for doc_id in self.documents:
-                date_scores[doc_id] = 1.0
+        latest = self.latest_timestamp()
+        if latest is None:
+            self.date_scores = {doc_id: 1.0 for doc_id in self.documents}
         else:
-            latest_date = max(valid_dates)
-            
-            # Calculate date scores for each document
-            for doc_id, doc in self.documents.items():
-                try:
-                    if doc.get('date'):
-                        date_str = doc['date'].split('GMT')[0].strip()
-                        doc_date = datetime.strptime(date_str, '%d/%m/%Y %H:%M')
-                        time_diff = (latest_date - doc_date).total_seconds() / (24 * 3600)
-                        date_scores[doc_id] = math.exp(-0.01 * time_diff)
-                    else:
-                        date_scores[doc_id] = 0.0
-                except (AttributeError, ValueError):
-                    date_scores[doc_id] = 0.0
+            self.date_scores = {doc_id: 0.0 for doc_id in self.documents}
+            for ts, doc_id in dated:
+                time_diff = (latest - ts) / (24 * 3600)
+                self.date_scores[doc_id] = math.exp(-0.01 * time_diff)
+        self.max_date_score = max(self.date_scores.values(), default=0.0)
+
+        # Newest first, same-date documents in document order; date_keys holds the negated timestamps
+        dated.sort(key=lambda pair: (-pair[0], positions[pair[1]]))
+        self.date_keys = [-ts for ts, _ in dated]
+        self.date_ids = [doc_id for _, doc_id in dated]
+        # Best date score first: dated documents, then the undated ones that all score the same
+        self.date_order = self.date_ids + [doc_id for doc_id in self.documents
+                                           if self.doc_timestamps.get(doc_id) is None]
+        self.dates_stale = False
+
+    def docs_in_range(self, date_from: datetime = None, date_to: datetime = None) -> List[str]:
+        """Documents dated within [date_from, date_to], newest first, found by bisecting the date index."""
+        lo = 0 if date_to is None else bisect.bisect_left(self.date_keys, -(date_to - EPOCH).total_seconds())
+        hi = len(self.date_keys) if date_from is None else bisect.bisect_right(self.date_keys, -(date_from - EPOCH).total_seconds())
+        return self.date_ids[lo:hi]
+
+    def format_result(self, doc_id: str, score: float, content_score: float, date_score: float) -> dict:
+        doc = self.documents[doc_id]
+        return {
+            'title': doc['title'],
+            'content': doc['content'],
+            'score': f"{score:.4f}",
+            'date': doc['date'],
+            'content_score': f"{content_score:.4f}",
+            'date_score': f"{date_score:.4f}"
+        }
+
+    def search(self, query: str, top_k: int = 5, date_weight: float = 0.3,
+               date_from: datetime = None, date_to: datetime = None) -> List[dict]:
+        """
+        Search for documents matching the query.
+        Args:
+            query: Search query string
+            top_k: Number of top results to return
+            date_weight: Weight for date score (0 to 1), default 0.3
+            date_from, date_to: Only return documents dated within this range (inclusive)
+        """
+        # Norms depend on IDF, refresh them if documents changed since the last query
+        if self.norms_stale:
+            self.compute_doc_norms()
+        if self.dates_stale:
+            self.compute_dates()
+
+        # Repeated queries are answered from the result cache until the index changes
+        query_tokens, constraints = self.parse_query(query)
+        cache_key = (tuple(sorted(Counter(query_tokens).items())), constraints, top_k, date_weight, date_from, date_to)
+        if self.result_cache_generation != self.generation:
+            self.result_cache.clear()
+            self.result_cache_generation = self.generation
+        if cache_key in self.result_cache:
+            self.cache_stats['result_hits'] += 1
+            self.result_cache.move_to_end(cache_key)
+            return [dict(result) for result in self.result_cache[cache_key]]
+        self.cache_stats['result_misses'] += 1
+
+        results = [self.format_result(doc_id, score, content_score, self.date_scores[doc_id])
+                   for doc_id, score, content_score in self.rank(query_tokens, constraints, top_k, date_weight,
+                                                                 date_from, date_to)]
+        self.result_cache[cache_key] = results
+        if len(self.result_cache) > RESULT_CACHE_SIZE:
+            self.result_cache.popitem(last=False)
+        return [dict(result) for result in results]
+
+    def rank(self, query_tokens: List[str], constraints: tuple, top_k: int, date_weight: float,
+             date_from: datetime = None, date_to: datetime = None) -> List[Tuple[str, float, float]]:
+        """(doc_id, score, content_score) of the top k documents for a parsed query, best first."""
+        query_vector = self.query_vector(query_tokens)
+
+        # Date scores are computed once per index change
+        date_scores = self.date_scores
+        allowed = None
+        if date_from is not None or date_to is not None:
+            in_range = self.docs_in_range(date_from, date_to)
+            allowed = set(in_range)
+        # Phrases are resolved on the positional postings; a plain dict index has no positions
+        filtered = bool(constraints)
+        if filtered:
+            if not isinstance(self.index, index_store.OverlayIndex):
+                raise ValueError("phrase and NEAR queries need an index with token positions")
+            matches = self.match_constraints(constraints)
+            allowed = matches if allowed is None else allowed & matches
+
+        # Only documents on the query terms' posting lists get a content score, every other
+        # document has a content score of 0. MaxScore skips the ones that cannot reach the top k.
+        query_magnitude = math.sqrt(sum(score ** 2 for score in query_vector.values()))
+        content_scores = self.content_scores(query_vector, query_magnitude, top_k, date_weight, date_scores, allowed)
 
         # Combine scores
+        content_weight = 1 - date_weight
         final_scores = {}
-        for doc_id in self.documents:
-            content_weight = 1 - date_weight
+        for doc_id, content_score in content_scores.items():
             final_scores[doc_id] = (
-                content_weight * content_scores[doc_id] + 
+                content_weight * content_score +
                 date_weight * date_scores[doc_id]
             )
 
-        # Sort documents by combined score using the class method
-        ranked_docs = sorted(final_scores.items(), key=self._get_score, reverse=True)
-        
-        # Return top K results
-        results = []
-        for doc_id, score in ranked_docs[:top_k]:
-            doc = self.documents[doc_id]
-            results.append({
-                'title': doc['title'],
-                'content': doc['content'],
-                'score': f"{score:.4f}",
-                'date': doc['date'],
-                'content_score': f"{content_scores[doc_id]:.4f}",
-                'date_score': f"{date_scores[doc_id]:.4f}"
-            })
-        return results
+        # Non-matching documents score on their date alone, so the best of them come first in
+        # date order (or in document order when the date does not count)
+        if filtered:
+            others = sorted(allowed, key=lambda doc_id: (-date_scores[doc_id] if date_weight > 0 else 0,
+                                                         self.doc_positions[doc_id]))
+        elif date_weight > 0:
+            others = self.date_order if allowed is None else in_range
+        elif date_weight == 0:
+            others = self.documents if allowed is None else sorted(in_range, key=self.doc_positions.get)
+        else:
+            # A negative weight favours old documents, score them all
+            others = self.documents if allowed is None else in_range
+        added = 0
+        for doc_id in others:
+            if added >= top_k and date_weight >= 0:
+                break
+            if doc_id not in content_scores:
+                final_scores[doc_id] = date_weight * date_scores[doc_id]
+                added += 1
+
+        # Highest score first, ties keep document order
+        ranked_docs = heapq.nsmallest(max(top_k, 0), final_scores.items(),
+                                      key=lambda pair: (-self._get_score(pair), self.doc_positions[pair[0]]))
+        return [(doc_id, score, content_scores.get(doc_id, 0)) for doc_id, score in ranked_docs]
+
+    def cache_info(self) -> dict:
+        """Hit and miss counts and sizes of the query result and query token caches."""
+        stats = {name: self.cache_stats[name]
+                 for name in ('result_hits', 'result_misses', 'token_hits', 'token_misses')}
+        return dict(stats, result_size=len(self.result_cache),
+                    token_size=len(self.query_token_cache), generation=self.generation)
+
+    def search_batch(self, queries: List[str], top_k: int = 5, date_weight: float = 0.3) -> List[List[dict]]:
+        """
+        Search many queries at once, e.g. for offline evaluation. With scipy installed the
+        queries are scored as sparse matrix products against the CSR document-term matrix;
+        queries with phrase or NEAR constraints are answered by search() like any other.
+        """
+        if sparse_search.sparse is None:
+            return [self.search(query, top_k, date_weight) for query in queries]
+        if self.norms_stale:
+            self.compute_doc_norms()
+        if self.dates_stale:
+            self.compute_dates()
+        if self.sparse_scorer is None:
+            self.sparse_scorer = sparse_search.SparseScorer(self)
+        # The matrix has no token positions, so queries with phrases or NEAR go through search()
+        constrained = [bool(self.parse_query(query)[1]) for query in queries]
+        plain = iter(self.sparse_scorer.search_batch([query for query, has_constraints in zip(queries, constrained)
+                                                      if not has_constraints], top_k, date_weight))
+        return [self.search(query, top_k, date_weight) if has_constraints else next(plain)
+                for query, has_constraints in zip(queries, constrained)]
 
 class SearchGUI:
-    def __init__(self, search_engine: SearchEngine):
+    def __init__(self, search_engine):
+        """search_engine is a SearchEngine or anything with the same search(), like a SearchClient."""
         self.search_engine = search_engine
+        # Queries run on a background thread so the window never waits on them; only the
+        # answer to the latest query is shown
+        self.search_pool = ThreadPoolExecutor(max_workers=1)
+        self.responses = queue.Queue()
+        self.query_number = 0
         
         # Create main window
         self.window = tk.Tk()
@@ -251,9 +818,14 @@ class SearchGUI:
         )
         date_weight_cb.pack(side=tk.LEFT, padx=5)
         
+        # Create status line
+        self.status_var = tk.StringVar()
+        ttk.Label(self.window, textvariable=self.status_var, padding=(10, 0)).pack(fill=tk.X)
+
         # Create results area
         self.results_area = scrolledtext.ScrolledText(self.window, wrap=tk.WORD, width=80, height=30)
         self.results_area.pack(padx=10, pady=10, fill=tk.BOTH, expand=True)
+        self.window.after(50, self.poll_responses)
 
     def perform_search(self):
         query = self.search_var.get()
@@ -267,10 +839,35 @@ class SearchGUI:
         if query.strip():
             # Use date weight 0.3 if checkbox is selected, 0.0 if not
             date_weight = 0.3 if self.use_date_weight.get() else 0.0
+            self.query_number += 1
+            self.status_var.set(f"Searching for {query}...")
+            self.search_pool.submit(self.search_in_background, self.query_number, query, k, date_weight)
+
+    def search_in_background(self, number: int, query: str, k: int, date_weight: float):
+        # Queries typed since this one was submitted make it pointless
+        if number != self.query_number:
+            return
+        try:
             results = self.search_engine.search(query, top_k=k, date_weight=date_weight)
-            self.display_results(results)
-        
-    def display_results(self, results: List[dict]):
+        except Exception as e:
+            print(f"Error searching for {query}: {e}")
+            results = e
+        self.responses.put((number, results, date_weight))
+
+    def poll_responses(self):
+        """Show answers from the search thread; Tk widgets may only be touched from the main loop."""
+        while not self.responses.empty():
+            number, results, date_weight = self.responses.get_nowait()
+            if number != self.query_number:
+                continue
+            if isinstance(results, Exception):
+                self.status_var.set(f"Search failed: {results}")
+            else:
+                self.status_var.set("")
+                self.display_results(results, date_weight)
+        self.window.after(50, self.poll_responses)
+
+    def display_results(self, results: List[dict], date_weight: float):
         self.results_area.delete('1.0', tk.END)
         if not results:
             self.results_area.insert(tk.END, "No results found.")
@@ -281,7 +878,7 @@ class SearchGUI:
             self.results_area.insert(tk.END, f"Final Score: {result['score']}\n")
             
             # Only show component scores if date weighting is enabled
-            if self.use_date_weight.get():
+            if date_weight:
                 self.results_area.insert(tk.END, f"Content Score: {result['content_score']}\n")
                 self.results_area.insert(tk.END, f"Date Score: {result['date_score']}\n")
                 
@@ -291,19 +888,51 @@ class SearchGUI:
 
     def run(self):
         self.window.mainloop()
+        self.search_pool.shutdown(wait=False)
 
 def main():
-    # Initialize and build search engine with Vietnamese stopwords
-    search_engine = SearchEngine(
-        data_directory="data",
-        stopwords_file="vietnamese-stopwords-dash.txt"
-    )
-    search_engine.build_index()
+    parser = argparse.ArgumentParser(description="Search the crawled articles")
+    parser.add_argument("--server", default=None,
+                        help="URL of a running search_server.py to query instead of loading the index here")
+    args = parser.parse_args()
+
+    if args.server:
+        from search_server import SearchClient
+        search_engine = SearchClient(args.server)
+    else:
+        # Initialize and build search engine with Vietnamese stopwords
+        search_engine = SearchEngine(
+            data_directory="data",
+            stopwords_file="vietnamese-stopwords-dash.txt",
+            token_cache=TOKEN_CACHE
+        )
+        search_engine.load_or_build("index.bin")
+        # Queries tokenize in this process, so the tokenizer pool and its cache are done with
+        search_engine.tokenizer.close()
     
     # Create and run GUI
     gui = SearchGUI(search_engine)
     gui.run()
 
+# Vocabulary of the small corpus the test functions index
+TEST_WORDS = ['giá', 'vàng', 'bóng', 'đá', 'học', 'sinh', 'kinh', 'tế', 'giao', 'thông', 'marathon', 'thủ', 'tướng']
+
+def make_test_documents(count: int) -> Dict[str, dict]:
+    """doc_id -> document of a small deterministic corpus shared by the test functions."""
+    documents = {}
+    for i in range(count):
+        content = " ".join(TEST_WORDS[(i * 7 + j * j) % len(TEST_WORDS)] for j in range(i % 9))
+        # Some documents have no date or an unparsable one, several share a date to exercise ties
+        date = f"{i % 28 + 1:02d}/0{i % 3 + 1}/2024 08:00 GMT+7" if i % 5 else ('' if i % 2 else 'không rõ')
+        documents[f"doc{i}.json"] = {'title': TEST_WORDS[i % 4], 'content': content, 'date': date}
+    return documents
+
+def write_test_documents(directory: str, documents: Dict[str, dict]):
+    """Write documents as data/*.json files the way the crawler does."""
+    for doc_id, doc in documents.items():
+        with open(os.path.join(directory, doc_id), 'w', encoding='utf-8') as f:
+            json.dump(doc, f, ensure_ascii=False)
+
 def test_search():
     """Test function to demonstrate TF-IDF calculation and search."""
     # Test documents
@@ -337,13 +966,8 @@ def test_search():
     # Initialize search engine with empty directory (we'll add docs manually)
     search_engine = SearchEngine("", "vietnamese-stopwords-dash.txt")
     
-    # Manually add documents to the engine
-    for doc in test_docs:
-        search_engine.documents[doc['id']] = doc
-    
     # Build index manually
     doc_frequencies = defaultdict(int)
-    search_engine.index = defaultdict(dict)
     
     print("Step 1: Document Processing and Term Frequencies")
     print("-" * 50)
@@ -366,10 +990,10 @@ def test_search():
         for token in set(tokens):
             doc_frequencies[token] += 1
             
-        # Store term frequencies in index
+        # Store term frequencies, and the token positions the quoted phrase is matched on, in the index
         for token, freq in term_freq.items():
-            search_engine.index[token][doc_id] = freq
             print(f"Raw TF for '{token}': {freq}")
+        search_engine.index_document(doc_id, doc)
     
     print("\nStep 2: Document Frequencies")
     print("-" * 50)
@@ -390,19 +1014,14 @@ def test_search():
             raw_tf = search_engine.index[term][doc_id]
             tf = 1 + math.log10(raw_tf) if raw_tf > 0 else 0
             tf_idf = tf * idf
-            search_engine.index[term][doc_id] = tf_idf
             print(f"Document {doc_id}:")
             print(f"  Raw tf: {raw_tf}")
             print(f"  Log tf: {tf:.4f}")
             print(f"  TF-IDF: {tf_idf:.4f}")
     
-    # Create document vectors
-    for doc_id in search_engine.documents:
-        vector = {}
-        for term in search_engine.index:
-            if doc_id in search_engine.index[term]:
-                vector[term] = search_engine.index[term][doc_id]
-        search_engine.document_vectors[doc_id] = vector
+    # Compute document vector magnitudes and date scores
+    search_engine.compute_doc_norms()
+    search_engine.compute_dates()
     
     print("\nStep 4: Search Results")
     print("-" * 50)
@@ -416,6 +1035,136 @@ def test_search():
         print(f"Score: {result['score']}")
         print(f"Content: {result['content']}")
 
+def test_search_parity():
+    """Check the posting-list evaluator, date filters and the sparse batch backend against scoring every document."""
+    search_engine = SearchEngine("", "vietnamese-stopwords-dash.txt")
+    for doc_id, doc in make_test_documents(60).items():
+        search_engine.add_document(doc_id, doc)
+
+    def exhaustive(query, top_k, date_weight):
+        search_engine.search(query, 1, date_weight)  # refreshes the norms
+        query_tf = defaultdict(int)
+        for token in search_engine.preprocess_text(query):
+            query_tf[token] += 1
+        query_vector = {}
+        for token, freq in query_tf.items():
+            if token in search_engine.index:
+                query_vector[token] = search_engine.log_tf(freq) * search_engine.idf(len(search_engine.index[token]))
+        query_magnitude = math.sqrt(sum(score ** 2 for score in query_vector.values()))
+        dates = {}
+        for doc_id, doc in search_engine.documents.items():
+            try:
+                dates[doc_id] = datetime.strptime(doc['date'].split('GMT')[0].strip(), '%d/%m/%Y %H:%M')
+            except ValueError:
+                pass
+        latest_date = max(dates.values())
+        final_scores = {}
+        for doc_id in search_engine.documents:
+            dot_product = sum(weight * search_engine.log_tf(search_engine.index[term].get(doc_id, 0)) *
+                              search_engine.idf(len(search_engine.index[term]))
+                              for term, weight in query_vector.items())
+            doc_magnitude = search_engine.doc_norms[doc_id]
+            content_score = dot_product / (query_magnitude * doc_magnitude) if query_magnitude and doc_magnitude else 0
+            date_score = 0.0
+            if doc_id in dates:
+                date_score = math.exp(-0.01 * (latest_date - dates[doc_id]).total_seconds() / (24 * 3600))
+            final_scores[doc_id] = (1 - date_weight) * content_score + date_weight * date_score
+        ranked_docs = sorted(final_scores.items(), key=lambda pair: pair[1], reverse=True)
+        return [(search_engine.documents[doc_id]['content'], search_engine.documents[doc_id]['date'], f"{score:.4f}")
+                for doc_id, score in ranked_docs[:top_k]]
+
+    for query in ["giá vàng", "bóng đá học sinh", "thủ tướng chạy marathon", "không khớp xyz", "tế tế giao"]:
+        for top_k in (1, 5, 20, 100):
+            for date_weight in (0.0, 0.3, 1.0):
+                results = search_engine.search(query, top_k, date_weight)
+                got = [(result['content'], result['date'], result['score']) for result in results]
+                assert got == exhaustive(query, top_k, date_weight), (query, top_k, date_weight)
+                assert search_engine.search_batch([query], top_k, date_weight) == [results], (query, top_k, date_weight)
+                # Date-range queries match the full ranking restricted to the range
+                date_from, date_to = datetime(2024, 1, 10), datetime(2024, 2, 20, 8, 0)
+                results = search_engine.search(query, top_k, date_weight, date_from, date_to)
+                got = [(result['content'], result['date'], result['score']) for result in results]
+                in_range = [result for result in exhaustive(query, len(search_engine.documents), date_weight)
+                            if search_engine.parse_timestamp(result[1]) is not None and
+                            date_from <= datetime.strptime(result[1].split('GMT')[0].strip(), '%d/%m/%Y %H:%M') <= date_to]
+                assert got == in_range[:top_k], (query, top_k, date_weight, 'date range')
+    # Repeated queries come from the result cache, an index change invalidates it
+    hits = search_engine.cache_info()['result_hits']
+    assert search_engine.search("Giá  vàng", 7) == search_engine.search("giá vàng", 7)
+    assert search_engine.cache_info()['result_hits'] == hits + 1
+    assert search_engine.search("xăng", 5, 0.0)[0]['content'] != 'giá xăng'
+    search_engine.add_document("new.json", {'title': '', 'content': 'giá xăng', 'date': ''})
+    assert search_engine.search("xăng", 5, 0.0)[0]['content'] == 'giá xăng'
+
+    # Queries with phrase or NEAR constraints return the same documents from the batch API
+    queries = ['"kinh tế" giao', 'giá NEAR/2 thông', '“bóng đá” học', 'giá vàng']
+    for date_weight in (0.0, 0.3):
+        assert search_engine.search_batch(queries, 10, date_weight) == \
+            [search_engine.search(query, 10, date_weight) for query in queries], date_weight
+
+    # A saved index synced after files are changed, deleted and added ranks like a fresh build
+    import tempfile
+    with tempfile.TemporaryDirectory() as directory:
+        write_test_documents(directory, make_test_documents(30))
+        index_path = os.path.join(directory, "index.bin")
+        synced = SearchEngine(directory, "vietnamese-stopwords-dash.txt")
+        synced.load_or_build(index_path)
+        synced.close_index_file()
+
+        os.remove(os.path.join(directory, "doc2.json"))
+        write_test_documents(directory, {
+            "doc1.json": {'title': 'giá', 'content': 'vàng giá vàng bóng đá', 'date': '05/03/2024 08:00 GMT+7'},
+            "doc100.json": {'title': 'kinh tế', 'content': 'giao thông thủ tướng', 'date': '01/03/2024 08:00 GMT+7'},
+        })
+        synced = SearchEngine(directory, "vietnamese-stopwords-dash.txt")
+        synced.load_index(index_path)
+        assert synced.sync()
+        fresh = SearchEngine(directory, "vietnamese-stopwords-dash.txt")
+        fresh.build_index()
+        for query in ["giá vàng", "bóng đá học sinh", "kinh tế giao thông", '"thủ tướng"']:
+            for date_weight in (0.0, 0.3):
+                assert synced.search(query, 10, date_weight) == fresh.search(query, 10, date_weight), (query, 'sync')
+        assert not synced.sync()
+        synced.close_index_file()
+    print("Search parity OK")
+
+def test_query_constraints():
+    """Check which documents quoted phrases and NEAR/k accept and reject."""
+    search_engine = SearchEngine("", "vietnamese-stopwords-dash.txt")
+    texts = ["giá vàng hôm nay", "vàng giá hôm nay", "giá hôm nay vàng",
+             "marathon qq bóng", "marathon qq qq bóng", "bóng qq marathon", "marathon bóng"]
+    for i, text in enumerate(texts):
+        search_engine.add_document(f"doc{i}.json", {'title': '', 'content': text, 'date': ''})
+
+    def matches(query):
+        # Without a date score, documents sharing no word with the query only pad the results
+        return {result['content'] for result in search_engine.search(query, len(texts), 0.0)
+                if float(result['content_score']) > 0}
+
+    # A phrase needs its words next to each other and in order, whichever quotes enclose it
+    for query in ['"giá vàng"', "'giá vàng'", '“giá vàng”', '"giá vàng" hôm nay']:
+        assert matches(query) == {"giá vàng hôm nay"}, query
+    assert matches("giá vàng") == {"giá vàng hôm nay", "vàng giá hôm nay", "giá hôm nay vàng"}
+    # NEAR/k allows at most k tokens between its operands, in either order
+    near_one = {"marathon qq bóng", "bóng qq marathon", "marathon bóng"}
+    assert matches("marathon NEAR/1 bóng") == near_one
+    assert matches("bóng NEAR/1 marathon") == near_one
+    assert matches("marathon NEAR/2 bóng") == near_one | {"marathon qq qq bóng"}
+    assert matches("marathon NEAR/0 bóng") == {"marathon bóng"}
+    assert matches('"marathon qq" NEAR/0 bóng') == {"marathon qq bóng"}
+    assert search_engine.search_batch(['"giá vàng"', "marathon NEAR/1 bóng"], len(texts), 0.0) == \
+        [search_engine.search('"giá vàng"', len(texts), 0.0), search_engine.search("marathon NEAR/1 bóng", len(texts), 0.0)]
+
+    # Without token positions a constrained query fails instead of ignoring its constraints
+    search_engine.index = {term: dict(search_engine.index[term]) for term in search_engine.index}
+    try:
+        search_engine.search('"giá vàng"', 5, 0.0)
+        assert False, "expected a ValueError"
+    except ValueError:
+        pass
+    print("Query constraints OK")
+
 if __name__ == "__main__":
     # test_search() # for testing
+    # test_search_parity() # for testing
     main() # for GUI
\ No newline at end of file
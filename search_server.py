@@ -0,0 +1,270 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from typing import List
+from urllib.error import HTTPError
+from urllib.parse import parse_qs, urlencode, urlsplit
+from urllib.request import urlopen
+
+from search import SearchEngine
+from token_cache import TOKEN_CACHE
+
+# CONSTANTS
+DEFAULT_PORT = 8765
+DEFAULT_URL = f"http://127.0.0.1:{DEFAULT_PORT}"
+MAX_TOP_K = 100
+MAX_HEADER_LINES = 100
+# Request bodies are read and thrown away, so nothing needs more than this
+MAX_BODY_BYTES = 64 * 1024
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+
+# The worker's engine; every worker maps the same index file, so the pages are shared between them
+engine = None
+
+def init_worker(data_directory: str, stopwords_file: str, index_path: str):
+    global engine
+    engine = SearchEngine(data_directory, stopwords_file)
+    engine.load_index(index_path)
+
+def run_search(query: str, top_k: int, date_weight: float, date_from: datetime, date_to: datetime) -> List[dict]:
+    return engine.search(query, top_k, date_weight, date_from, date_to)
+
+def parse_search_params(params: dict) -> tuple:
+    """(query, top_k, date_weight, date_from, date_to) from query string values; raises ValueError."""
+    query = params.get('q', [''])[0]
+    if not query.strip():
+        raise ValueError("missing query parameter q")
+    top_k = min(max(int(params.get('k', ['5'])[0]), 0), MAX_TOP_K)
+    date_weight = float(params.get('date_weight', ['0.3'])[0])
+    if not -1 <= date_weight <= 1:
+        raise ValueError("date_weight must be between -1 and 1")
+    date_from, date_to = (datetime.fromisoformat(params[name][0]) if name in params else None
+                          for name in ('from', 'to'))
+    return query, top_k, date_weight, date_from, date_to
+
+class SearchServer:
+    """
+    HTTP/JSON search API on asyncio, serving one saved index to many concurrent clients.
+
+    The event loop only parses requests and writes responses; scoring runs in a pool of
+    worker processes that each memory-map the index, so a slow query never holds up the
+    others. Identical queries arriving while one is being scored share its result.
+    With workers=0 queries run on one thread in this process instead.
+
+        GET /search?q=...&k=5&date_weight=0.3&from=2024-01-01&to=2024-02-01
+        GET /stats
+    """
+
+    def __init__(self, data_directory: str, stopwords_file: str, index_path: str, workers: int = None):
+        initargs = (data_directory, stopwords_file, index_path)
+        if workers == 0:
+            self.pool = ThreadPoolExecutor(max_workers=1, initializer=init_worker, initargs=initargs)
+        else:
+            self.pool = ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1,
+                                            initializer=init_worker, initargs=initargs)
+        self.in_flight = {}
+        self.stats = Counter()
+        self.server = None
+
+    async def search(self, args: tuple) -> List[dict]:
+        future = self.in_flight.get(args)
+        if future is not None:
+            self.stats['coalesced'] += 1
+            return await asyncio.shield(future)
+        future = asyncio.get_running_loop().run_in_executor(self.pool, run_search, *args)
+        self.in_flight[args] = future
+        try:
+            return await asyncio.shield(future)
+        finally:
+            if self.in_flight.get(args) is future:
+                del self.in_flight[args]
+
+    async def respond(self, method: str, target: str) -> tuple:
+        """(status, body) for one request."""
+        url = urlsplit(target)
+        if url.path not in ('/search', '/stats'):
+            return 404, {'error': f"no such endpoint {url.path}"}
+        if method != 'GET':
+            return 405, {'error': "only GET is supported"}
+        if url.path == '/stats':
+            return 200, dict(self.stats, in_flight=len(self.in_flight))
+        try:
+            args = parse_search_params(parse_qs(url.query))
+        except ValueError as e:
+            return 400, {'error': str(e)}
+        start = time.perf_counter()
+        results = await self.search(args)
+        return 200, {'query': args[0], 'results': results,
+                     'elapsed_ms': round((time.perf_counter() - start) * 1000, 2)}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Serve the requests of one connection, keeping it open between them unless asked not to."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                for _ in range(MAX_HEADER_LINES):
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                self.stats['requests'] += 1
+                # Request bodies are not used, but must be consumed to reach the next request
+                try:
+                    length = int(headers.get('content-length', 0) or 0)
+                except ValueError:
+                    length = -1
+                if not 0 <= length <= MAX_BODY_BYTES:
+                    # The body cannot be skipped reliably, so answer and drop the connection
+                    self.stats['errors'] += 1
+                    await self.write_response(writer, 400, {'error': "invalid or too large Content-Length"}, False)
+                    break
+                if length:
+                    await reader.readexactly(length)
+
+                parts = request_line.decode('latin-1').split()
+                try:
+                    if len(parts) != 3:
+                        status, body = 400, {'error': "malformed request line"}
+                    else:
+                        status, body = await self.respond(parts[0], parts[1])
+                except Exception as e:
+                    print(f"Error serving {request_line!r}: {e}")
+                    status, body = 500, {'error': str(e)}
+                if status != 200:
+                    self.stats['errors'] += 1
+
+                keep_alive = (len(parts) == 3 and parts[2] == 'HTTP/1.1' and
+                              headers.get('connection', '').lower() != 'close')
+                await self.write_response(writer, status, body, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def write_response(self, writer: asyncio.StreamWriter, status: int, body: dict, keep_alive: bool):
+        payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                     f"Content-Type: application/json; charset=utf-8\r\n"
+                     f"Content-Length: {len(payload)}\r\n"
+                     f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + payload)
+        await writer.drain()
+
+    async def start(self, host: str = '127.0.0.1', port: int = DEFAULT_PORT):
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self, host: str = '127.0.0.1', port: int = DEFAULT_PORT):
+        host, port = await self.start(host, port)
+        print(f"Search server listening on http://{host}:{port}")
+        async with self.server:
+            await self.server.serve_forever()
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+        self.pool.shutdown()
+
+class SearchClient:
+    """Search through a SearchServer, with the same search() signature as SearchEngine."""
+
+    def __init__(self, url: str = DEFAULT_URL, timeout: float = 30):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def search(self, query: str, top_k: int = 5, date_weight: float = 0.3,
+               date_from: datetime = None, date_to: datetime = None) -> List[dict]:
+        params = {'q': query, 'k': top_k, 'date_weight': date_weight}
+        if date_from is not None:
+            params['from'] = date_from.isoformat()
+        if date_to is not None:
+            params['to'] = date_to.isoformat()
+        try:
+            with urlopen(f"{self.url}/search?{urlencode(params)}", timeout=self.timeout) as response:
+                return json.load(response)['results']
+        except HTTPError as e:
+            raise ValueError(json.load(e).get('error', str(e))) from None
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the search index over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--index", default="index.bin")
+    parser.add_argument("--workers", type=int, default=None, help="scoring processes, 0 to score in-process")
+    args = parser.parse_args()
+
+    # Bring the saved index up to date once, then every worker maps it
+    search_engine = SearchEngine("data", "vietnamese-stopwords-dash.txt", token_cache=TOKEN_CACHE)
+    search_engine.load_or_build(args.index)
+    search_engine.tokenizer.close()
+    search_engine.close_index_file()
+    del search_engine
+
+    server = SearchServer("data", "vietnamese-stopwords-dash.txt", args.index, args.workers)
+    try:
+        asyncio.run(server.serve_forever(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+def test_search_server():
+    """Serve a small index and check concurrent HTTP queries against the engine itself."""
+    import socket
+    import tempfile
+    import threading
+    from concurrent.futures import ThreadPoolExecutor as ClientPool
+    from search import make_test_documents, write_test_documents
+    with tempfile.TemporaryDirectory() as directory:
+        write_test_documents(directory, make_test_documents(40))
+        index_path = os.path.join(directory, "index.bin")
+        search_engine = SearchEngine(directory, "vietnamese-stopwords-dash.txt")
+        search_engine.build_index()
+        search_engine.save_index(index_path)
+
+        server = SearchServer(directory, "vietnamese-stopwords-dash.txt", index_path, workers=0)
+        loop = asyncio.new_event_loop()
+        host, port = loop.run_until_complete(server.start(port=0))
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+        try:
+            client = SearchClient(f"http://{host}:{port}")
+            queries = ["giá vàng", "bóng đá học sinh", '"kinh tế"', "không khớp xyz"] * 5
+            with ClientPool(8) as pool:
+                responses = list(pool.map(lambda query: client.search(query, 5, 0.3), queries))
+            for query, results in zip(queries, responses):
+                assert results == search_engine.search(query, 5, 0.3), query
+            date_from = datetime(2024, 2, 1)
+            assert client.search("giá vàng", 10, 0.0, date_from) == search_engine.search("giá vàng", 10, 0.0, date_from)
+            try:
+                client.search("giá vàng", date_weight=5)
+                assert False, "expected a 400 error"
+            except ValueError as e:
+                assert "date_weight" in str(e)
+            # A bad or oversized Content-Length is answered, not dropped
+            for length in ("abc", "-5", str(MAX_BODY_BYTES + 1)):
+                with socket.create_connection((host, port), timeout=10) as sock:
+                    sock.sendall(f"GET /stats HTTP/1.1\r\nContent-Length: {length}\r\n\r\n".encode('latin-1'))
+                    response = sock.makefile('rb').read()
+                assert response.startswith(b"HTTP/1.1 400 ") and b"Content-Length" in response, (length, response)
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            server.close()
+            loop.close()
+            search_engine.close_index_file()
+
+    print("Search server answers like the engine")
+
+if __name__ == "__main__":
+    main()
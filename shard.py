@@ -0,0 +1,377 @@
+import argparse
+import heapq
+import itertools
+import multiprocessing
+import os
+import zlib
+from collections import Counter, OrderedDict
+from datetime import datetime
+from multiprocessing.connection import Client, Listener
+from typing import Dict, List, Tuple
+
+import index_store
+from corpus import CorpusReader
+from search import RESULT_CACHE_SIZE, SearchEngine
+from token_cache import TOKEN_CACHE
+
+# CONSTANTS
+# Shared secret of shard servers and their coordinator; there is deliberately no default
+AUTHKEY_ENV = "SEARCH_SHARD_KEY"
+# Requests a shard answers; anything else sent over the wire is refused
+SHARD_METHODS = ("build_index", "statistics", "set_statistics", "search_shard", "cache_info")
+
+def load_authkey(path: str = None) -> bytes:
+    """The shard servers' secret key, read from path or else from $SEARCH_SHARD_KEY."""
+    if path:
+        with open(path, "rb") as f:
+            key = f.read().strip()
+    else:
+        key = os.environ.get(AUTHKEY_ENV, "").encode("utf-8")
+    if not key:
+        raise ValueError(f"shard servers need a secret key: set {AUTHKEY_ENV} or pass --authkey-file")
+    return key
+
+def shard_of(doc_id: str, num_shards: int) -> int:
+    """Shard a document belongs to; hashing the id keeps it on the same shard as the corpus grows."""
+    return zlib.crc32(doc_id.encode("utf-8")) % num_shards
+
+def shard_cache_path(token_cache: str, shard: int, num_shards: int) -> str:
+    """Each shard keeps its own token cache, so shards neither contend on nor prune each other's."""
+    root, ext = os.path.splitext(token_cache)
+    return f"{root}.{shard}-of-{num_shards}{ext}"
+
+class ShardEngine(SearchEngine):
+    """
+    SearchEngine over one partition of the corpus, scoring with corpus-wide statistics.
+
+    IDF, the date score reference and the tie-breaking document order come from the whole
+    corpus once set_statistics has been called, so a shard ranks its documents exactly as a
+    single engine over every document would.
+    """
+
+    def __init__(self, data_directory: str, stopwords_file: str, shard: int, num_shards: int,
+                 token_cache: str = None):
+        if token_cache:
+            token_cache = shard_cache_path(token_cache, shard, num_shards)
+        # The shards already run one per core, so each tokenizes in its own process
+        super().__init__(data_directory, stopwords_file, token_cache, workers=1)
+        self.shard = shard
+        self.num_shards = num_shards
+        self.global_positions = {}
+        self.global_size = None
+        self.global_df = None
+        self.global_latest = None
+
+    def iter_documents(self):
+        """This shard's documents, remembering each one's position in the whole corpus.
+
+        Positions follow SearchEngine.iter_documents but come from the .idx sidecars and the
+        file names, so only the documents hashed to this shard are read and decoded.
+        """
+        self.global_positions = {}
+        position = 0
+        seen = set()
+        corpus_parts = []
+        for corpus_dir in self.corpus_dirs():
+            reader = CorpusReader(corpus_dir)
+            own = set()
+            for post_id in reader.ordered_post_ids():
+                doc_id = f"{post_id}.json"
+                if doc_id in seen:
+                    continue
+                seen.add(doc_id)
+                if shard_of(doc_id, self.num_shards) == self.shard:
+                    self.global_positions[doc_id] = position
+                    own.add(post_id)
+                position += 1
+            corpus_parts.append((reader, own))
+
+        filenames = []
+        for filename in os.listdir(self.data_directory):
+            if filename.endswith('.json') and filename not in seen:
+                if shard_of(filename, self.num_shards) == self.shard:
+                    self.global_positions[filename] = position
+                    filenames.append(filename)
+                position += 1
+
+        for reader, own in corpus_parts:
+            for doc in reader.scan(own):
+                yield f"{doc['postId']}.json", doc, self.corpus_source(reader, doc['postId'])
+        for filename in filenames:
+            path = os.path.join(self.data_directory, filename)
+            yield filename, self.load_json(path), self.file_source(path)
+
+    def build_index(self):
+        self.global_size = None
+        self.global_df = None
+        self.global_latest = None
+        super().build_index()
+
+    def statistics(self) -> Tuple[int, Dict[str, int], float]:
+        """Document count, document frequencies and latest timestamp of this shard, to be combined."""
+        return (len(self.documents), {term: len(self.index[term]) for term in self.index},
+                super().latest_timestamp())
+
+    def set_statistics(self, corpus_size: int, dfs: Dict[str, int], latest: float):
+        """Score with statistics of the whole corpus from now on."""
+        self.global_size = corpus_size
+        self.global_df = dfs
+        self.global_latest = latest
+        self.generation += 1
+        self.compute_doc_norms()
+        self.compute_dates()
+
+    def corpus_size(self) -> int:
+        return super().corpus_size() if self.global_size is None else self.global_size
+
+    def term_df(self, term: str, postings: dict) -> int:
+        return len(postings) if self.global_df is None else self.global_df.get(term, 0)
+
+    def base_dfs(self):
+        if self.global_df is None or not isinstance(self.index, index_store.OverlayIndex):
+            return None
+        return [self.global_df.get(term, 0) for term in self.index.base_terms()]
+
+    def latest_timestamp(self) -> float:
+        return super().latest_timestamp() if self.global_size is None else self.global_latest
+
+    def compute_doc_norms(self):
+        super().compute_doc_norms()
+        # Ties are broken by the position in the whole corpus
+        self.doc_positions = {doc_id: self.global_positions[doc_id] for doc_id in self.documents}
+
+    def search_shard(self, query: str, top_k: int, date_weight: float,
+                     date_from: datetime = None, date_to: datetime = None) -> List[tuple]:
+        """(score, corpus position, result) of this shard's top k, best first, for the coordinator to merge."""
+        if self.norms_stale:
+            self.compute_doc_norms()
+        if self.dates_stale:
+            self.compute_dates()
+        query_tokens, constraints = self.parse_query(query)
+        return [(score, self.doc_positions[doc_id],
+                 self.format_result(doc_id, score, content_score, self.date_scores[doc_id]))
+                for doc_id, score, content_score in self.rank(query_tokens, constraints, top_k, date_weight,
+                                                              date_from, date_to)]
+
+    def close(self):
+        self.tokenizer.close()
+        self.close_index_file()
+        if isinstance(self.documents, index_store.DocumentStore):
+            self.documents.close()
+
+def serve_connection(conn):
+    """Answer (method, args) requests on a connection until the coordinator closes it."""
+    engine = None
+    while True:
+        try:
+            method, args = conn.recv()
+        except EOFError:
+            break
+        if method == "close":
+            conn.send(("ok", None))
+            break
+        try:
+            if method == "open":
+                if engine is not None:
+                    engine.close()
+                engine = ShardEngine(*args)
+                result = None
+            elif method in SHARD_METHODS and engine is not None:
+                result = getattr(engine, method)(*args)
+            else:
+                raise ValueError(f"unexpected request {method!r}")
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+        else:
+            conn.send(("ok", result))
+    if engine is not None:
+        engine.close()
+    conn.close()
+
+def serve(address, authkey: bytes):
+    """
+    Serve shard requests on a socket, one coordinator at a time.
+
+    Requests are pickled, so whoever can connect can run code in this process; the authkey
+    handshake is the only thing keeping others out. A key is therefore required, and an
+    address other than loopback should only be bound on a trusted network.
+    """
+    if not authkey:
+        raise ValueError(f"refusing to serve {address} without a secret key: set {AUTHKEY_ENV} or pass --authkey-file")
+    with Listener(address, authkey=authkey) as listener:
+        print(f"Shard server listening on {listener.address}")
+        while True:
+            with listener.accept() as conn:
+                serve_connection(conn)
+
+class ShardedSearchEngine:
+    """
+    Document-partitioned index: every shard builds and searches its part of the corpus in its
+    own process, and this coordinator fans each request out and merges the answers.
+
+    Shards run as local worker processes connected by pipes, or as shard servers (see serve)
+    reached over sockets at the given addresses; both speak the same (method, args) protocol.
+    Every shard reads the whole data directory and indexes the documents hashed to it, so
+    remote shard servers need their own copy of the data.
+    """
+
+    def __init__(self, data_directory: str, stopwords_file: str, num_shards: int = None, addresses: list = None,
+                 authkey: bytes = None, token_cache: str = None):
+        self.processes = []
+        # Merged results of repeated queries, dropped whenever the index is rebuilt
+        self.result_cache = OrderedDict()
+        if addresses:
+            authkey = authkey or load_authkey()
+            self.connections = [Client(address, authkey=authkey) for address in addresses]
+        else:
+            self.connections = []
+            for _ in range(num_shards or os.cpu_count() or 1):
+                conn, child_conn = multiprocessing.Pipe()
+                process = multiprocessing.Process(target=serve_connection, args=(child_conn,), daemon=True)
+                process.start()
+                child_conn.close()
+                self.connections.append(conn)
+                self.processes.append(process)
+        self.num_shards = len(self.connections)
+        self.call("open", [(data_directory, stopwords_file, shard, self.num_shards, token_cache)
+                           for shard in range(self.num_shards)])
+
+    def call(self, method: str, shard_args: list) -> list:
+        """Send one request to every shard, then gather the replies, so the shards work in parallel."""
+        for conn, args in zip(self.connections, shard_args):
+            conn.send((method, args))
+        replies = [conn.recv() for conn in self.connections]
+        errors = [f"shard {shard}: {result}" for shard, (status, result) in enumerate(replies) if status != "ok"]
+        if errors:
+            raise RuntimeError(f"{method} failed on " + "; ".join(errors))
+        return [result for _, result in replies]
+
+    def broadcast(self, method: str, *args) -> list:
+        return self.call(method, [args] * self.num_shards)
+
+    def build_index(self):
+        """Build every shard in parallel, then hand them the statistics of the whole corpus."""
+        self.broadcast("build_index")
+        corpus_size = 0
+        dfs = Counter()
+        latest = None
+        for size, shard_dfs, shard_latest in self.broadcast("statistics"):
+            corpus_size += size
+            dfs.update(shard_dfs)
+            if shard_latest is not None and (latest is None or shard_latest > latest):
+                latest = shard_latest
+        self.broadcast("set_statistics", corpus_size, dict(dfs), latest)
+        self.result_cache.clear()
+
+    def search(self, query: str, top_k: int = 5, date_weight: float = 0.3,
+               date_from: datetime = None, date_to: datetime = None) -> List[dict]:
+        """Same arguments and results as SearchEngine.search, merged from every shard's top k."""
+        cache_key = (query, top_k, date_weight, date_from, date_to)
+        if cache_key in self.result_cache:
+            self.result_cache.move_to_end(cache_key)
+            return [dict(result) for result in self.result_cache[cache_key]]
+
+        shard_hits = self.broadcast("search_shard", query, top_k, date_weight, date_from, date_to)
+        # Each shard's hits are sorted, so merging them yields the global order directly
+        merged = heapq.merge(*shard_hits, key=lambda hit: (-hit[0], hit[1]))
+        results = [result for _, _, result in itertools.islice(merged, max(top_k, 0))]
+        self.result_cache[cache_key] = results
+        if len(self.result_cache) > RESULT_CACHE_SIZE:
+            self.result_cache.popitem(last=False)
+        return [dict(result) for result in results]
+
+    def cache_info(self) -> List[dict]:
+        return self.broadcast("cache_info")
+
+    def close(self):
+        for conn in self.connections:
+            try:
+                conn.send(("close", ()))
+                conn.recv()
+            except (EOFError, OSError):
+                pass
+            conn.close()
+        for process in self.processes:
+            process.join()
+        self.connections = []
+        self.processes = []
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharded search: serve a shard or query a sharded index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve_parser = subparsers.add_parser("serve", help="run a shard server for a remote coordinator")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=6100)
+    serve_parser.add_argument("--authkey-file", default=None, help=f"file holding the secret key, else ${AUTHKEY_ENV}")
+    search_parser = subparsers.add_parser("search", help="build a sharded index and run queries")
+    search_parser.add_argument("queries", nargs="+")
+    search_parser.add_argument("--shards", type=int, default=None)
+    search_parser.add_argument("--connect", nargs="*", default=None, help="host:port of shard servers")
+    search_parser.add_argument("--top-k", type=int, default=5)
+    search_parser.add_argument("--authkey-file", default=None, help=f"file holding the secret key, else ${AUTHKEY_ENV}")
+    args = parser.parse_args()
+
+    try:
+        authkey = load_authkey(args.authkey_file) if args.command == "serve" or args.connect else None
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        return
+    if args.command == "serve":
+        serve((args.host, args.port), authkey)
+        return
+    addresses = None
+    if args.connect:
+        addresses = [(host, int(port)) for host, port in (address.rsplit(":", 1) for address in args.connect)]
+    engine = ShardedSearchEngine("data", "vietnamese-stopwords-dash.txt", args.shards, addresses, authkey,
+                                 token_cache=TOKEN_CACHE)
+    try:
+        engine.build_index()
+        for query in args.queries:
+            print(f"\n{query}")
+            for i, result in enumerate(engine.search(query, args.top_k), 1):
+                print(f"{i}. {result['title']} ({result['score']})")
+    finally:
+        engine.close()
+
+def test_sharded_search():
+    """Check that a sharded index ranks exactly like a single engine over the same documents."""
+    import tempfile
+    from corpus import CorpusWriter
+    from search import make_test_documents, write_test_documents
+    with tempfile.TemporaryDirectory() as directory:
+        documents = make_test_documents(60)
+        write_test_documents(directory, documents)
+        # Part of the articles also sit in a corpus, whose copy wins over the data/*.json file
+        with CorpusWriter(os.path.join(directory, "corpus"), batch_size=4, prefix="test") as writer:
+            for i in range(20, 40):
+                writer.append(dict(documents[f"doc{i}.json"], postId=f"doc{i}"))
+            for i in range(60, 70):
+                writer.append(dict(documents[f"doc{i - 60}.json"], postId=f"doc{i}"))
+        search_engine = SearchEngine(directory, "vietnamese-stopwords-dash.txt")
+        search_engine.build_index()
+        sharded = ShardedSearchEngine(directory, "vietnamese-stopwords-dash.txt", num_shards=3)
+        try:
+            sharded.build_index()
+            # Every document lands on exactly one shard
+            assert sum(sharded.broadcast("statistics")[i][0] for i in range(3)) == len(search_engine.documents) == 70
+            for query in ["giá vàng", "bóng đá học sinh", '"kinh tế" giao', "giá NEAR/2 thông", "không khớp xyz"]:
+                for top_k in (1, 5, 100):
+                    for date_weight in (0.0, 0.3, 1.0):
+                        assert sharded.search(query, top_k, date_weight) == \
+                            search_engine.search(query, top_k, date_weight), (query, top_k, date_weight)
+            date_from = datetime(2024, 1, 10)
+            assert sharded.search("giá vàng", 10, 0.3, date_from) == search_engine.search("giá vàng", 10, 0.3, date_from)
+        finally:
+            sharded.close()
+
+    # Shard servers unpickle their requests, so they never listen without a secret key
+    try:
+        serve(("0.0.0.0", 0), b"")
+        assert False, "expected serve to refuse an empty key"
+    except ValueError:
+        pass
+
+    print("Sharded search matches the single engine")
+
+if __name__ == "__main__":
+    main()
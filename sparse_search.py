@@ -0,0 +1,98 @@
+import math
+
+import numpy as np
+
+try:
+    from scipy import sparse
+except ImportError:
+    sparse = None
+
+# CONSTANTS
+BATCH_SIZE = 512  # queries per sparse product, bounds the size of the score matrix
+
+class SparseScorer:
+    """TF-IDF document-term matrix as an L2-normalized CSR matrix with integer term ids.
+
+    Cosine scores for a batch of queries are one sparse product of the normalized query
+    matrix with the transposed document matrix; date blending and top-k selection run on
+    NumPy arrays. The arithmetic runs in a different order than SearchEngine.search, so
+    scores can differ from it in the last bits; ties are still broken by document order.
+    Build it after the engine's norms and dates are up to date, and rebuild it when
+    documents change.
+    """
+
+    def __init__(self, engine):
+        if sparse is None:
+            raise ValueError("the sparse backend needs the scipy package")
+        self.engine = engine
+        self.doc_ids = list(engine.documents)
+        rows_of = {doc_id: row for row, doc_id in enumerate(self.doc_ids)}
+        norms = np.array([engine.doc_norms[doc_id] for doc_id in self.doc_ids], dtype=np.float64)
+
+        self.term_ids = {}
+        rows, cols, tfs, idfs = [], [], [], []
+        for term in engine.index:
+            postings = engine.index[term]
+            if not postings:
+                continue
+            term_id = len(self.term_ids)
+            self.term_ids[term] = term_id
+            rows.append(np.fromiter((rows_of[doc_id] for doc_id in postings), dtype=np.int64, count=len(postings)))
+            tfs.append(np.fromiter(postings.values(), dtype=np.float64, count=len(postings)))
+            cols.append(np.full(len(postings), term_id, dtype=np.int64))
+            idfs.append(engine.idf(engine.term_df(term, postings)))
+        if rows:
+            rows, cols, tfs = np.concatenate(rows), np.concatenate(cols), np.concatenate(tfs)
+            # Same weights as search(): (1 + log10 tf) * idf, divided by the document norm
+            data = (1 + np.log10(tfs)) * np.array(idfs)[cols] / norms[rows]
+        else:
+            rows, cols, data = np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0)
+        self.matrix = sparse.csr_matrix((data, (rows, cols)), shape=(len(self.doc_ids), len(self.term_ids)))
+        self.matrix_t = self.matrix.T.tocsr()
+
+        self.date_scores = np.array([engine.date_scores[doc_id] for doc_id in self.doc_ids], dtype=np.float64)
+        self.positions = np.arange(len(self.doc_ids))
+
+    def query_matrix(self, queries):
+        """One L2-normalized TF-IDF row per query."""
+        rows, cols, data = [], [], []
+        for row, query in enumerate(queries):
+            query_vector = self.engine.query_vector(self.engine.query_tokens(query))
+            magnitude = math.sqrt(sum(weight ** 2 for weight in query_vector.values()))
+            for term, weight in query_vector.items():
+                rows.append(row)
+                cols.append(self.term_ids[term])
+                data.append(weight / magnitude)
+        return sparse.csr_matrix((data, (rows, cols)), shape=(len(queries), len(self.term_ids)))
+
+    def search_batch(self, queries, top_k=5, date_weight=0.3):
+        """Results for each query, in the same format as SearchEngine.search."""
+        top_k = max(top_k, 0)
+        content_weight = 1 - date_weight
+        date_part = date_weight * self.date_scores
+        # Documents that match no query term rank by their date score alone, best first
+        fallback = np.lexsort((self.positions, -date_part))
+        matched = np.zeros(len(self.doc_ids), dtype=bool)
+
+        results = []
+        for start in range(0, len(queries), BATCH_SIZE):
+            batch = queries[start:start + BATCH_SIZE]
+            scores = (self.query_matrix(batch) @ self.matrix_t).tocsr()
+            for row in range(len(batch)):
+                lo, hi = scores.indptr[row], scores.indptr[row + 1]
+                docs, cosine = scores.indices[lo:hi], scores.data[lo:hi]
+
+                # At most len(docs) of the best fallback documents match, so this slice has enough
+                matched[docs] = True
+                head = fallback[:len(docs) + top_k]
+                padding = head[~matched[head]][:top_k]
+                matched[docs] = False
+
+                docs = np.concatenate([docs, padding])
+                cosine = np.concatenate([cosine, np.zeros(len(padding))])
+                final = content_weight * cosine + date_part[docs]
+                order = np.lexsort((docs, -final))[:top_k]
+                results.append([self.engine.format_result(self.doc_ids[docs[i]], final[i], cosine[i],
+                                                          self.date_scores[docs[i]])
+                                for i in order])
+        return results
@@ -0,0 +1,146 @@
+import hashlib
+import os
+import sqlite3
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from pyvi import ViTokenizer
+
+# CONSTANTS
+TOKEN_CACHE = os.path.join("data", "token_cache.db")
+CHUNK_SIZE = 64  # texts per task sent to a tokenizer process
+
+def tokenize(text):
+    """pyvi word segmentation of the lowercased text; stop words are left to the caller."""
+    return ViTokenizer.tokenize(text.lower()).split()
+
+def tokenize_chunk(texts):
+    return [tokenize(text) for text in texts]
+
+def text_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+class TokenCache:
+    """Persistent pyvi output, keyed by the hash of the tokenized text."""
+
+    def __init__(self, path=TOKEN_CACHE):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS tokens (hash TEXT PRIMARY KEY, tokens TEXT)")
+        self.conn.commit()
+
+    def get_many(self, hashes):
+        found = {}
+        hashes = list(hashes)
+        # Stay under SQLite's limit on bound parameters
+        for start in range(0, len(hashes), 500):
+            batch = hashes[start:start + 500]
+            rows = self.conn.execute(
+                f"SELECT hash, tokens FROM tokens WHERE hash IN ({','.join('?' * len(batch))})", batch
+            )
+            for key, tokens in rows:
+                # pyvi joins the syllables of a word with "_", so tokens never contain spaces
+                found[key] = tokens.split(" ") if tokens else []
+        return found
+
+    def put_many(self, items):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO tokens (hash, tokens) VALUES (?, ?)",
+            ((key, " ".join(tokens)) for key, tokens in items),
+        )
+        self.conn.commit()
+
+    def retain(self, hashes):
+        """Drop cached texts that are no longer in the corpus."""
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS keep (hash TEXT PRIMARY KEY)")
+        self.conn.execute("DELETE FROM keep")
+        self.conn.executemany("INSERT OR IGNORE INTO keep (hash) VALUES (?)", ((key,) for key in hashes))
+        self.conn.execute("DELETE FROM tokens WHERE hash NOT IN (SELECT hash FROM keep)")
+        self.conn.execute("DELETE FROM keep")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+class Tokenizer:
+    """Tokenizes documents through the cache, sending the misses to a process pool in chunks."""
+
+    def __init__(self, cache=None, workers=None, chunk_size=CHUNK_SIZE):
+        self.cache = cache
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.pool = None
+        self.hashes_seen = set()
+
+    def tokenize(self, text):
+        """Tokenize one text in this process, through the cache."""
+        if self.cache is None:
+            return tokenize(text)
+        key = text_hash(text)
+        tokens = self.cache.get_many([key]).get(key)
+        if tokens is None:
+            tokens = tokenize(text)
+            self.cache.put_many([(key, tokens)])
+        return tokens
+
+    def tokenize_stream(self, items):
+        """Yield (payload, tokens) for each (text, payload), in input order.
+
+        Up to two chunks per worker are in flight, so memory stays bounded however large the
+        corpus is. Only texts missing from the cache are tokenized.
+        """
+        self.hashes_seen = set()
+        pending = deque()
+        chunk = []
+        for text, payload in items:
+            chunk.append((text, payload))
+            if len(chunk) >= self.chunk_size:
+                pending.append(self.submit(chunk))
+                chunk = []
+                if len(pending) > 2 * self.workers:
+                    yield from self.collect(*pending.popleft())
+        if chunk:
+            pending.append(self.submit(chunk))
+        while pending:
+            yield from self.collect(*pending.popleft())
+
+    def submit(self, chunk):
+        keys = [text_hash(text) for text, _ in chunk] if self.cache is not None else [None] * len(chunk)
+        cached = self.cache.get_many(keys) if self.cache is not None else {}
+        misses = [text for (text, _), key in zip(chunk, keys) if key not in cached]
+        if not misses:
+            future = None
+        elif self.workers > 1:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(max_workers=self.workers)
+            future = self.pool.submit(tokenize_chunk, misses)
+        else:
+            future = tokenize_chunk(misses)
+        return chunk, keys, cached, future
+
+    def collect(self, chunk, keys, cached, future):
+        if future is None:
+            tokenized = iter(())
+        else:
+            tokenized = iter(future if isinstance(future, list) else future.result())
+        new_tokens = []
+        for (text, payload), key in zip(chunk, keys):
+            tokens = cached.get(key) if key is not None else None
+            if tokens is None:
+                tokens = next(tokenized)
+                new_tokens.append((key, tokens))
+            self.hashes_seen.add(key)
+            yield payload, tokens
+        if self.cache is not None and new_tokens:
+            self.cache.put_many(new_tokens)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        if self.cache is not None:
+            self.cache.close()